@@ -0,0 +1,143 @@
+import os
+
+import backtrader as bt
+import numpy as np
+import pandas as pd
+
+# date.toordinal() of 1970-01-01, backtrader datetimes are ordinal days
+EPOCH_ORDINAL = 719163
+
+
+def num2index(nums):
+    """ Converts an array of backtrader float datetimes to a DatetimeIndex,
+    truncating microseconds the same way as backtrader's num2date
+    """
+    nums = np.asarray(nums, dtype=np.float64)
+    days = np.floor(nums)
+    micros = np.floor((nums - days) * 86400e6).astype('int64')
+    micros -= np.where(micros % 1000000 < 10, micros % 1000000, 0)
+    micros += (days.astype('int64') - EPOCH_ORDINAL) * 86400000000
+    return pd.DatetimeIndex(pd.to_datetime(micros, unit='us'))
+
+
+def read_rows(path, columns):
+    """ Return (n, columns) read-only memmap of a file of float64 rows
+    """
+    if not os.path.getsize(path):
+        return np.empty((0, columns))
+    return np.memmap(path, dtype=np.float64, mode='r').reshape(-1, columns)
+
+
+class EquityRecorder(bt.Analyzer):
+    """ Records datetime, broker value, cash and data open for every bar
+
+    Values are written into preallocated NumPy arrays, sized from the
+    preloaded data length when known and grown geometrically otherwise.
+    Unlike observers.Broker it works with any feed class and does not need
+    full line buffers, so it also works with exactbars memory saving.
+
+    With a ``path`` the rows are written to that file instead, ``size``
+    rows at a time (float64, one row of COLUMNS per bar), so memory stays
+    the same however long the run. The results are then columns of a
+    read-only memmap of the file.
+    """
+    params = (
+        ('size', 0),  # initial capacity, 0 derives it from the data
+        ('growth', 2.0),  # capacity factor when the arrays are full
+        ('path', None),  # file to stream the rows to
+    )
+
+    COLUMNS = ('datetime', 'value', 'cash', 'open')
+
+    def start(self):
+        if self.p.path:
+            size = self.p.size or 65536
+            self._file = open(self.p.path, 'wb')
+        else:
+            size = self.p.size or max(self.data.buflen(), 1024)
+        self.arrays = {col: np.empty(size) for col in self.COLUMNS}
+        self.length = 0
+        self.written = 0
+
+    def _flush(self):
+        block = np.column_stack([self.arrays[col][:self.length]
+                                 for col in self.COLUMNS])
+        block.tofile(self._file)
+        self.written += self.length
+        self.length = 0
+
+    def _grow(self):
+        size = int(len(self.arrays['value']) * self.p.growth) + 1
+        for col, array in self.arrays.items():
+            grown = np.empty(size)
+            grown[:self.length] = array[:self.length]
+            self.arrays[col] = grown
+
+    def next(self):
+        i = self.length
+        if i == len(self.arrays['value']):
+            if self.p.path:
+                self._flush()
+                i = 0
+            else:
+                self._grow()
+        arrays = self.arrays
+        broker = self.strategy.broker
+        arrays['datetime'][i] = self.data.datetime[0]
+        arrays['value'][i] = broker.getvalue()
+        arrays['cash'][i] = broker.getcash()
+        arrays['open'][i] = self.data.open[0]
+        self.length = i + 1
+
+    def stop(self):
+        if self.p.path:
+            self._flush()
+            self._file.close()
+            rows = read_rows(self.p.path, len(self.COLUMNS))
+            for i, col in enumerate(self.COLUMNS):
+                self.rets[col] = rows[:, i]
+            return
+        for col, array in self.arrays.items():
+            self.rets[col] = array[:self.length]
+
+    def get_dataframe(self):
+        """ Return recorded columns as DataFrame indexed by datetime
+        """
+        rets = self.get_analysis()
+        index = num2index(rets['datetime'])
+        cols = [col for col in self.COLUMNS if col != 'datetime']
+        return pd.DataFrame({col: rets[col] for col in cols},
+                            index=index, columns=cols)
+
+
+class TradeRecorder(bt.Analyzer):
+    """ Records (close datetime, pnl, pnl net of commission) of every
+    closed trade and counts the opened ones
+
+    With a ``path`` closed trades are appended to that file as float64
+    rows instead, ``closed`` is then a (trades, 3) memmap of it.
+    """
+    params = (
+        ('path', None),  # file to stream the closed trades to
+    )
+
+    def start(self):
+        self.rets['closed'] = []
+        self.rets['opened'] = 0
+        if self.p.path:
+            self._file = open(self.p.path, 'wb')
+
+    def notify_trade(self, trade):
+        if trade.justopened:
+            self.rets['opened'] += 1
+        elif trade.isclosed:
+            row = (trade.dtclose, trade.pnl, trade.pnlcomm)
+            if self.p.path:
+                np.array(row).tofile(self._file)
+            else:
+                self.rets['closed'].append(row)
+
+    def stop(self):
+        if self.p.path:
+            self._file.close()
+            self.rets['closed'] = read_rows(self.p.path, 3)
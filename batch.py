@@ -0,0 +1,328 @@
+"""Run one strategy over a universe of OHLCV files
+
+    python batch.py 'data/*.csv' --strategy sma_multi:SMAStrategy \
+        --param sma_period='(10, 20)' --workers 8
+
+Every file given as a directory (its *.csv files) or glob is parsed once,
+in parallel, and the bars of all assets are written one after the other
+into a single optimize.SharedOHLCV segment. Each asset is then a run on
+its start/stop slice of that segment through a GridRunner, so the workers
+map the bars instead of parsing or receiving them. Progress and
+throughput go to stderr while the runs come in, the per-asset KPIs are
+printed as one table and optionally written to CSV. An asset's symbol is
+its file name, with its directory when the files come from several.
+"""
+import argparse
+import ast
+import csv
+import datetime
+import glob
+import multiprocessing
+import os
+import sys
+import time
+import traceback
+
+import backtrader as bt
+import numpy as np
+
+from analyzers import EquityRecorder, TradeRecorder
+from distributed import load_strategy
+from feeds import load_feed_arrays
+from optimize import GridRunner, SharedOHLCV, strategy_metrics
+from replay import max_drawdown
+
+BATCH_ANALYZERS = ((EquityRecorder, {'_name': 'batchEquity'}),
+                   (TradeRecorder, {'_name': 'batchTrades'}))
+
+KPI_COLUMNS = ('symbol', 'bars', 'first', 'last', 'final_value',
+               'return_pct', 'buyhold_pct', 'max_drawdown_pct', 'trades',
+               'win_pct', 'status')
+
+
+def find_files(paths):
+    """ Return sorted list of the files of directories (*.csv) and globs
+    """
+    files = set()
+    for path in paths:
+        if os.path.isdir(path):
+            path = os.path.join(path, '*.csv')
+        files.update(p for p in glob.glob(path) if os.path.isfile(p))
+    return sorted(files)
+
+
+def symbols_of(files):
+    """ Return {path: symbol} of files, a symbol being the path relative to
+    the directory common to all of them without extension, e.g. BTC for
+    files of one directory, binance/BTC and kraken/BTC otherwise
+    """
+    if not files:
+        return {}
+    paths = [os.path.abspath(path) for path in files]
+    common = os.path.commonpath([os.path.dirname(path) for path in paths])
+    symbols = {}
+    seen = {}
+    for path, abspath in zip(files, paths):
+        symbol = os.path.splitext(os.path.relpath(abspath, common))[0]
+        if symbol in seen:
+            raise ValueError('{} and {} would both be symbol {}'.format(
+                seen[symbol], path, symbol))
+        seen[symbol] = path
+        symbols[path] = symbol
+    return symbols
+
+
+def _load(task):
+    """ Pool entry point, parses one file into a (7, n) bars array
+    """
+    path, feed, feedkw = task
+    try:
+        data = feed(dataname=path, **feedkw)
+        return path, load_feed_arrays(data), (data._timeframe,
+                                              data._compression), None
+    except Exception:
+        return path, None, None, traceback.format_exc(limit=3)
+
+
+def asset_metrics(strat):
+    """ KPIs of one asset run, plus the strategy's own metrics
+    """
+    metrics = strategy_metrics(strat)
+    equity = strat.analyzers.batchEquity.get_analysis()
+    closed = strat.analyzers.batchTrades.get_analysis()['closed']
+    values = equity['value']
+    start = strat.broker.startingcash
+    metrics.update({
+        'first': bt.num2date(equity['datetime'][0]).date().isoformat(),
+        'last': bt.num2date(equity['datetime'][-1]).date().isoformat(),
+        'return_pct': 100.0 * (metrics['final_value'] / start - 1.0),
+        'buyhold_pct': 100.0 * (strat.data.close[0] / equity['open'][0]
+                                - 1.0),
+        'max_drawdown_pct': max_drawdown(values),
+        'trades': len(closed),
+        'win_pct': (100.0 * sum(1 for _, _, pnl in closed if pnl > 0)
+                    / len(closed) if closed else None),
+    })
+    return metrics
+
+
+class Universe:
+    """ Bars of many assets in one SharedOHLCV, ``slices`` maps each
+    symbol to its (start, stop) bars, ``errors`` the files that failed to
+    parse to their traceback
+    """
+
+    def __init__(self, ohlcv, slices, errors):
+        self.ohlcv = ohlcv
+        self.slices = slices
+        self.errors = errors
+
+    @classmethod
+    def load(cls, files, feed=bt.feeds.YahooFinanceCSVData, workers=None,
+             shmdir=None, **feedkw):
+        """ Parses files with feed(dataname=path, **feedkw) in a process
+        pool and shares the bars of all of them
+        """
+        symbols = symbols_of(files)
+        tasks = [(path, feed, feedkw) for path in files]
+        with multiprocessing.Pool(workers) as pool:
+            loaded = pool.map(_load, tasks, chunksize=4)
+        parts, slices, errors = [], {}, {}
+        frame = None
+        offset = 0
+        for path, arrays, timeframe, error in loaded:
+            symbol = symbols[path]
+            if error is not None:
+                errors[symbol] = error
+                continue
+            if not arrays.shape[1]:
+                errors[symbol] = 'no bars'
+                continue
+            if frame is None:
+                frame = timeframe
+            elif timeframe != frame:
+                errors[symbol] = 'timeframe {} differs from {}'.format(
+                    timeframe, frame)
+                continue
+            parts.append(arrays)
+            slices[symbol] = (offset, offset + arrays.shape[1])
+            offset += arrays.shape[1]
+        if not parts:
+            raise ValueError('no bars loaded from {} files'.format(
+                len(files)))
+        ohlcv = SharedOHLCV.create(np.concatenate(parts, axis=1), *frame,
+                                   shmdir=shmdir)
+        return cls(ohlcv, slices, errors)
+
+    def close(self):
+        self.ohlcv.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class BatchRunner(GridRunner):
+    """ Runs a strategy with one params dict over every asset of a
+    Universe, reporting progress to ``progress`` (a stream, None for
+    quiet). Other arguments like GridRunner, whose chunks default to one
+    asset here.
+    """
+
+    def __init__(self, strategy, universe, params=None, progress=sys.stderr,
+                 chunksize=1, **settings):
+        settings.setdefault('analyzers', BATCH_ANALYZERS)
+        settings.setdefault('metrics', asset_metrics)
+        super().__init__(strategy, universe.ohlcv, chunksize=chunksize,
+                         errors='record', **settings)
+        self.universe = universe
+        self.params = params or {}
+        self.progress = progress
+
+    def _consume(self, results, records):
+        done = bars = 0
+        total = len(records)
+        begin = time.perf_counter()
+        for chunk in results:
+            super()._consume([chunk], records)
+            done += len(chunk)
+            bars += sum(record.get('bars', 0) for _, record in chunk)
+            if self.progress is not None:
+                elapsed = max(time.perf_counter() - begin, 1e-9)
+                self.progress.write(
+                    '\r{:>6}/{} assets {:>7.1f} assets/s {:>10.0f} bars/s '
+                    'eta {:>5.0f}s'.format(
+                        done, total, done / elapsed, bars / elapsed,
+                        (total - done) * elapsed / done))
+                self.progress.flush()
+        if self.progress is not None:
+            self.progress.write('\n')
+
+    def run_assets(self):
+        """ Return list of one KPI record per asset, symbol order
+        """
+        symbols = sorted(self.universe.slices)
+        runs = [(self.params, {'start': start, 'stop': stop})
+                for start, stop in (self.universe.slices[symbol]
+                                    for symbol in symbols)]
+        records = self.run_many(runs)
+        for symbol, record in zip(symbols, records):
+            record['symbol'] = symbol
+        for symbol, error in sorted(self.universe.errors.items()):
+            records.append({'symbol': symbol, 'params': self.params,
+                            'status': 'error', 'error': error})
+        return records
+
+
+def format_table(records, sort='return_pct', top=None):
+    """ Return KPI table of the records, best ``sort`` first
+    """
+    def key(record):
+        value = record.get(sort)
+        return (value is None or value != value, -(value or 0))
+
+    lines = ["{:<12} {:>6} {:>10} {:>10} {:>14} {:>9} {:>9} {:>7} {:>6} "
+             "{:>6}  {}".format('symbol', 'bars', 'first', 'last',
+                                'final_value', 'return%', 'b&h%', 'maxdd%',
+                                'trades', 'win%', 'status')]
+    ok = sorted((r for r in records if r['status'] != 'error'), key=key)
+    for record in ok[:top]:
+        lines.append(
+            "{:<12} {:>6} {:>10} {:>10} {:>14.2f} {:>9.2f} {:>9.2f} "
+            "{:>7.2f} {:>6} {:>6}  {}".format(
+                record['symbol'][:12], record['bars'], record['first'],
+                record['last'], record['final_value'], record['return_pct'],
+                record['buyhold_pct'], record['max_drawdown_pct'],
+                record['trades'],
+                '-' if record['win_pct'] is None else
+                '{:.1f}'.format(record['win_pct']), record['status']))
+    for record in records:
+        if record['status'] == 'error':
+            lines.append("{:<12} {:>6}  error: {}".format(
+                record['symbol'][:12], '-',
+                record['error'].strip().splitlines()[-1]))
+    return '\n'.join(lines)
+
+
+def write_csv(records, path):
+    with open(path, 'w', newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=KPI_COLUMNS + ('params',),
+                                extrasaction='ignore')
+        writer.writeheader()
+        for record in records:
+            writer.writerow(record)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description='Run a strategy over a universe of OHLCV files')
+    parser.add_argument('paths', nargs='+',
+                        help='Directories (their *.csv) or globs of Yahoo '
+                             'format CSV files')
+    parser.add_argument('--strategy', default='sma_multi:SMAStrategy',
+                        help='Strategy as module:Class')
+    parser.add_argument('--param', action='append', default=[],
+                        metavar='NAME=VALUE',
+                        help='Strategy param, VALUE a Python literal')
+    parser.add_argument('--fromdate', default=None,
+                        help='Starting date in YYYY-MM-DD format')
+    parser.add_argument('--todate', default=None,
+                        help='Ending date in YYYY-MM-DD format')
+    parser.add_argument('--cash', type=float, default=100000.0,
+                        help='Cash to start with')
+    parser.add_argument('--commission', type=float, default=0.0,
+                        help='Commission, 0.001 -> 0.1%%')
+    parser.add_argument('--workers', type=int, default=None,
+                        help='Worker processes, defaults to the cpu count')
+    parser.add_argument('--sort', default='return_pct',
+                        help='KPI column to sort the table by')
+    parser.add_argument('--top', type=int, default=None,
+                        help='Only print the TOP best assets')
+    parser.add_argument('--csv', default=None, metavar='PATH',
+                        help='Write the KPIs of all assets to PATH')
+    parser.add_argument('--quiet', action='store_true',
+                        help='No progress output')
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    args = parse_args()
+    strategy = load_strategy(args.strategy.split(':'))
+    params = {}
+    for item in args.param:
+        name, _, value = item.partition('=')
+        params[name] = ast.literal_eval(value)
+    feedkw = {}
+    if args.fromdate:
+        feedkw['fromdate'] = datetime.datetime.strptime(args.fromdate,
+                                                        '%Y-%m-%d')
+    if args.todate:
+        feedkw['todate'] = datetime.datetime.strptime(args.todate,
+                                                      '%Y-%m-%d')
+    files = find_files(args.paths)
+    if not files:
+        sys.exit('no files match {}'.format(' '.join(args.paths)))
+
+    begin = time.perf_counter()
+    universe = Universe.load(files, workers=args.workers, **feedkw)
+    load_time = time.perf_counter() - begin
+    with universe:
+        nbars = len(universe.ohlcv)
+        print("Loaded {} assets, {} bars in {:.2f}s ({} failed)".format(
+            len(universe.slices), nbars, load_time, len(universe.errors)))
+        runner = BatchRunner(strategy, universe, params=params,
+                             progress=None if args.quiet else sys.stderr,
+                             workers=args.workers, cash=args.cash,
+                             commission=args.commission)
+        records = runner.run_assets()
+    print(format_table(records, sort=args.sort, top=args.top))
+    print("{} assets in {:.2f}s: {:.1f} assets/s, {:.0f} bars/s on {} "
+          "workers".format(len(universe.slices), runner.wall_time,
+                           len(universe.slices) / max(runner.wall_time, 1e-9),
+                           nbars / max(runner.wall_time, 1e-9),
+                           runner.workers))
+    if args.csv:
+        write_csv(records, args.csv)
+        print("KPIs written to {}".format(args.csv))
@@ -0,0 +1,86 @@
+"""Per-bar overhead of the report analyzers on BTC-USD.csv
+
+Runs SMAStrategy once without analyzers and once per report analyzer, then
+once per report.Cerebro analyzer profile, and prints the extra microseconds
+each one costs per bar. This is what every run of a sweep pays for them.
+
+    python bench_analyzers.py [--repeat 5] [--data BTC-USD.csv]
+"""
+import argparse
+import os
+import sys
+import time
+
+import backtrader as bt
+
+from report import Cerebro, ANALYZER_PROFILES
+from sma_multi import SMAStrategy
+
+ANALYZERS = (
+    ('SharpeRatio', bt.analyzers.SharpeRatio,
+     dict(timeframe=bt.TimeFrame.Months, riskfreerate=0.01)),
+    ('DrawDown', bt.analyzers.DrawDown, dict()),
+    ('AnnualReturn', bt.analyzers.AnnualReturn, dict()),
+    ('TradeAnalyzer', bt.analyzers.TradeAnalyzer, dict()),
+    ('SQN', bt.analyzers.SQN, dict()),
+)
+
+
+def parse_args():
+    modpath = os.path.dirname(os.path.abspath(sys.argv[0]))
+    parser = argparse.ArgumentParser(
+        description='Per-bar overhead of the report analyzers')
+    parser.add_argument('--data', default=os.path.join(modpath, 'BTC-USD.csv'),
+                        help='Yahoo style OHLCV csv file')
+    parser.add_argument('--repeat', type=int, default=5,
+                        help='Runs per case, the fastest one is kept')
+    return parser.parse_args()
+
+
+def time_run(make_cerebro, datapath, repeat):
+    """ Return (best wall time, bars) of running a cerebro ``repeat`` times
+    """
+    best = float('inf')
+    bars = 0
+    for _ in range(repeat):
+        cerebro = make_cerebro()
+        data = bt.feeds.YahooFinanceCSVData(dataname=datapath, reverse=False)
+        cerebro.adddata(data)
+        cerebro.addstrategy(SMAStrategy, sma_period=(10, 20))
+        cerebro.broker.setcash(100000.0)
+        start = time.perf_counter()
+        cerebro.run()
+        best = min(best, time.perf_counter() - start)
+        bars = len(data)
+    return best, bars
+
+
+def main():
+    args = parse_args()
+    time_run(bt.Cerebro, args.data, 1)  # warm up imports and file cache
+    baseline, bars = time_run(bt.Cerebro, args.data, args.repeat)
+    print("Bars: {}, baseline run: {:.3f}s ({:.1f} us/bar)".format(
+        bars, baseline, 1e6 * baseline / bars))
+    print("{:<22} {:>10} {:>14}".format('case', 'run (s)', 'extra us/bar'))
+
+    def with_analyzer(ancls, ankwargs):
+        def make_cerebro():
+            cerebro = bt.Cerebro()
+            cerebro.addanalyzer(ancls, **ankwargs)
+            return cerebro
+        return make_cerebro
+
+    cases = [(name, with_analyzer(ancls, ankwargs))
+             for name, ancls, ankwargs in ANALYZERS]
+    cases.extend(('profile {}'.format(profile),
+                  lambda profile=profile: Cerebro(analyzers=profile))
+                 for profile in ANALYZER_PROFILES)
+
+    for name, make_cerebro in cases:
+        elapsed, _ = time_run(make_cerebro, args.data, args.repeat)
+        extra = 1e6 * (elapsed - baseline) / bars
+        print("{:<22} {:>10.3f} {:>14.2f}".format(name, elapsed, extra))
+
+
+if __name__ == '__main__':
+    main()
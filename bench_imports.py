@@ -0,0 +1,137 @@
+"""Cold-start import time of the entry points
+
+Imports every entry point module in a fresh ``python -X importtime``
+interpreter and prints its cumulative import time, the slowest modules
+it pulls in and whether it loaded one of the HEAVY modules, which only
+plotting, PDF rendering and the spline/regression paths should load, on
+first use. Exits with status 1 when an entry point imports a heavy module,
+takes longer than its budget or, with --baseline, regressed by more than
+--tolerance over a results file written by --json.
+
+    python bench_imports.py [--repeat 5] [--json imports.json]
+    python bench_imports.py --baseline imports.json --tolerance 0.25
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+
+HEAVY = ('matplotlib.pyplot', 'scipy', 'jinja2', 'weasyprint')
+
+# entry point module -> import time budget in ms
+ENTRY_POINTS = {
+    'sma_multi': 1500,
+    'macd': 1500,
+    'rsi': 1000,
+    'rsi_divergence': 1500,
+    'turtle': 1000,
+    'example': 1500,
+    'optimize': 1000,
+    'batch': 1500,
+    'replay': 1500,
+    'tickbars': 1000,
+    'livefeed': 1000,
+    'report': 1500,
+}
+
+
+def parse_importtime(stderr):
+    """ Return {module: (self us, cumulative us)} of -X importtime output
+    """
+    times = {}
+    for line in stderr.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        selftime, cumulative, name = line[len('import time:'):].split('|')
+        times[name.strip()] = (int(selftime), int(cumulative))
+    return times
+
+
+def import_times(module, cwd):
+    """ Return {module: (self us, cumulative us)} of importing module in a
+    new interpreter
+    """
+    proc = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', 'import ' + module],
+        cwd=cwd, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE,
+        universal_newlines=True)
+    if proc.returncode:
+        raise RuntimeError('import {} failed:\n{}'.format(
+            module, proc.stderr[-2000:]))
+    return parse_importtime(proc.stderr)
+
+
+def measure(module, repeat, cwd):
+    """ Return result dict of the fastest of ``repeat`` imports
+    """
+    best = None
+    for _ in range(repeat):
+        times = import_times(module, cwd)
+        if best is None or times[module][1] < best[module][1]:
+            best = times
+    heavy = sorted(name for name in best
+                   if any(name == h or name.startswith(h + '.')
+                          for h in HEAVY))
+    slowest = sorted(best.items(), key=lambda item: -item[1][0])[:5]
+    return {'ms': best[module][1] / 1000.0,
+            'modules': len(best),
+            'heavy': heavy,
+            'slowest': [(name, selftime / 1000.0)
+                        for name, (selftime, _) in slowest]}
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description='Cold-start import time of the entry points')
+    parser.add_argument('modules', nargs='*',
+                        help='Entry points to measure, default all')
+    parser.add_argument('--repeat', type=int, default=3,
+                        help='Imports per entry point, the fastest is kept')
+    parser.add_argument('--json', default=None, metavar='PATH',
+                        help='Write the results to PATH')
+    parser.add_argument('--baseline', default=None, metavar='PATH',
+                        help='Compare with results written by --json')
+    parser.add_argument('--tolerance', type=float, default=0.25,
+                        help='With --baseline, allowed slowdown fraction')
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    cwd = os.path.dirname(os.path.abspath(__file__))
+    baseline = {}
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+    results = {}
+    failures = []
+    print("{:<16} {:>9} {:>8}  {}".format('entry point', 'ms', 'modules',
+                                          'slowest (self ms)'))
+    for module in args.modules or list(ENTRY_POINTS):
+        result = results[module] = measure(module, args.repeat, cwd)
+        print("{:<16} {:>9.1f} {:>8}  {}".format(
+            module, result['ms'], result['modules'],
+            ', '.join('{} {:.0f}'.format(name, ms)
+                      for name, ms in result['slowest'][:3])))
+        if result['heavy']:
+            failures.append('{} imports {}'.format(
+                module, ', '.join(result['heavy'])))
+        budget = ENTRY_POINTS.get(module)
+        if budget is not None and result['ms'] > budget:
+            failures.append('{} takes {:.0f}ms, budget {}ms'.format(
+                module, result['ms'], budget))
+        before = baseline.get(module)
+        if before and result['ms'] > before['ms'] * (1 + args.tolerance):
+            failures.append('{} takes {:.0f}ms, was {:.0f}ms'.format(
+                module, result['ms'], before['ms']))
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2)
+    for failure in failures:
+        print('FAIL ' + failure)
+    return 1 if failures else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,319 @@
+"""End-to-end throughput of the strategies of this repo
+
+Runs every strategy on BTC-USD.csv and on synthetic.py minute bars of a
+fixed seed (100k, 1M and 10M of them), in runonce and in next mode,
+without and with the report analyzers (report.Cerebro's 'full' profile),
+and reports for each case:
+
+- startup: seconds from spawning the process to a ready Cerebro, that is
+  interpreter start plus imports plus strategy setup
+- bars/sec of cerebro.run(), the bars coming from feeds.ArrayData so CSV
+  parsing and data generation (load_s) are left out
+- the peak RSS of the process
+- the final broker value, a change of it means the results changed
+
+Every case runs in its own process, ``--repeat`` times, keeping the best
+of each measure. The results are written as JSON, with the commit and
+versions they were measured on, and compare flags regressions between
+two results files:
+
+    python bench_strategies.py run --json HEAD.json \
+        [--strategies sma macd] [--datasets btc 100k] [--repeat 3]
+    python bench_strategies.py compare base.json HEAD.json [--tolerance 0.1]
+
+The 10M bar cases take minutes each and GBs of memory in runonce mode.
+"""
+import argparse
+import datetime
+import importlib
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+
+# name -> (module, class, params)
+STRATEGIES = {
+    'crossover': ('example', 'CrossOver', {}),
+    'rsi': ('rsi', 'RSIStrategy', {}),
+    'rsi_divergence': ('rsi_divergence', 'RSIStrategy', {}),
+    'sma': ('sma_multi', 'SMAStrategy', {'sma_period': (10, 20)}),
+    'turtle': ('turtle', 'Strategy', {}),
+    'macd': ('macd', 'TheStrategy', {}),
+}
+
+# name -> synthetic bars, None for BTC-USD.csv
+DATASETS = {
+    'btc': None,
+    '100k': 100000,
+    '1m': 1000000,
+    '10m': 10000000,
+}
+
+MODES = ('runonce', 'next')
+ANALYZERS = ('none', 'report')
+SEED = 42
+MEASURES = ('startup_s', 'bars_per_sec', 'peak_rss_mb')
+
+
+def load_dataset(name, datapath):
+    """ Return (bars array, timeframe, compression) of a dataset
+    """
+    import backtrader as bt
+    from feeds import load_feed_arrays
+    from synthetic import SyntheticOHLCV
+
+    size = DATASETS[name]
+    if size is None:
+        data = bt.feeds.YahooFinanceCSVData(dataname=datapath, reverse=False)
+        return load_feed_arrays(data), bt.TimeFrame.Days, 1
+    synthetic = SyntheticOHLCV(size, timeframe='1m', seed=SEED)
+    return synthetic.array(), synthetic.frame, synthetic.compression
+
+
+def run_case(strategy, dataset, mode, analyzers, datapath, spawned):
+    """ Runs one case in this process, return its result dict
+    """
+    import backtrader as bt
+    from feeds import ArrayData
+    from profiling import peak_rss
+
+    module, clsname, params = STRATEGIES[strategy]
+    stratcls = getattr(importlib.import_module(module), clsname)
+    if analyzers == 'report':
+        from report import Cerebro
+        cerebro = Cerebro(analyzers='full')
+    else:
+        cerebro = bt.Cerebro()
+    cerebro.addstrategy(stratcls, **params)
+    cerebro.broker.setcash(100000.0)
+    startup = time.time() - spawned
+
+    begin = time.perf_counter()
+    bars, timeframe, compression = load_dataset(dataset, datapath)
+    cerebro.adddata(ArrayData(dataname=bars, timeframe=timeframe,
+                              compression=compression))
+    load = time.perf_counter() - begin
+
+    with open(os.devnull, 'w') as devnull:
+        stdout, sys.stdout = sys.stdout, devnull  # strategies print trades
+        try:
+            begin = time.perf_counter()
+            cerebro.run(runonce=mode == 'runonce')
+            elapsed = time.perf_counter() - begin
+        finally:
+            sys.stdout = stdout
+    nbars = bars.shape[1]
+    return {'strategy': strategy, 'dataset': dataset, 'mode': mode,
+            'analyzers': analyzers, 'status': 'ok', 'bars': nbars,
+            'startup_s': startup, 'load_s': load, 'run_s': elapsed,
+            'bars_per_sec': nbars / elapsed,
+            'peak_rss_mb': peak_rss() / 2**20,
+            'final_value': cerebro.broker.getvalue()}
+
+
+def spawn_case(strategy, dataset, mode, analyzers, datapath, timeout):
+    """ Runs one case in a new process, return its result dict
+    """
+    spawned = time.time()
+    cmd = [sys.executable, os.path.abspath(__file__), 'case', strategy,
+           dataset, mode, analyzers, '--data', datapath,
+           '--spawned', repr(spawned)]
+    try:
+        proc = subprocess.run(cmd, stdout=subprocess.PIPE,
+                              stderr=subprocess.PIPE, timeout=timeout,
+                              universal_newlines=True)
+    except subprocess.TimeoutExpired:
+        error = 'timed out after {}s'.format(timeout)
+    else:
+        if proc.returncode == 0:
+            return json.loads(proc.stdout.splitlines()[-1])
+        error = proc.stderr.strip().splitlines()[-1] if proc.stderr else \
+            'exit status {}'.format(proc.returncode)
+    return {'strategy': strategy, 'dataset': dataset, 'mode': mode,
+            'analyzers': analyzers, 'status': 'error', 'error': error}
+
+
+def best_of(results):
+    """ Return result combining the best of each measure of repeated runs
+    """
+    ok = [result for result in results if result['status'] == 'ok']
+    if not ok:
+        return results[-1]
+    best = dict(min(ok, key=lambda result: result['run_s']))
+    best['startup_s'] = min(result['startup_s'] for result in ok)
+    best['peak_rss_mb'] = min(result['peak_rss_mb'] for result in ok)
+    best['load_s'] = min(result['load_s'] for result in ok)
+    return best
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(
+            ['git', 'rev-parse', 'HEAD'], stderr=subprocess.DEVNULL,
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+            universal_newlines=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def environment():
+    import backtrader as bt
+    import numpy as np
+    return {'commit': git_commit(),
+            'date': datetime.datetime.now().isoformat(timespec='seconds'),
+            'python': platform.python_version(),
+            'backtrader': bt.__version__,
+            'numpy': np.__version__,
+            'platform': platform.platform(),
+            'cpus': os.cpu_count()}
+
+
+def case_key(result):
+    return (result['strategy'], result['dataset'], result['mode'],
+            result['analyzers'])
+
+
+def format_results(results):
+    lines = ["{:<15} {:>7} {:>8} {:>9} {:>9} {:>8} {:>12} {:>9}  {}".format(
+        'strategy', 'dataset', 'mode', 'analyzers', 'bars', 'startup',
+        'bars/sec', 'peak MB', 'final value')]
+    for result in results:
+        if result['status'] != 'ok':
+            lines.append("{:<15} {:>7} {:>8} {:>9}  error: {}".format(
+                *case_key(result), result['error']))
+            continue
+        lines.append(
+            "{:<15} {:>7} {:>8} {:>9} {:>9} {:>7.2f}s {:>12.0f} {:>9.1f}  "
+            "{:.2f}".format(*case_key(result), result['bars'],
+                            result['startup_s'], result['bars_per_sec'],
+                            result['peak_rss_mb'], result['final_value']))
+    return '\n'.join(lines)
+
+
+def compare(base, head, tolerance):
+    """ Return (lines, regressions) comparing the cases of two results
+    files, a regression is a measure worse by more than ``tolerance``
+    (fraction) or a changed final value
+    """
+    before = {case_key(result): result for result in base['results']}
+    lines = ["{} -> {}".format(base['environment'].get('commit'),
+                               head['environment'].get('commit')),
+             "{:<15} {:>7} {:>8} {:>9} {:>10} {:>10} {:>10}  {}".format(
+                 'strategy', 'dataset', 'mode', 'analyzers', 'startup',
+                 'bars/sec', 'peak MB', 'flags')]
+    regressions = 0
+    for result in head['results']:
+        old = before.get(case_key(result))
+        if old is None or result['status'] != 'ok' or old['status'] != 'ok':
+            continue
+        changes, flags = [], []
+        for measure in MEASURES:
+            change = result[measure] / old[measure] - 1.0
+            changes.append(change)
+            # bars/sec is better higher, the others lower
+            worse = -change if measure == 'bars_per_sec' else change
+            if worse > tolerance:
+                flags.append(measure)
+        if result['final_value'] != old['final_value']:
+            flags.append('final_value {:.2f} -> {:.2f}'.format(
+                old['final_value'], result['final_value']))
+        regressions += bool(flags)
+        lines.append("{:<15} {:>7} {:>8} {:>9} {:>+9.1%} {:>+9.1%} "
+                     "{:>+9.1%}  {}".format(*case_key(result), *changes,
+                                            ', '.join(flags)))
+    for result in head['results']:
+        old = before.get(case_key(result))
+        if result['status'] != 'ok' and old and old['status'] == 'ok':
+            regressions += 1
+            lines.append("{:<15} {:>7} {:>8} {:>9}  now fails: {}".format(
+                *case_key(result), result['error']))
+    return lines, regressions
+
+
+def parse_args():
+    modpath = os.path.dirname(os.path.abspath(__file__))
+    parser = argparse.ArgumentParser(
+        description='End-to-end throughput of the strategies')
+    sub = parser.add_subparsers(dest='command')
+    run = sub.add_parser('run', help='Run the benchmark cases')
+    run.add_argument('--strategies', nargs='+', choices=list(STRATEGIES),
+                     default=list(STRATEGIES))
+    run.add_argument('--datasets', nargs='+', choices=list(DATASETS),
+                     default=list(DATASETS))
+    run.add_argument('--modes', nargs='+', choices=MODES,
+                     default=list(MODES))
+    run.add_argument('--analyzers', nargs='+', choices=ANALYZERS,
+                     default=list(ANALYZERS))
+    run.add_argument('--repeat', type=int, default=3,
+                     help='Runs per case, the best of each measure is kept')
+    run.add_argument('--timeout', type=float, default=None,
+                     help='Seconds a case may take')
+    run.add_argument('--json', default=None, metavar='PATH',
+                     help='Write the results to PATH')
+    case = sub.add_parser('case', help='Run one case in this process')
+    for subparser in (run, case):
+        subparser.add_argument(
+            '--data', default=os.path.join(modpath, 'BTC-USD.csv'),
+            help='Yahoo style OHLCV csv file of the btc dataset')
+    case.add_argument('strategy', choices=list(STRATEGIES))
+    case.add_argument('dataset', choices=list(DATASETS))
+    case.add_argument('mode', choices=MODES)
+    case.add_argument('analyzers', choices=ANALYZERS)
+    case.add_argument('--spawned', type=float, default=None,
+                      help='time.time() the process was spawned at')
+    comp = sub.add_parser('compare', help='Flag regressions between two '
+                                          'results files')
+    comp.add_argument('base')
+    comp.add_argument('head')
+    comp.add_argument('--tolerance', type=float, default=0.10,
+                      help='Allowed fraction a measure may worsen by')
+    args = parser.parse_args()
+    if args.command is None:
+        parser.error('a command is required')
+    return args
+
+
+def main():
+    args = parse_args()
+    if args.command == 'case':
+        spawned = time.time() if args.spawned is None else args.spawned
+        result = run_case(args.strategy, args.dataset, args.mode,
+                          args.analyzers, args.data, spawned)
+        print(json.dumps(result))
+        return 0
+    if args.command == 'compare':
+        with open(args.base) as f:
+            base = json.load(f)
+        with open(args.head) as f:
+            head = json.load(f)
+        lines, regressions = compare(base, head, args.tolerance)
+        print('\n'.join(lines))
+        print("{} regressions".format(regressions))
+        return 1 if regressions else 0
+
+    results = []
+    for dataset in args.datasets:
+        for strategy in args.strategies:
+            for mode in args.modes:
+                for analyzers in args.analyzers:
+                    result = best_of([
+                        spawn_case(strategy, dataset, mode, analyzers,
+                                   args.data, args.timeout)
+                        for _ in range(args.repeat)])
+                    results.append(result)
+                    print(format_results([result]).splitlines()[-1],
+                          flush=True)
+    print()
+    print(format_results(results))
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump({'environment': environment(), 'results': results},
+                      f, indent=2)
+        print("Results written to {}".format(args.json))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
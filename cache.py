@@ -0,0 +1,255 @@
+import hashlib
+import inspect
+import json
+import os
+import shutil
+import sys
+import types
+
+import numpy as np
+import pandas as pd
+
+_file_hashes = {}  # (path, size, mtime) -> sha256, avoids rehashing data
+REPO_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+def file_hash(path, blocksize=1 << 20):
+    """ Return sha256 hex digest of a file's content
+    """
+    st = os.stat(path)
+    memo = (os.path.abspath(path), st.st_size, st.st_mtime_ns)
+    if memo not in _file_hashes:
+        sha = hashlib.sha256()
+        with open(path, 'rb') as f:
+            for block in iter(lambda: f.read(blocksize), b''):
+                sha.update(block)
+        _file_hashes[memo] = sha.hexdigest()
+    return _file_hashes[memo]
+
+
+def class_source(cls):
+    """ Return source of cls and of its non backtrader base classes
+    """
+    sources = []
+    for klass in cls.__mro__:
+        module = klass.__module__
+        if module == 'builtins' or module.startswith('backtrader'):
+            continue
+        try:
+            sources.append(inspect.getsource(klass))
+        except (OSError, TypeError):
+            sources.append(klass.__qualname__)
+    return '\n'.join(sources)
+
+
+def _repo_module(name):
+    """ Return module ``name`` if it was loaded from a file of this repo,
+    else None
+    """
+    path = getattr(sys.modules.get(name), '__file__', None)
+    if path and os.path.dirname(os.path.abspath(path)) == REPO_DIR:
+        return sys.modules[name]
+    return None
+
+
+def repo_source(cls):
+    """ Return source of the modules of this repo cls and its base classes
+    are defined in, and of the modules of this repo they import from
+    (mixins such as FastForward, helpers such as indicators.cached)
+    """
+    modules = {}
+    for klass in cls.__mro__:
+        module = _repo_module(klass.__module__)
+        if module is None:
+            continue
+        modules[module.__name__] = module
+        for value in list(vars(module).values()):
+            name = (value.__name__ if isinstance(value, types.ModuleType)
+                    else getattr(value, '__module__', None))
+            used = _repo_module(name) if isinstance(name, str) else None
+            if used is not None:
+                modules[name] = used
+    sources = []
+    for name, module in sorted(modules.items()):
+        try:
+            sources.append(inspect.getsource(module))
+        except (OSError, TypeError):
+            sources.append(name)
+    return '\n'.join(sources)
+
+
+def data_fingerprint(data):
+    """ Return string identifying a data feed's content and settings
+    """
+    dataname = data.p.dataname
+    if isinstance(dataname, pd.DataFrame):
+        content = pd.util.hash_pandas_object(dataname).values
+        content = hashlib.sha256(content.tobytes()).hexdigest()
+    elif isinstance(dataname, str) and os.path.isfile(dataname):
+        content = file_hash(dataname)
+    else:
+        content = repr(dataname)
+    params = sorted((k, v) for k, v in data.p._getkwargs().items()
+                    if k != 'dataname')
+    return '{}|{}|{!r}'.format(data.__class__.__name__, content, params)
+
+
+def _data_refs(cerebro, args, kwargs):
+    """ Return (args, sorted kwargs items) with the datas of cerebro
+    replaced by their index, a feed's repr holds its address
+    """
+    refs = {id(data): 'datas[{}]'.format(i)
+            for i, data in enumerate(cerebro.datas)}
+    return (tuple(refs.get(id(arg), arg) for arg in args),
+            sorted((k, refs.get(id(v), v)) for k, v in kwargs.items()))
+
+
+def cerebro_fingerprint(cerebro, runkwargs=None):
+    """ Return string identifying everything that determines a single run:
+    Cerebro params (with the ``runkwargs`` given to run), strategy source
+    and params, data content, broker, commissions, sizers and analyzers.
+    """
+    cparams = dict(cerebro.p._getkwargs())
+    cparams.update(runkwargs or {})
+    parts = [repr(sorted(cparams.items()))]
+    for stratlist in cerebro.strats:
+        for stratcls, args, kwargs in stratlist:
+            params = dict(stratcls.params._getpairs())
+            params.update(kwargs)
+            parts.append(class_source(stratcls))
+            parts.append(repo_source(stratcls))
+            parts.append(repr(_data_refs(cerebro, args, params)))
+    parts.extend(data_fingerprint(data) for data in cerebro.datas)
+    broker = cerebro.broker
+    bparams = sorted((k, v) for k, v in broker.p._getkwargs().items()
+                     if k != 'commission')  # lives in broker.comminfo
+    parts.append(repr((broker.__class__.__name__, broker.getcash(), bparams)))
+    for name, comminfo in sorted(broker.comminfo.items(), key=repr):
+        parts.append(repr((name, comminfo.__class__.__name__,
+                           sorted(comminfo.p._getkwargs().items()))))
+    for idx, (sizer, args, kwargs) in sorted(cerebro.sizers.items(), key=repr):
+        parts.append(repr((idx, sizer.__name__)
+                          + _data_refs(cerebro, args, kwargs)))
+    for ancls, args, kwargs in cerebro.analyzers:
+        parts.append(repr((ancls.__name__,)
+                          + _data_refs(cerebro, args, kwargs)))
+    return '\n'.join(parts)
+
+
+class CachedResult:
+    """ KPIs and recorded equity of a backtest, as loaded from ResultCache
+    """
+
+    def __init__(self, key, kpis, recorded, meta):
+        self.key = key
+        self.kpis = kpis
+        self.recorded = recorded  # DataFrame of EquityRecorder columns
+        self.meta = meta  # strategy_name, params, start_cash, final_value
+
+    def get_equity_curve(self):
+        curve = self.recorded['value']
+        return 100 * curve / curve.iloc[0]
+
+
+class ResultCache:
+    """ Content-addressed on-disk cache of backtest results and reports
+
+    Entries live in ``cachedir/<key>/`` and are evicted least recently used
+    first once the cache grows over ``max_bytes``.
+    """
+
+    def __init__(self, cachedir='.btcache', max_bytes=256 * 2**20):
+        self.cachedir = os.path.abspath(cachedir)
+        self.max_bytes = max_bytes
+        os.makedirs(self.cachedir, exist_ok=True)
+
+    def key(self, cerebro, runkwargs=None):
+        """ Return cache key of the run configured in cerebro, to be run
+        with ``runkwargs``
+        """
+        fingerprint = cerebro_fingerprint(cerebro, runkwargs).encode('utf-8')
+        return hashlib.sha256(fingerprint).hexdigest()
+
+    def _entrydir(self, key):
+        return os.path.join(self.cachedir, key)
+
+    def get(self, key):
+        """ Return CachedResult for key or None, marks the entry as used
+        """
+        entrydir = self._entrydir(key)
+        try:
+            with open(os.path.join(entrydir, 'kpis.json')) as f:
+                stored = json.load(f)
+            arrays = np.load(os.path.join(entrydir, 'recorded.npz'))
+        except (OSError, ValueError):
+            return None
+        index = pd.to_datetime(arrays['index'], unit='ns')
+        columns = [col for col in arrays.files if col != 'index']
+        recorded = pd.DataFrame({col: arrays[col] for col in columns},
+                                index=index, columns=columns)
+        os.utime(entrydir)
+        return CachedResult(key, stored['kpis'], recorded, stored['meta'])
+
+    def put(self, key, kpis, recorded, meta):
+        """ Stores KPIs and recorded equity DataFrame under key
+        """
+        tmpdir = '{}.tmp-{}'.format(self._entrydir(key), os.getpid())
+        os.makedirs(tmpdir, exist_ok=True)
+        with open(os.path.join(tmpdir, 'kpis.json'), 'w') as f:
+            json.dump({'kpis': kpis, 'meta': meta}, f, default=float)
+        arrays = {col: recorded[col].values for col in recorded.columns}
+        arrays['index'] = recorded.index.values.astype('int64')
+        np.savez(os.path.join(tmpdir, 'recorded.npz'), **arrays)
+        try:
+            os.rename(tmpdir, self._entrydir(key))
+        except OSError:  # stored concurrently by another process
+            shutil.rmtree(tmpdir, ignore_errors=True)
+        self.evict()
+
+    def get_artifact(self, key, name):
+        """ Return path of a stored artifact or None
+        """
+        path = os.path.join(self._entrydir(key), 'artifacts', name)
+        if not os.path.isfile(path):
+            return None
+        os.utime(self._entrydir(key))
+        return path
+
+    def put_artifact(self, key, name, path):
+        """ Copies file at path into the entry of key as artifact name
+        """
+        artdir = os.path.join(self._entrydir(key), 'artifacts')
+        if not os.path.isdir(self._entrydir(key)):
+            return None
+        os.makedirs(artdir, exist_ok=True)
+        target = os.path.join(artdir, name)
+        shutil.copyfile(path, target)
+        os.utime(self._entrydir(key))
+        self.evict()
+        return target
+
+    def _entries(self):
+        """ Return list of (last_used, size, entrydir) for all entries
+        """
+        entries = []
+        for name in os.listdir(self.cachedir):
+            entrydir = os.path.join(self.cachedir, name)
+            if '.tmp-' in name or not os.path.isdir(entrydir):
+                continue
+            size = 0
+            for root, _, files in os.walk(entrydir):
+                size += sum(os.path.getsize(os.path.join(root, f))
+                            for f in files)
+            entries.append((os.path.getmtime(entrydir), size, entrydir))
+        return entries
+
+    def evict(self):
+        """ Removes least recently used entries until under max_bytes
+        """
+        entries = sorted(self._entries())
+        total = sum(size for _, size, _ in entries)
+        for _, size, entrydir in entries:
+            if total <= self.max_bytes:
+                break
+            shutil.rmtree(entrydir, ignore_errors=True)
+            total -= size
@@ -0,0 +1,115 @@
+"""Fast-forward runs against plain runs
+
+FastForward only changes which bars next() is called on and which bars
+are jumped over, never the result. Runs every case here in runonce mode,
+where the strategies fast-forward, and in next mode, where they do not,
+and compares the broker value, the orders and the next() calls of the
+strategies that do not fast-forward. Exits with status 1 on a difference.
+
+    python check_fastforward.py [--data BTC-USD.csv]
+"""
+import argparse
+import os
+import sys
+
+import backtrader as bt
+
+from macd import FixedPerc, TheStrategy
+from sma_multi import SMAStrategy
+
+
+class PlainSMA(bt.Strategy):
+    """ Counts its next() calls, trades on nothing
+    """
+
+    def __init__(self):
+        self.sma = bt.indicators.SMA(self.data, period=30)
+        self.calls = 0
+
+    def next(self):
+        self.calls += 1
+
+
+def with_sma(cerebro):
+    cerebro.addstrategy(SMAStrategy, sma_period=(10, 40))
+
+
+def with_plain(cerebro):
+    with_sma(cerebro)
+    cerebro.addstrategy(PlainSMA)
+
+
+def with_two(cerebro):
+    cerebro.addstrategy(SMAStrategy, sma_period=(5, 60))
+    with_sma(cerebro)
+
+
+def with_writer(cerebro):
+    with_sma(cerebro)
+    cerebro.addwriter(bt.WriterFile, out=open(os.devnull, 'w'))
+
+
+def without_checksubmit(cerebro):
+    cerebro.broker.set_checksubmit(False)
+    cerebro.addstrategy(TheStrategy)
+    cerebro.addsizer(FixedPerc)
+
+
+CASES = {
+    'alone': with_sma,
+    'plain strategy': with_plain,
+    'two strategies': with_two,
+    'writer': with_writer,
+    'no checksubmit': without_checksubmit,
+}
+
+
+def run_case(setup, datapath, runonce):
+    """ Return (broker value, per strategy (orders, next() calls), bars
+    jumped) of a case
+    """
+    cerebro = bt.Cerebro(stdstats=False)
+    cerebro.adddata(bt.feeds.YahooFinanceCSVData(dataname=datapath,
+                                                 reverse=False))
+    cerebro.broker.setcash(100000.0)
+    setup(cerebro)
+    strats = cerebro.run(runonce=runonce)
+    counts = tuple((len(strat._orders), getattr(strat, 'calls', None))
+                   for strat in strats)
+    jumped = sum(getattr(strat, 'ffjumped', 0) for strat in strats)
+    return cerebro.broker.getvalue(), counts, jumped
+
+
+def parse_args():
+    modpath = os.path.dirname(os.path.abspath(__file__))
+    parser = argparse.ArgumentParser(
+        description='Fast-forward runs against plain runs')
+    parser.add_argument('--data', default=os.path.join(modpath,
+                                                       'BTC-USD.csv'),
+                        help='Yahoo style OHLCV csv file')
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    failures = 0
+    print("{:<16} {:>14} {:>14} {:>8}  {}".format(
+        'case', 'runonce', 'next', 'jumped', 'orders, calls'))
+    for name, setup in CASES.items():
+        stdout, sys.stdout = sys.stdout, open(os.devnull, 'w')
+        try:
+            fast = run_case(setup, args.data, True)
+            plain = run_case(setup, args.data, False)
+        finally:
+            sys.stdout.close()
+            sys.stdout = stdout
+        ok = fast[:2] == plain[:2]
+        failures += not ok
+        print("{:<16} {:>14.2f} {:>14.2f} {:>8}  {}{}".format(
+            name, fast[0], plain[0], fast[2], fast[1],
+            '' if ok else '  FAIL next mode {}'.format(plain[1])))
+    return 1 if failures else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
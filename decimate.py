@@ -0,0 +1,75 @@
+import numpy as np
+
+
+def lttb(x, y, threshold):
+    """ Return indices of the points picked by Largest-Triangle-Three-Buckets
+
+    Keeps first and last point and, for each of threshold - 2 buckets, the
+    point forming the largest triangle with the previously picked point and
+    the average of the next bucket.
+    See: Steinarsson, Downsampling Time Series for Visual Representation
+    """
+    x = np.asarray(x, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+    n = len(y)
+    if threshold >= n or threshold < 3:
+        return np.arange(n)
+    edges = np.linspace(1, n - 1, threshold - 1).astype(np.int64)
+    picked = np.empty(threshold, dtype=np.int64)
+    picked[0], picked[-1] = 0, n - 1
+    a = 0
+    for i in range(threshold - 2):
+        start, stop = edges[i], edges[i + 1]
+        if i + 2 < len(edges):
+            nxt = slice(edges[i + 1], edges[i + 2])
+            cx, cy = x[nxt].mean(), y[nxt].mean()
+        else:
+            cx, cy = x[-1], y[-1]
+        bx, by = x[start:stop], y[start:stop]
+        area = np.abs((x[a] - cx) * (by - y[a]) - (x[a] - bx) * (cy - y[a]))
+        a = start + int(np.argmax(area))
+        picked[i + 1] = a
+    return picked
+
+
+def drawdown_extremes(y):
+    """ Return (peak, trough) indices of the maximum drawdown of y
+    """
+    y = np.asarray(y, dtype=np.float64)
+    running_max = np.maximum.accumulate(y)
+    trough = int(np.argmax((running_max - y) / running_max))
+    peak = int(np.argmax(y[:trough + 1]))
+    return peak, trough
+
+
+def decimate_curve(curve, max_points=2000):
+    """ Return curve downsampled to max_points with LTTB
+
+    Global maximum, minimum and the peak and trough of the maximum drawdown
+    are always kept, so visual extremes survive decimation.
+    """
+    if len(curve) <= max_points:
+        return curve
+    y = curve.values
+    x = curve.index.values.astype(np.int64)
+    keep = [int(np.argmax(y)), int(np.argmin(y))]
+    keep.extend(drawdown_extremes(y))
+    picked = lttb(x, y, max_points - len(keep))
+    picked = np.union1d(picked, keep)
+    return curve.iloc[picked]
+
+
+def cap_periods(values, max_bars):
+    """ Return period closes thinned to at most max_bars returns
+
+    Keeps every k-th close (and the last one), so the returns computed from
+    the result compound k consecutive periods. Returns (closes, k).
+    """
+    n = len(values)
+    if n <= max_bars + 1:
+        return values, 1
+    k = int(np.ceil((n - 1) / float(max_bars)))
+    idx = np.arange(0, n, k)
+    if idx[-1] != n - 1:
+        idx = np.append(idx, n - 1)
+    return values.iloc[idx], k
@@ -0,0 +1,365 @@
+"""Sweeps distributed over workers on several hosts
+
+DistributedRunner is a GridRunner whose runs are done by worker processes
+connected over TCP instead of a local process pool. The coordinator
+listens on ``address``, workers connect, get the strategy, the run
+settings and the SHA-256 of the bars, and then pull chunks of params one
+after the other, streaming a record back as soon as each run finishes.
+
+A worker keeps the bars in ``cachedir`` under their hash, it only fetches
+them from the coordinator when no file with that hash is there, so a
+restarted worker starts right away. A worker whose connection breaks, or
+that sends nothing for ``lease`` seconds while it has runs, is lost: the
+runs of its chunk not finished yet are queued again, runs lost more than
+``retries`` times get status 'crashed'.
+
+Start workers with, from a checkout of this repo on each host:
+
+    python distributed.py worker coordinator-host:5555 --authkey secret
+
+Connections use multiprocessing.connection, messages are pickles and
+whoever knows ``authkey`` can run code on the coordinator and the workers:
+only run it on networks where the workers are trusted. There is no
+default key, it comes from --authkey or $BT_AUTHKEY; a coordinator on a
+loopback address without one makes up a random key for its local workers.
+Strategies are sent by module and name, workers import them from their
+checkout. ``local_workers`` starts worker processes on this host, that
+needs no other setup.
+"""
+import argparse
+import collections
+import hashlib
+import importlib
+import ipaddress
+import multiprocessing
+import os
+import socket
+import sys
+import tempfile
+import threading
+import time
+from multiprocessing.connection import Client, Listener
+
+import numpy as np
+
+from cache import file_hash
+from optimize import GridRunner, SharedOHLCV, run_safe
+
+
+def env_authkey():
+    """ Return $BT_AUTHKEY as bytes, None if not set
+    """
+    key = os.environ.get('BT_AUTHKEY')
+    return key.encode('utf-8') if key else None
+
+
+def is_loopback(host):
+    """ Return whether every address host resolves to is a loopback one
+    """
+    try:
+        infos = socket.getaddrinfo(host, None) if host else []
+        return bool(infos) and all(
+            ipaddress.ip_address(info[4][0]).is_loopback for info in infos)
+    except (socket.gaierror, ValueError):
+        return False
+
+
+def data_hash(ohlcv):
+    """ Return SHA-256 hex digest of the bars of a SharedOHLCV
+    """
+    return hashlib.sha256(
+        np.ascontiguousarray(ohlcv.arrays).tobytes()).hexdigest()
+
+
+def strategy_ref(strategy):
+    """ Return (module, name) importing strategy on another host, the
+    script run as __main__ by its file name
+    """
+    module = strategy.__module__
+    if module == '__main__':
+        main = getattr(sys.modules['__main__'], '__file__', None)
+        if main is None:
+            raise ValueError('cannot send {} defined interactively'.format(
+                strategy.__name__))
+        module = os.path.splitext(os.path.basename(main))[0]
+    return module, strategy.__qualname__
+
+
+def load_strategy(ref):
+    module, name = ref
+    obj = importlib.import_module(module)
+    for part in name.split('.'):
+        obj = getattr(obj, part)
+    return obj
+
+
+def parse_address(text, default_host='localhost'):
+    """ Return (host, port) of a 'host:port' or 'port' string
+    """
+    host, _, port = text.rpartition(':')
+    return host or default_host, int(port)
+
+
+def _attach_data(conn, digest, shape, timeframe, compression, cachedir):
+    """ Return SharedOHLCV over the cached bars with hash digest, fetched
+    from the coordinator unless a verified copy is cached
+    """
+    path = os.path.join(cachedir, 'btohlcv-{}.f8'.format(digest))
+    if not (os.path.exists(path) and file_hash(path) == digest):
+        conn.send(('fetch',))
+        payload = conn.recv_bytes()
+        if hashlib.sha256(payload).hexdigest() != digest:
+            raise ValueError('bars received do not match hash {}'.format(
+                digest))
+        fd, tmp = tempfile.mkstemp(dir=cachedir, suffix='.part')
+        with os.fdopen(fd, 'wb') as f:
+            f.write(payload)
+        os.replace(tmp, path)
+    return SharedOHLCV(path, shape, timeframe, compression)
+
+
+def work(address, authkey, cachedir=None):
+    """ Worker loop: connects to a coordinator and runs chunks until told
+    to exit, returns the number of runs done
+    """
+    if cachedir is None:
+        cachedir = '/dev/shm' if os.path.isdir('/dev/shm') else (
+            tempfile.gettempdir())
+    host = socket.gethostname()
+    done = 0
+    with Client(tuple(address), authkey=authkey) as conn:
+        conn.send(('hello', host, os.getpid()))
+        _, ref, settings, digest, shape, timeframe, compression = conn.recv()
+        strategy = load_strategy(ref)
+        ohlcv = _attach_data(conn, digest, shape, timeframe, compression,
+                             cachedir)
+        while True:
+            conn.send(('ready',))
+            msg = conn.recv()
+            if msg[0] == 'exit':
+                break
+            for idx, params, overrides in msg[1]:
+                record = run_safe(strategy, params, ohlcv,
+                                  **dict(settings, **(overrides or {})))
+                record['host'] = host
+                conn.send(('record', idx, record))
+                done += 1
+    return done
+
+
+class WorkerLost(Exception):
+    pass
+
+
+class DistributedRunner(GridRunner):
+    """ Runs a strategy over params dicts on workers connected over TCP
+
+    ``address`` is the (host, port) to listen on, port 0 picks a free one
+    (see ``address`` after construction). ``authkey`` defaults to
+    $BT_AUTHKEY, without either only a loopback address is accepted and
+    a random key is used. ``local_workers`` worker processes are started
+    on this host. Use as context manager, or call close() to let the
+    workers exit. Other arguments like GridRunner.
+    """
+
+    def __init__(self, strategy, ohlcv, address=('localhost', 0),
+                 authkey=None, local_workers=0, chunksize=4,
+                 errors='raise', lease=300.0, retries=2, cachedir=None,
+                 **settings):
+        authkey = authkey or env_authkey()
+        if authkey is None:
+            if not is_loopback(address[0]):
+                raise ValueError(
+                    'listening on {} needs an authkey (or $BT_AUTHKEY), '
+                    'anyone knowing it can run code here'.format(address[0]))
+            authkey = os.urandom(32)  # only the local workers know it
+        super().__init__(strategy, ohlcv, workers=max(local_workers, 1),
+                         chunksize=chunksize, errors=errors, **settings)
+        self.lease = lease
+        self.retries = retries
+        self.digest = data_hash(ohlcv)
+        self.job = ('job', strategy_ref(strategy), settings, self.digest,
+                    ohlcv.shape, ohlcv.timeframe, ohlcv.compression)
+        self.listener = Listener(tuple(address), authkey=authkey)
+        host, port = self.listener.address
+        self.address = (host, port)
+        self.connected = set()  # (host, pid) of workers seen
+        self.lost = 0
+        self._cond = threading.Condition()
+        self._pending = collections.deque()  # chunks of (idx, params, ovr)
+        self._attempts = collections.Counter()
+        self._records = []
+        self._remaining = 0
+        self._closed = False
+        threading.Thread(target=self._accept, daemon=True).start()
+        if local_workers and host in ('', '0.0.0.0'):
+            host = '127.0.0.1'
+        self.local = [multiprocessing.Process(
+            target=work, args=((host, port), authkey, cachedir), daemon=True)
+            for _ in range(local_workers)]
+        for process in self.local:
+            process.start()
+
+    def _accept(self):
+        while True:
+            try:
+                conn = self.listener.accept()
+            except OSError:  # listener closed
+                return
+            except Exception:  # failed authentication, stray connection
+                continue
+            threading.Thread(target=self._serve, args=(conn,),
+                             daemon=True).start()
+
+    def _take(self):
+        """ Return next chunk of unfinished runs, None once closed
+        """
+        with self._cond:
+            while True:
+                while self._pending:
+                    chunk = [item for item in self._pending.popleft()
+                             if self._records[item[0]] is None]
+                    if chunk:
+                        return chunk
+                if self._closed:
+                    return None
+                self._cond.wait()
+
+    def _store(self, idx, record):
+        """ Keeps the record of a run, called holding the lock
+        """
+        if idx >= len(self._records) or self._records[idx] is not None:
+            return  # late duplicate of a requeued run
+        self._records[idx] = record
+        self._remaining -= 1
+        if record['status'] != 'crashed':
+            self._collect(record)
+        self._cond.notify_all()
+
+    def _finish(self, idx, record):
+        with self._cond:
+            self._store(idx, record)
+
+    def _requeue(self, items):
+        with self._cond:
+            self.lost += 1
+            retry = []
+            for idx, params, overrides in items:
+                if idx >= len(self._records) or self._records[idx] is not None:
+                    continue
+                self._attempts[idx] += 1
+                if self._attempts[idx] <= self.retries:
+                    retry.append((idx, params, overrides))
+                else:
+                    self._store(idx, {'params': params, 'status': 'crashed'})
+            if retry:
+                self._pending.appendleft(retry)
+            self._cond.notify_all()
+
+    def _serve(self, conn):
+        """ Talks to one worker until it exits or is lost
+        """
+        inflight = {}
+        try:
+            _, host, pid = conn.recv()
+            with self._cond:
+                self.connected.add((host, pid))
+            conn.send(self.job)
+            while True:
+                if inflight and not conn.poll(self.lease):
+                    raise WorkerLost(host, pid)
+                msg = conn.recv()
+                if msg[0] == 'fetch':
+                    conn.send_bytes(np.ascontiguousarray(self.ohlcv.arrays))
+                elif msg[0] == 'ready':
+                    chunk = self._take()
+                    if chunk is None:
+                        conn.send(('exit',))
+                        break
+                    inflight = {item[0]: item for item in chunk}
+                    conn.send(('chunk', chunk))
+                elif msg[0] == 'record':
+                    _, idx, record = msg
+                    inflight.pop(idx, None)
+                    self._finish(idx, record)
+        except (EOFError, OSError, WorkerLost):
+            pass
+        finally:
+            if inflight:
+                self._requeue(list(inflight.values()))
+            conn.close()
+
+    def run_many(self, runs):
+        """ Return list of result records for (params, overrides) pairs,
+        blocking until every run is done by some worker
+        """
+        begin = time.perf_counter()
+        with self._cond:
+            self._records = [None] * len(runs)
+            self._remaining = len(runs)
+            self._attempts.clear()
+            self._pending.extend(self.chunks(runs))
+            self._cond.notify_all()
+            while self._remaining:
+                self._cond.wait()
+            self._pending.clear()  # requeued runs finished meanwhile
+            records = self._records
+            self.workers = max(len(self.connected), 1)
+        self.wall_time += time.perf_counter() - begin
+        if self.errors != 'record':
+            for record in records:
+                if record['status'] == 'error':
+                    raise RuntimeError('run {} failed on worker {}:\n{}'.format(
+                        record['params'], record['worker'], record['error']))
+        return records
+
+    def format_stats(self):
+        return "{}\n{} workers connected, {} lost".format(
+            super().format_stats(), len(self.connected), self.lost)
+
+    def close(self):
+        """ Tells the workers to exit and stops listening
+        """
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+        self.listener.close()
+        for process in self.local:
+            process.join(5)
+            if process.is_alive():
+                process.kill()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description='Worker of a distributed sweep')
+    parser.add_argument('role', choices=('worker',))
+    parser.add_argument('address', help='HOST:PORT of the coordinator')
+    parser.add_argument('--authkey', default=None,
+                        help='Shared secret, default $BT_AUTHKEY')
+    parser.add_argument('--cachedir', default=None,
+                        help='Directory the bars are cached in')
+    parser.add_argument('--processes', type=int, default=1,
+                        help='Worker processes to start on this host')
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    args = parse_args()
+    address = parse_address(args.address)
+    authkey = args.authkey.encode('utf-8') if args.authkey else env_authkey()
+    if authkey is None:
+        sys.exit('an --authkey or $BT_AUTHKEY is needed')
+    workers = [multiprocessing.Process(target=work,
+                                       args=(address, authkey, args.cachedir))
+               for _ in range(args.processes)]
+    for process in workers:
+        process.start()
+    for process in workers:
+        process.join()
@@ -4,9 +4,11 @@ import sys
 import pandas as pd
 import backtrader as bt
 from report import Cerebro
+from cache import ResultCache
+from fastforward import FastForward
 
 
-class CrossOver(bt.Strategy):
+class CrossOver(FastForward, bt.Strategy):
     """A simple moving average crossover strategy,
     at SMA 50/200 a.k.a. the "Golden Cross Strategy"
     """
@@ -31,6 +33,10 @@ class CrossOver(bt.Strategy):
     def start(self):
         self.size = None
 
+    def wakeup(self):
+        # flat, only crossovers up matter, in the market every bar does
+        return self.ffarray(self.crossover) > 0
+
     def log(self, txt, dt=None):
         """ Logging function for this strategy
         """
@@ -71,8 +77,9 @@ if __name__ == "__main__":
     infile = os.path.join(datadir, TESTDATA)
     ohlc = pd.read_csv(infile, index_col='dt', parse_dates=True)
 
-    # initialize Cerebro engine, extende with report method
-    cerebro = Cerebro()
+    # initialize Cerebro engine, extende with report method, reruns with
+    # unchanged code, data and params are served from the result cache
+    cerebro = Cerebro(cache=ResultCache(os.path.join(basedir, '.btcache')))
     cerebro.broker.setcash(100)
 
     # add data
@@ -89,7 +96,8 @@ if __name__ == "__main__":
 
     # run backtest with both plotting and reporting
     cerebro.run()
-    cerebro.plot(volume=False)
+    if not cerebro.cache_hit:
+        cerebro.plot(volume=False)
     cerebro.report(OUTPUTDIR,
                    infilename='btc_usd.csv',
                    user='Trading John',
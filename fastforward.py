@@ -0,0 +1,169 @@
+"""Fast-forward execution: run only the bars that matter
+
+Most bars of a crossover strategy do nothing: no signal, no position, no
+pending order. A strategy deriving from FastForward (before bt.Strategy)
+declares the bars it wants next() called on with wakeup(), a boolean
+NumPy array over its bars computed from the precomputed indicator arrays,
+e.g. for a CrossOver indicator:
+
+    def wakeup(self):
+        return self.ffarray(self.crossover) != 0
+
+Besides the wake-up bars next() is called on every bar an order is alive,
+and with ``ffposition`` (the default) on every bar a position is open.
+
+On the other bars only next() is skipped: the broker runs, lines,
+observers and analyzers advance and notifications are delivered as in a
+normal run. That alone saves little, backtrader's own work per bar is
+most of a run. So when nothing can observe the skipped bars (no
+analyzers, observers, timers, writers or other datas, and a broker with
+checksubmit, the default, listing every order) and the strategy is flat
+with no order alive, the data, the indicators and the strategy are moved
+straight to the bar before the next wake-up bar: with no position and no
+order the broker has nothing to do on those bars, the result is the same.
+
+The mask needs the indicators computed before the bar loop, so it is
+used with runonce only. With runonce=False, with quicknotify, with other
+strategies (they change the position too), or if wakeup() returns None,
+next() is called on every bar. ``ffcalls`` counts the next() calls of a
+run, ``ffjumped`` the bars jumped over; check_fastforward.py compares
+fast-forward runs with plain ones.
+"""
+import backtrader as bt
+import numpy as np
+from backtrader.lineiterator import LineIterator
+
+
+class FastForward:
+    """ Strategy mixin calling next() only on wake-up bars, see the module
+    docstring
+    """
+    ffposition = True  # call next() on every bar with an open position
+    ffcalls = 0
+    ffjumped = 0
+
+    def wakeup(self):
+        """ Return bool array, True for the bars next() is needed on, or
+        None for all bars
+        """
+        return None
+
+    def ffarray(self, line):
+        """ Return NumPy view of the values of an indicator (first line)
+        or line over all bars, valid once indicators are precomputed
+        """
+        if isinstance(line, bt.LineSeries):
+            line = line.lines[0]
+        return np.frombuffer(line.array, dtype=np.float64)
+
+    def _once(self):
+        super()._once()
+        cerebro = self.cerebro
+        # other strategies open and close the position of the data too,
+        # without notifying this one
+        wake = (None if cerebro.p.quicknotify
+                or len(cerebro.runningstrats) > 1 else self.wakeup())
+        self._ffwake = None if wake is None else np.asarray(wake, dtype=bool)
+        self._ffhold = False  # next() on every bar
+        self._ffbusy = False  # position or orders, no jumping
+        self._ffdone = 0  # broker.orders before this index are not alive
+        self.ffcalls = 0
+        self.ffjumped = 0
+        self._ffnext = None
+        # jumping moves the data, which writers see too, and needs every
+        # live order in broker.orders, which only checksubmit puts them in
+        if self._ffwake is not None and not (
+                len(self.analyzers) or len(self.stats)
+                or len(cerebro.datas) > 1 or cerebro._timers
+                or cerebro._timerscheat or cerebro.p.cheat_on_open
+                or cerebro.runwriters
+                or not hasattr(self.broker, 'orders')
+                or not self.broker.p.checksubmit):
+            # index of the next wake-up bar at or after each bar
+            nbars = len(self._ffwake)
+            bars = np.where(self._ffwake, np.arange(nbars), nbars)
+            self._ffnext = np.minimum.accumulate(bars[::-1])[::-1]
+
+    def _ffstate(self):
+        """ Updates whether next() is needed on every bar and whether bars
+        may be jumped over from the position and the orders alive
+        """
+        inposition = bool(self.position.size)
+        orders = getattr(self.broker, 'orders', None)
+        if orders is None:  # not a BackBroker, assume orders are alive
+            alive = True
+        else:
+            done = self._ffdone
+            while done < len(orders) and not orders[done].alive():
+                done += 1
+            self._ffdone = done
+            # without checksubmit orders go straight to broker.pending
+            alive = (any(order.alive() for order in orders[done:])
+                     or any(order.alive() for order in self.broker.pending))
+        self._ffhold = alive or (self.ffposition and inposition)
+        self._ffbusy = alive or inposition
+
+    def _ffjump(self, bar):
+        """ Moves the data to the bar before the next wake-up bar
+        """
+        data = self.data
+        nbars = data.buflen()
+        target = self._ffnext[bar + 1] if bar + 1 < len(self._ffnext) else (
+            nbars)
+        # the last bar runs normally
+        gap = min(target, nbars - 1) - bar - 1
+        if gap > 0:
+            data.advance(size=gap)
+            self.ffjumped += gap
+
+    def _oncepost(self, dt):
+        wake = getattr(self, '_ffwake', None)
+        if wake is None:
+            return super()._oncepost(dt)
+
+        # bt.Strategy._oncepost, catching up on jumped bars and with next()
+        # on the wake-up bars only
+        for indicator in self._lineiterators[LineIterator.IndType]:
+            gap = len(indicator._clock) - len(indicator)
+            if gap > 0:
+                indicator.advance(gap)
+
+        gap = len(self._clock) - len(self)
+        if self._oldsync:
+            self.advance(max(gap, 1))
+        else:
+            self.forward(size=max(gap, 1))
+
+        self.lines.datetime[0] = dt
+        notified = self._orderspending or self._tradespending
+        self._notify()
+        if notified:  # orders may have been filled or created
+            self._ffstate()
+
+        bar = len(self.data) - 1
+        minperstatus = self._getminperstatus()
+        if minperstatus < 0:
+            if self._ffhold:
+                # stays on until a notification says orders and position
+                # are done
+                self.ffcalls += 1
+                self.next()
+            elif bar >= len(wake) or wake[bar]:
+                self.ffcalls += 1
+                self.next()
+                self._ffstate()
+        elif minperstatus == 0:
+            self.ffcalls += 1
+            self.nextstart()  # only called for the 1st value
+            self._ffstate()
+        else:
+            self.prenext()
+
+        self._next_analyzers(minperstatus, once=True)
+        self._next_observers(minperstatus, once=True)
+
+        self.clear()
+
+        if (self._ffnext is not None and minperstatus <= 0
+                and not self._ffbusy):
+            self._ffjump(bar)
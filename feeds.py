@@ -0,0 +1,56 @@
+import backtrader as bt
+import numpy as np
+
+COLUMNS = ('datetime', 'open', 'high', 'low', 'close', 'volume',
+           'openinterest')
+
+
+def load_feed_arrays(data):
+    """ Return (7, n) float64 array with the bars of a backtrader feed,
+    rows ordered like COLUMNS, after the feed's own parsing and filters
+    """
+    cerebro = bt.Cerebro()
+    cerebro.adddata(data)
+    data.reset()
+    data._start()
+    data.preload()
+    arrays = np.empty((len(COLUMNS), data.buflen()))
+    for row, col in enumerate(COLUMNS):
+        arrays[row] = np.frombuffer(getattr(data.lines, col).array, 'd')
+    data.stop()
+    return arrays
+
+
+class ArrayData(bt.feed.DataBase):
+    """ Feeds bars from a (7, n) float64 array ordered like feeds.COLUMNS
+
+    The array can be a view on shared memory, ``start`` and ``stop`` pick a
+    slice of it without copying, so many feeds can share one array.
+    """
+    params = (
+        ('start', 0),
+        ('stop', None),
+    )
+
+    def start(self):
+        super().start()
+        self._arrays = self.p.dataname
+        stop = self.p.stop
+        self._stop = self._arrays.shape[1] if stop is None else stop
+        self._idx = self.p.start
+
+    def _load(self):
+        i = self._idx
+        if i >= self._stop:
+            return False
+        self._idx = i + 1
+        arrays = self._arrays
+        lines = self.lines
+        lines.datetime[0] = arrays[0, i]
+        lines.open[0] = arrays[1, i]
+        lines.high[0] = arrays[2, i]
+        lines.low[0] = arrays[3, i]
+        lines.close[0] = arrays[4, i]
+        lines.volume[0] = arrays[5, i]
+        lines.openinterest[0] = arrays[6, i]
+        return True
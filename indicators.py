@@ -0,0 +1,179 @@
+"""Cross-run indicator cache for optimization sweeps
+
+Strategies of a sweep share one data feed but rebuild the same indicators
+in every run, e.g. sma_multi.py's 190 period pairs need only 20 distinct
+SMAs. Strategies create indicators through ``cached()`` instead:
+
+    self.sma = cached(bt.indicators.SMA, self.data, period=20)
+
+The first run asking for a (data, indicator class, params) key gets the
+real indicator, whose lines are recorded once they are complete. Later
+runs in the same process get a light indicator that copies the recorded
+lines. Memory is bounded by evicting the least recently used lines.
+"""
+import array
+import collections
+import hashlib
+
+import backtrader as bt
+import numpy as np
+
+from feeds import COLUMNS
+
+
+class Precomputed(bt.Indicator):
+    """ Replays lines recorded from an identical indicator of an earlier
+    run, subclassed per source class by IndicatorCache to get its lines
+    """
+    params = (
+        ('values', ()),
+        ('minperiod', 1),
+    )
+
+    def __init__(self):
+        self.addminperiod(self.p.minperiod)
+
+    def once(self, start, end):
+        for line, values in zip(self.lines, self.p.values):
+            line.array[start:end] = values[start:end]
+
+    preonce = oncestart = once
+
+    def next(self):
+        i = len(self) - 1
+        for line, values in zip(self.lines, self.p.values):
+            line[0] = values[i]
+
+    prenext = nextstart = next
+
+
+def data_key(data):
+    """ Return hashable identity of a preloaded feed's bars, or None when
+    the feed is not preloaded and bars are unknown up front. Computed once
+    per feed and kept on it, ``cached()`` asks for it per indicator.
+    """
+    if not isinstance(data, bt.AbstractDataBase) or not data.buflen():
+        return None
+    memo = getattr(data, '_indcachekey', None)
+    if memo is None or memo[1] != data.buflen():
+        memo = data._indcachekey = (_data_key(data), data.buflen())
+    return memo[0]
+
+
+def _data_key(data):
+    dataname = data.p.dataname
+    filename = getattr(dataname, 'filename', None)
+    if isinstance(dataname, np.memmap) and filename:
+        # shared memory bars, see optimize.SharedOHLCV
+        return (filename, data.p.start, data.p.stop, data.buflen())
+    sha = hashlib.sha1()
+    for col in COLUMNS:
+        sha.update(getattr(data.lines, col).array)
+    return (sha.hexdigest(), data.buflen())
+
+
+class IndicatorCache:
+    """ Process wide cache of indicator lines keyed by (data identity,
+    indicator class, params), bounded to ``max_bytes`` of line values
+    """
+
+    def __init__(self, max_bytes=64 << 20):
+        self.max_bytes = max_bytes
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._entries = collections.OrderedDict()  # key -> (minper, lines)
+        self._classes = {}  # indicator class -> Precomputed subclass
+
+    def key(self, indcls, data, params):
+        dkey = data_key(data)
+        if dkey is None:
+            return None
+        pairs = dict(indcls.params._getpairs())
+        pairs.update(params)
+        key = (dkey, indcls, tuple(sorted(pairs.items())))
+        try:
+            hash(key)
+        except TypeError:
+            return None
+        return key
+
+    def get(self, indcls, data, **params):
+        """ Return indicator for a strategy's __init__, precomputed when an
+        identical one already ran in this process
+        """
+        key = self.key(indcls, data, params)
+        if key is None:
+            return indcls(data, **params)
+        entry = self._entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return self._recording(indcls)(data, _cachekey=key, **params)
+        self.hits += 1
+        self._entries.move_to_end(key)
+        minperiod, values = entry
+        return self._precomputed(indcls)(data, values=values,
+                                         minperiod=minperiod)
+
+    def put(self, key, minperiod, lines):
+        """ Stores complete lines, evicting least recently used entries
+        """
+        if key in self._entries:
+            return
+        values = tuple(array.array('d', line.array) for line in lines)
+        size = sum(len(v) * v.itemsize for v in values)
+        if size > self.max_bytes:
+            return
+        self._entries[key] = (minperiod, values)
+        self.nbytes += size
+        while self.nbytes > self.max_bytes:
+            _, (_, old) = self._entries.popitem(last=False)
+            self.nbytes -= sum(len(v) * v.itemsize for v in old)
+
+    def clear(self):
+        self._entries.clear()
+        self.nbytes = 0
+
+    def _precomputed(self, indcls):
+        if (indcls, 'replay') not in self._classes:
+            self._classes[indcls, 'replay'] = type(
+                'Cached' + indcls.__name__, (Precomputed,),
+                {'lines': indcls.lines._getlines(),
+                 'plotinfo': dict(indcls.plotinfo._getpairs(),
+                                  plotname=indcls.__name__)})
+        return self._classes[indcls, 'replay']
+
+    def _recording(self, indcls):
+        if (indcls, 'record') not in self._classes:
+            cache = self
+
+            class Recording(indcls):
+                params = (('_cachekey', None),)
+
+                def _record(self):
+                    if all(len(line.array) == self.data.buflen()
+                           for line in self.lines):
+                        cache.put(self.p._cachekey, self._minperiod,
+                                  self.lines)
+
+                def _once(self):
+                    super()._once()
+                    self._record()
+
+                def _next(self):
+                    super()._next()
+                    if len(self) == self.data.buflen():
+                        self._record()
+
+            Recording.__name__ = indcls.__name__
+            self._classes[indcls, 'record'] = Recording
+        return self._classes[indcls, 'record']
+
+
+indicator_cache = IndicatorCache()
+
+
+def cached(indcls, data, **params):
+    """ Return indcls(data, **params) from the process wide cache
+    """
+    return indicator_cache.get(indcls, data, **params)
@@ -0,0 +1,487 @@
+"""Live candles from a ccxt exchange into Cerebro
+
+CCXTLiveData is a live backtrader feed. An asyncio loop in a background
+thread first backfills ``backfill`` closed candles with bulk
+fetch_ohlcv() calls, then follows new candles: with watch_ohlcv() when
+the exchange streams them (ccxt.pro), else by polling fetch_ohlcv() right
+after each candle is due to close. Closed candles are handed to Cerebro
+through a queue its loop blocks on, so a bar reaches the strategy as soon
+as it arrives, not at the next check of an interval. The feed notifies
+DELAYED while backfilling and LIVE once it follows the exchange.
+
+SimulatedExchange has the async ccxt calls the feed uses and emits
+candles at ``rate`` per second, from given bars or a seeded random walk,
+without network access. LatencyRecorder times every live bar from the
+moment the simulator closed it to the strategy having run on it, run
+
+    python livefeed.py --rate 50 --bars 500 --max-p99 20
+
+to measure bar -> signal -> order latency on a local simulator; the exit
+status is 1 when the 99th percentile exceeds --max-p99 milliseconds.
+
+ccxt is only imported when an exchange is given by name.
+"""
+import argparse
+import asyncio
+import datetime
+import queue
+import sys
+import threading
+import time
+
+import backtrader as bt
+import numpy as np
+
+# ccxt timeframe unit -> (backtrader timeframe, seconds)
+_UNITS = {'m': (bt.TimeFrame.Minutes, 60), 'h': (bt.TimeFrame.Minutes, 3600),
+          'd': (bt.TimeFrame.Days, 86400), 'w': (bt.TimeFrame.Weeks, 604800)}
+
+
+def parse_timeframe(timeframe):
+    """ Return (backtrader timeframe, compression, milliseconds) of a ccxt
+    timeframe string like '1m', '4h' or '1d'
+    """
+    amount, unit = int(timeframe[:-1]), timeframe[-1]
+    if unit not in _UNITS:
+        raise ValueError('unsupported timeframe {!r}'.format(timeframe))
+    frame, seconds = _UNITS[unit]
+    compression = amount * seconds // 60 if frame == bt.TimeFrame.Minutes \
+        else amount
+    return frame, compression, amount * seconds * 1000
+
+
+def ms2num(ms):
+    """ Return backtrader float datetime (UTC) of epoch milliseconds
+    """
+    return bt.date2num(datetime.datetime.utcfromtimestamp(ms / 1000.0))
+
+
+class CCXTLiveData(bt.feed.DataBase):
+    """ Live feed of the candles of ``symbol`` on a ccxt async exchange
+
+    ``exchange`` is an async exchange object (ccxt.async_support, ccxt.pro
+    or SimulatedExchange) or the name of a ccxt.async_support exchange.
+    ``backfill`` is the number of closed candles loaded at start,
+    ``limit`` the candles per bulk request, ``polldelay`` the seconds
+    after a candle's close the first poll for it is made and ``retry``
+    the seconds between polls until it shows up. Network errors are
+    retried ``retries`` times in a row before the feed ends.
+
+    After each bar ``candle_ts`` holds the candle's open time in epoch
+    ms, ``received`` the perf_counter time the exchange call returned it
+    and ``islivebar`` whether it came after the backfill.
+    """
+    params = (
+        ('exchange', None),
+        ('symbol', 'BTC/USDT'),
+        ('ccxt_timeframe', '1m'),
+        ('backfill', 0),
+        ('limit', 500),
+        ('polldelay', 0.05),
+        ('retry', 0.05),
+        ('retries', 5),
+        ('stream', None),  # None: watch_ohlcv when the exchange has it
+        ('qcheck', 0.5),
+    )
+
+    def islive(self):
+        return True
+
+    def haslivedata(self):
+        return not self._queue.empty()
+
+    def start(self):
+        super().start()
+        frame, compression, self._tfms = parse_timeframe(
+            self.p.ccxt_timeframe)
+        self._timeframe = frame
+        self._compression = compression
+        self._queue = queue.Queue()
+        self._stopping = threading.Event()
+        self._lastts = None  # open time of the last candle queued
+        self._status = self.DELAYED if self.p.backfill else self.LIVE
+        self.candle_ts = None
+        self.received = None
+        self.islivebar = False
+        self.error = None
+        self.put_notification(self._status)
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stopping.set()  # seen by the loop after its current call
+        self._thread.join(5)
+        super().stop()
+
+    def _load(self):
+        try:
+            item = self._queue.get(timeout=self._qcheck)
+        except queue.Empty:
+            return None
+        if item is None:  # the exchange ended or failed for good
+            self.put_notification(self.DISCONNECTED)
+            return False
+        if isinstance(item, int):  # status change
+            self._status = item
+            self.put_notification(item)
+            return self._load()
+        (ts, o, h, l, c, v), self.received, self.islivebar = item
+        self.candle_ts = ts
+        lines = self.lines
+        lines.datetime[0] = ms2num(ts)
+        lines.open[0] = o
+        lines.high[0] = h
+        lines.low[0] = l
+        lines.close[0] = c
+        lines.volume[0] = v
+        lines.openinterest[0] = 0.0
+        return True
+
+    # background thread
+
+    def _run(self):
+        loop = asyncio.new_event_loop()
+        try:
+            loop.run_until_complete(self._follow())
+        except EOFError:  # a simulator out of candles
+            pass
+        except Exception as e:
+            self.error = e
+        finally:
+            self._queue.put(None)
+            loop.close()
+
+    def _exchange(self):
+        exchange = self.p.exchange
+        if isinstance(exchange, str):
+            import ccxt.async_support as ccxt
+            exchange = getattr(ccxt, exchange)({'enableRateLimit': True})
+            self._owned = True
+        else:
+            self._owned = False
+        return exchange
+
+    def _put(self, candles, live):
+        """ Queues candles newer than the last one queued, closed ones only
+        """
+        now = self._ex.milliseconds()
+        received = time.perf_counter()
+        for i, candle in enumerate(candles):
+            ts = candle[0]
+            if self._lastts is not None and ts <= self._lastts:
+                continue
+            closed = i + 1 < len(candles) or ts + self._tfms <= now
+            if not closed:
+                break  # forming candle
+            self._queue.put((tuple(candle[:6]), received, live))
+            self._lastts = ts
+
+    async def _call(self, method, *args, **kwargs):
+        """ Exchange call retried on network errors
+        """
+        failures = 0
+        while True:
+            try:
+                return await getattr(self._ex, method)(*args, **kwargs)
+            except EOFError:
+                raise
+            except Exception:
+                failures += 1
+                if failures > self.p.retries or self._stopping.is_set():
+                    raise
+                await asyncio.sleep(self.p.retry * 2 ** failures)
+
+    async def _follow(self):
+        self._ex = ex = self._exchange()
+        try:
+            await self._backfill()
+            if self._status != self.LIVE:
+                self._queue.put(self.LIVE)
+            stream = self.p.stream
+            if stream is None:
+                stream = bool(getattr(ex, 'has', {}).get('watchOHLCV'))
+            if stream:
+                await self._watch()
+            else:
+                await self._poll()
+        finally:
+            if self._owned:
+                await ex.close()
+
+    async def _backfill(self):
+        if not self.p.backfill:
+            return
+        since = self._ex.milliseconds() - (self.p.backfill + 1) * self._tfms
+        while not self._stopping.is_set():
+            candles = await self._call(
+                'fetch_ohlcv', self.p.symbol, self.p.ccxt_timeframe,
+                since=since, limit=self.p.limit)
+            before = self._lastts
+            self._put(candles, live=False)
+            if self._lastts == before or len(candles) < self.p.limit:
+                return
+            since = self._lastts + self._tfms
+
+    async def _watch(self):
+        while not self._stopping.is_set():
+            candles = await self._call('watch_ohlcv', self.p.symbol,
+                                       self.p.ccxt_timeframe)
+            self._put(candles, live=True)
+
+    async def _poll(self):
+        ex = self._ex
+        # exchange ms per wall second, faster than 1000 on a simulator
+        scale = getattr(ex, 'timescale', 1.0) * 1000.0
+        while not self._stopping.is_set():
+            if self._lastts is None:
+                due = ex.milliseconds()
+            else:  # close of the candle after the last one
+                due = self._lastts + 2 * self._tfms
+            wait = (due - ex.milliseconds()) / scale
+            await asyncio.sleep(max(wait, 0.0) + self.p.polldelay)
+            since = None if self._lastts is None else self._lastts + self._tfms
+            last = self._lastts
+            while self._lastts == last and not self._stopping.is_set():
+                candles = await self._call(
+                    'fetch_ohlcv', self.p.symbol, self.p.ccxt_timeframe,
+                    since=since, limit=self.p.limit)
+                self._put(candles, live=True)
+                if self._lastts == last:
+                    await asyncio.sleep(self.p.retry)
+
+
+class SimulatedExchange:
+    """ Local exchange emitting one candle every 1 / ``rate`` seconds
+
+    Candles come from ``bars``, a (7, n) array ordered like feeds.COLUMNS
+    (e.g. SharedOHLCV.arrays), or from a random walk seeded with ``seed``.
+    ``history`` candles are closed already at its first call, the next
+    ones close one after the other from then on. ``latency`` seconds are added to
+    every call. ``emitted`` maps each candle's open time to the
+    perf_counter time it closed, ``calls`` counts the calls made.
+    Raises EOFError once the candles run out.
+    """
+
+    def __init__(self, bars=None, timeframe='1m', rate=10.0, history=500,
+                 count=10000, latency=0.0, seed=0, stream=True):
+        _, _, self.tfms = parse_timeframe(timeframe)
+        if bars is None:
+            rng = np.random.default_rng(seed)
+            n = history + count
+            close = 100.0 * np.exp(np.cumsum(rng.normal(0.0, 0.002, n)))
+            open_ = np.r_[close[0], close[:-1]]
+            spread = np.abs(rng.normal(0.0, 0.001, n)) * close
+            bars = np.vstack([np.zeros(n), open_,
+                              np.maximum(open_, close) + spread,
+                              np.minimum(open_, close) - spread, close,
+                              rng.uniform(1.0, 10.0, n), np.zeros(n)])
+        self.bars = np.asarray(bars)
+        self.rate = rate
+        self.history = min(history, self.bars.shape[1])
+        self.latency = latency
+        self.timescale = rate * self.tfms / 1000.0
+        self.has = {'fetchOHLCV': True, 'watchOHLCV': stream}
+        self.timeframes = {timeframe: timeframe}
+        self.calls = 0
+        self.emitted = {}
+        self.base = None
+        self.wall0 = None
+        self._watched = self.history - 1
+
+    def _start(self):
+        # candle 0 opens history candles before the start, on a tf boundary
+        self.base = int(time.time() * 1000) // self.tfms * self.tfms \
+            - self.history * self.tfms
+        self.wall0 = time.perf_counter()
+
+    def _closed(self, at=None):
+        """ Return number of closed candles at perf_counter time ``at``
+        """
+        at = time.perf_counter() if at is None else at
+        return min(self.history + int((at - self.wall0) * self.rate),
+                   self.bars.shape[1])
+
+    def _close_time(self, i):
+        """ Return perf_counter time candle i closes
+        """
+        return self.wall0 + (i + 1 - self.history) / self.rate
+
+    def milliseconds(self):
+        if self.wall0 is None:
+            self._start()
+        elapsed = time.perf_counter() - self.wall0
+        return int(round(self.base + self.history * self.tfms
+                         + elapsed * self.timescale * 1000.0))
+
+    def _candle(self, i):
+        bars = self.bars
+        ts = self.base + i * self.tfms
+        if i >= self.history and ts not in self.emitted:
+            self.emitted[ts] = self._close_time(i)
+        return [ts, float(bars[1, i]),
+                float(bars[2, i]), float(bars[3, i]), float(bars[4, i]),
+                float(bars[5, i])]
+
+    async def fetch_ohlcv(self, symbol, timeframe='1m', since=None,
+                          limit=None, params=None):
+        self.calls += 1
+        if self.wall0 is None:
+            self._start()
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        closed = self._closed()
+        if since is not None and since >= self.base + self.bars.shape[1] * \
+                self.tfms:
+            raise EOFError('simulated exchange out of candles')
+        first = 0 if since is None else max(
+            0, -(-(since - self.base) // self.tfms))
+        last = min(closed + 1, self.bars.shape[1])  # with the forming one
+        if limit:
+            if since is None:
+                first = max(first, last - limit)
+            last = min(last, first + limit)
+        return [self._candle(i) for i in range(first, last)]
+
+    async def watch_ohlcv(self, symbol, timeframe='1m', since=None,
+                          limit=None, params=None):
+        """ Waits for the next candle to close, returns it and the forming
+        candle like ccxt.pro
+        """
+        self.calls += 1
+        if self.wall0 is None:
+            self._start()
+        nxt = self._watched + 1
+        if nxt >= self.bars.shape[1]:
+            raise EOFError('simulated exchange out of candles')
+        wait = self._close_time(nxt) - time.perf_counter()
+        if wait > 0:
+            await asyncio.sleep(wait)
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        closed = self._closed()
+        candles = [self._candle(i) for i in range(nxt, closed)]
+        if closed < self.bars.shape[1]:
+            candles.append(self._candle(closed))
+        self._watched = closed - 1
+        return candles
+
+    async def close(self):
+        pass
+
+
+class LatencyRecorder(bt.Analyzer):
+    """ Records, for every live bar, the seconds from the candle's close
+    on a SimulatedExchange (``exchange``) to the feed getting it and to
+    the strategy having run on it, plus whether the strategy created
+    orders on it
+    """
+    params = (
+        ('exchange', None),
+    )
+
+    def start(self):
+        self.rows = []
+        self._orders = 0
+
+    def next(self):
+        data = self.data
+        orders = len(getattr(self.strategy.broker, 'orders', ()))
+        created, self._orders = orders > self._orders, orders
+        if not data.islivebar:
+            return
+        done = time.perf_counter()
+        closed = self.p.exchange.emitted.get(data.candle_ts)
+        if closed is None:
+            return
+        self.rows.append((data.received - closed, done - closed, created))
+
+    def stop(self):
+        rows = np.array(self.rows, dtype=np.float64).reshape(-1, 3)
+        self.rets['bars'] = len(rows)
+        for name, col in (('feed', 0), ('signal', 1)):
+            values = rows[:, col] * 1000.0
+            self.rets[name] = percentiles(values)
+        orders = rows[rows[:, 2] > 0, 1] * 1000.0
+        self.rets['order'] = percentiles(orders)
+
+
+def percentiles(values):
+    """ Return dict of p50/p95/p99/max of values, None when empty
+    """
+    if not len(values):
+        return None
+    p50, p95, p99 = np.percentile(values, (50, 95, 99))
+    return {'p50': p50, 'p95': p95, 'p99': p99, 'max': values.max(),
+            'count': len(values)}
+
+
+class _StopAfter(bt.Analyzer):
+    params = (
+        ('bars', 0),
+    )
+
+    def start(self):
+        self.live = 0
+
+    def next(self):
+        if self.data.islivebar:
+            self.live += 1
+            if self.live >= self.p.bars:
+                self.strategy.env.runstop()
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description='Bar -> signal -> order latency on a simulated exchange')
+    parser.add_argument('--strategy', default='sma_multi:SMAStrategy',
+                        help='Strategy as module:Class')
+    parser.add_argument('--rate', type=float, default=20.0,
+                        help='Candles per second the exchange emits')
+    parser.add_argument('--bars', type=int, default=200,
+                        help='Live bars to run')
+    parser.add_argument('--backfill', type=int, default=200,
+                        help='Candles backfilled at start')
+    parser.add_argument('--latency', type=float, default=0.0,
+                        help='Seconds added to every exchange call')
+    parser.add_argument('--poll', action='store_true',
+                        help='Poll fetch_ohlcv instead of watch_ohlcv')
+    parser.add_argument('--polldelay', type=float, default=0.002,
+                        help='With --poll, seconds after a candle is due '
+                             'to close it is first polled')
+    parser.add_argument('--max-p99', type=float, default=None, metavar='MS',
+                        help='Exit with status 1 if the p99 bar to signal '
+                             'latency exceeds MS milliseconds')
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    from distributed import load_strategy
+
+    args = parse_args()
+    strategy = load_strategy(args.strategy.split(':'))
+    exchange = SimulatedExchange(rate=args.rate, history=args.backfill,
+                                 count=args.bars + 10, latency=args.latency,
+                                 stream=not args.poll)
+    cerebro = bt.Cerebro(stdstats=False)
+    cerebro.adddata(CCXTLiveData(exchange=exchange, backfill=args.backfill,
+                                 polldelay=args.polldelay))
+    cerebro.addstrategy(strategy)
+    cerebro.addanalyzer(LatencyRecorder, _name='latency', exchange=exchange)
+    cerebro.addanalyzer(_StopAfter, bars=args.bars)
+    strat = cerebro.run()[0]
+    latency = strat.analyzers.latency.get_analysis()
+    print("{} live bars at {} bars/s, {} exchange calls ({})".format(
+        latency['bars'], args.rate, exchange.calls,
+        'polling' if args.poll else 'streaming'))
+    for name in ('feed', 'signal', 'order'):
+        stats = latency[name]
+        if stats is None:
+            print("{:>6}: no bars".format(name))
+            continue
+        print("{:>6}: p50 {:.3f}ms p95 {:.3f}ms p99 {:.3f}ms max {:.3f}ms "
+              "over {} bars".format(name, stats['p50'], stats['p95'],
+                                    stats['p99'], stats['max'],
+                                    stats['count']))
+    if args.max_p99 is not None and latency['signal'] is not None and \
+            latency['signal']['p99'] > args.max_p99:
+        sys.exit(1)
@@ -0,0 +1,149 @@
+"""Memory-bounded runs over long histories
+
+A normal run keeps every value of every line (datas, indicators,
+observers) for the whole run, so memory grows with the history. In a
+long run mode backtest:
+
+- line buffers hold only the last values something reads: Cerebro's
+  exactbars=1 sizes each line to the minimum period of what uses it, and
+  a strategy deriving from Lookback (before bt.Strategy) sizes its datas
+  to lookback(), the longest minimum period of its indicators, so next()
+  may read the datas as far back as the indicators do
+- datas are not preloaded, the stdstats observers are not added
+- the strategy's and the broker's histories of finished orders and
+  closed trades, which backtrader keeps for the whole run, are dropped
+  every ``prune`` bars (HistoryPruner)
+- the equity (analyzers.EquityRecorder) and the closed trades
+  (analyzers.TradeRecorder) are streamed to files of ``streamdir``,
+  the report reads them back from there
+
+    cerebro = LongRunCerebro('runs/turtle-1m')
+    cerebro.adddata(bt.feeds.GenericCSVData(dataname='btc-1m.csv', ...))
+    cerebro.addstrategy(turtle.Strategy)
+    cerebro.run()
+    cerebro.report('runs/turtle-1m')
+
+Peak memory is then the same for a thousand bars or hundreds of millions.
+Plotting needs the full buffers and is not available, nor are analyzers
+walking the datas at their end (AnnualReturn is left out of the 'full'
+analyzer profile).
+"""
+import os
+
+import backtrader as bt
+from backtrader.lineiterator import LineIterator
+
+from analyzers import TradeRecorder
+from report import Cerebro
+
+EQUITY_FILE = 'equity.f8'
+TRADES_FILE = 'trades.f8'
+
+
+def lookback(strat):
+    """ Return bars of history the indicators of strat need, plus its
+    ``lookback_extra``
+    """
+    periods = [ind._minperiod
+               for ind in strat._lineiterators[LineIterator.IndType]]
+    return (max(periods + [strat._minperiod])
+            + getattr(strat, 'lookback_extra', 0))
+
+
+class Lookback:
+    """ Strategy mixin sizing the data buffers of a memory saving run to
+    lookback(), see the module docstring
+    """
+    lookback_extra = 0  # bars next() reads beyond the indicators' lookback
+    lookback = 0  # buffer size of the datas, set at the start of the run
+
+    def qbuffer(self, savemem=0, replaying=False):
+        super().qbuffer(savemem=savemem, replaying=replaying)
+        if savemem > 0:
+            self.lookback = lookback(self)
+            for data in self.datas:
+                data.minbuffer(self.lookback)
+
+
+class HistoryPruner(bt.Analyzer):
+    """ Drops the finished orders and closed trades a strategy and its
+    broker keep, every ``every`` bars. The orders still alive and the
+    last trade of each data stay, notifications are not affected.
+    """
+    params = (
+        ('every', 10000),
+    )
+
+    def start(self):
+        self.pruned = 0
+
+    def next(self):
+        if len(self.strategy) % self.p.every:
+            return
+        strat = self.strategy
+        pruned = len(strat._orders)
+        del strat._orders[:]
+        broker = strat.broker
+        if isinstance(broker, bt.brokers.BackBroker):
+            pruned += self._prune_broker(broker)
+        for datatrades in strat._trades.values():
+            for trades in datatrades.values():
+                pruned += len(trades[:-1])
+                del trades[:-1]
+        self.pruned += pruned
+
+    def _prune_broker(self, broker):
+        alive = [order for order in broker.orders if order.alive()]
+        pruned = len(broker.orders) - len(alive)
+        broker.orders[:] = alive
+        # bracket and oco bookkeeping of finished orders, a single order
+        # leaves an empty children queue and a one order oco group. Without
+        # checksubmit live orders are not in broker.orders, only queued
+        refs = set(order.ref for order in alive)
+        refs.update(order.ref
+                    for queue in (broker.submitted, broker.pending,
+                                  broker._toactivate)
+                    for order in queue if order.alive())
+        refs.update([broker._ocos[ref] for ref in refs
+                     if ref in broker._ocos])
+        for pref in [pref for pref, pc in broker._pchildren.items()
+                     if not pc]:
+            del broker._pchildren[pref]
+        for mapping in (broker._ocos, broker._ocol):
+            for ref in [ref for ref in mapping if ref not in refs]:
+                del mapping[ref]
+        return pruned
+
+    def stop(self):
+        self.rets['pruned'] = self.pruned
+
+
+class LongRunCerebro(Cerebro):
+    """ report.Cerebro with bounded line buffers, streaming the recorded
+    equity and trades of a single run to ``streamdir`` (created if
+    needed) and pruning order and trade histories every ``prune`` bars.
+    Other arguments as report.Cerebro, whose exactbars is always 1 and
+    stdstats False.
+    """
+
+    def __init__(self, streamdir, analyzers='minimal', cache=None,
+                 prune=10000, **kwds):
+        os.makedirs(streamdir, exist_ok=True)
+        self.streamdir = streamdir
+        self.equity_path = os.path.join(streamdir, EQUITY_FILE)
+        self.trades_path = os.path.join(streamdir, TRADES_FILE)
+        self.equity_kwargs = {'path': self.equity_path}
+        super().__init__(analyzers=analyzers, cache=cache, **kwds)
+        self.p.exactbars = 1
+        self.p.stdstats = False
+        self.addanalyzer(TradeRecorder, _name='longTrades',
+                         path=self.trades_path)
+        self.addanalyzer(HistoryPruner, _name='longPruner', every=prune)
+
+    def add_report_analyzers(self, riskfree=0.01):
+        # AnnualReturn reads the whole datetime line when it stops
+        self.add_minimal_analyzers(riskfree=riskfree)
+
+    def plot(self, *args, **kwargs):
+        raise ValueError('plotting needs full line buffers, not available '
+                         'in a long run')
@@ -3,10 +3,21 @@ from __future__ import absolute_import, division, print_function, unicode_litera
 
 import argparse
 import datetime
+import io
+import os
 import random
 
 import backtrader as bt
 
+from cache import ResultCache
+from fastforward import FastForward
+from indicators import cached
+from longrun import Lookback, LongRunCerebro
+from optimize import SharedOHLCV
+from replay import ExecutionReplay
+from report import Cerebro
+from search import MODES, Search, Space
+
 BTVERSION = tuple(int(x) for x in bt.__version__.split("."))
 
 
@@ -28,7 +39,7 @@ class FixedPerc(bt.Sizer):
         return size
 
 
-class TheStrategy(bt.Strategy):
+class TheStrategy(FastForward, Lookback, bt.Strategy):
     """
     This strategy is loosely based on some of the examples from the Van
     K. Tharp book: *Trade Your Way To Financial Freedom*. The logic:
@@ -67,7 +78,8 @@ class TheStrategy(bt.Strategy):
             self.order = None  # indicate no order is pending
 
     def __init__(self):
-        self.macd = bt.indicators.MACD(
+        self.macd = cached(
+            bt.indicators.MACD,
             self.data,
             period_me1=self.p.macd1,
             period_me2=self.p.macd2,
@@ -78,15 +90,21 @@ class TheStrategy(bt.Strategy):
         self.mcross = bt.indicators.CrossOver(self.macd.macd, self.macd.signal)
 
         # To set the stop price
-        self.atr = bt.indicators.ATR(self.data, period=self.p.atrperiod)
+        self.atr = cached(bt.indicators.ATR, self.data, period=self.p.atrperiod)
 
         # Control market trend
-        self.sma = bt.indicators.SMA(self.data, period=self.p.smaperiod)
+        self.sma = cached(bt.indicators.SMA, self.data, period=self.p.smaperiod)
         self.smadir = self.sma - self.sma(-self.p.dirperiod)
 
     def start(self):
         self.order = None  # sentinel to avoid operrations on pending order
 
+    def wakeup(self):
+        # out of the market only entry bars matter, in the market every bar
+        # moves the stop (ffposition)
+        return ((self.ffarray(self.mcross) > 0.0)
+                & (self.ffarray(self.smadir) < 0.0))
+
     def next(self):
         if self.order:
             return  # pending order execution
@@ -111,11 +129,38 @@ class TheStrategy(bt.Strategy):
 
 DATASETS = {"yhoo": "./USD-BTC.csv"}
 
+# added by report.Cerebro for its cache, not printed
+REPORT_ANALYZERS = ("mySharpe", "myDrawDown", "myTradeAnalysis", "mySqn", "myEquity")
+
+
+def analyzers_text(strat):
+    """Return what print() of the analyzers of strat writes, but for the
+    report analyzers and those streamed to a file (long runs), printing
+    those would read the whole stream back
+    """
+    out = io.StringIO()
+    for name, alyzer in strat.analyzers.getitems():
+        if name in REPORT_ANALYZERS or getattr(alyzer.p, "path", None):
+            continue
+        alyzer.print(out=out)
+    return out.getvalue()
+
 
 def runstrat(args=None):
     args = parse_args(args)
 
-    cerebro = bt.Cerebro()
+    if args.longrun:
+        cerebro = LongRunCerebro(args.longrun)
+    else:
+        # reruns with unchanged code, data and params come from the cache
+        cache = None if args.no_cache else ResultCache(
+            os.path.join(os.path.dirname(os.path.abspath(__file__)), ".btcache")
+        )
+        cerebro = Cerebro(
+            analyzers="none" if cache is None else "minimal",
+            cache=cache,
+            cache_meta=lambda strat: {"analyzers": analyzers_text(strat)},
+        )
     cerebro.broker.set_cash(args.cash)
     comminfo = bt.commissions.CommInfo_Stocks_Perc(
         commission=args.commperc, percabs=True
@@ -135,6 +180,10 @@ def runstrat(args=None):
     # if dataset is None, args.data has been given
     dataname = DATASETS.get(args.dataset, args.data)
     data0 = bt.feeds.YahooFinanceCSVData(dataname=dataname, **dkwargs)
+    if args.search:
+        return search(args, data0)
+    if args.replay:
+        return replay_costs(args, data0)
     cerebro.adddata(data0)
 
     cerebro.addstrategy(
@@ -178,10 +227,17 @@ def runstrat(args=None):
     results = cerebro.run()
     st0 = results[0]
 
-    for alyzer in st0.analyzers:
-        alyzer.print()
+    if cerebro.cache_hit:
+        print(st0.meta["analyzers"], end="")
+    else:
+        print(analyzers_text(st0), end="")
+
+    if args.longrun:
+        print("Equity and trades written to {}".format(args.longrun))
 
-    if args.plot:
+    if args.plot and cerebro.cache_hit:
+        print("Result from the cache, plot it with --no-cache")
+    elif args.plot:
         pkwargs = dict(style="bar")
         if args.plot is not True:  # evals to True but is not True
             npkwargs = eval("dict(" + args.plot + ")")  # args were passed
@@ -190,6 +246,53 @@ def runstrat(args=None):
         cerebro.plot(**pkwargs)
 
 
+def search(args, data0):
+    # search params around their defaults instead of running them
+    space = Space.from_strategy(
+        TheStrategy, constraint=lambda p: p["macd1"] < p["macd2"]
+    )
+    with SharedOHLCV.from_feed(data0) as ohlcv:
+        searcher = Search(
+            TheStrategy,
+            ohlcv,
+            space,
+            seed=args.seed,
+            workers=args.workers,
+            cash=args.cash,
+            commission=args.commperc,
+            sizer=(FixedPerc, dict(perc=args.cashalloc)),
+        )
+        best = searcher.run(args.search, args.evals)
+    print(searcher.format_summary())
+    return best
+
+
+def replay_costs(args, data0):
+    # signals once, then only the broker for every cost/sizing config
+    params = dict(
+        macd1=args.macd1,
+        macd2=args.macd2,
+        macdsig=args.macdsig,
+        atrperiod=args.atrperiod,
+        atrdist=args.atrdist,
+        smaperiod=args.smaperiod,
+        dirperiod=args.dirperiod,
+    )
+    configs = [
+        dict(cash=cash, commission=commission, perc=perc)
+        for cash in args.cashes or [args.cash]
+        for commission in args.commpercs or [args.commperc]
+        for perc in args.cashallocs or [args.cashalloc]
+    ]
+    with SharedOHLCV.from_feed(data0) as ohlcv:
+        replayer = ExecutionReplay(
+            TheStrategy, ohlcv, FixedPerc, workers=args.workers
+        )
+        records = replayer.run([params], configs)
+    print(replayer.format_summary(records))
+    return records
+
+
 def parse_args(pargs=None):
 
     parser = argparse.ArgumentParser(
@@ -323,6 +426,95 @@ def parse_args(pargs=None):
         default=0.01,
         help=("Risk free rate in Perc (abs) of the asset for " "the Sharpe Ratio"),
     )
+    # Search options
+    parser.add_argument(
+        "--search",
+        required=False,
+        default=None,
+        choices=MODES,
+        help="Search the strategy params with this mode instead of a run",
+    )
+
+    parser.add_argument(
+        "--evals",
+        required=False,
+        action="store",
+        type=int,
+        default=50,
+        help=("Runs on all bars (candidates for halving) of the search"),
+    )
+
+    parser.add_argument(
+        "--workers",
+        required=False,
+        action="store",
+        type=int,
+        default=None,
+        help=("Search worker processes, defaults to the cpu count"),
+    )
+
+    parser.add_argument(
+        "--seed",
+        required=False,
+        action="store",
+        type=int,
+        default=None,
+        help=("Random seed of the search"),
+    )
+
+    # Cost/sizing replay options
+    parser.add_argument(
+        "--replay",
+        required=False,
+        action="store_true",
+        help=(
+            "Run the signals once and replay the orders for every "
+            "combination of --cashes, --commpercs and --cashallocs"
+        ),
+    )
+
+    parser.add_argument(
+        "--cashes",
+        required=False,
+        nargs="+",
+        type=float,
+        default=None,
+        help=("Starting cash values to replay, defaults to --cash"),
+    )
+
+    parser.add_argument(
+        "--commpercs",
+        required=False,
+        nargs="+",
+        type=float,
+        default=None,
+        help=("Commissions to replay, defaults to --commperc"),
+    )
+
+    parser.add_argument(
+        "--cashallocs",
+        required=False,
+        nargs="+",
+        type=float,
+        default=None,
+        help=("Cash allocations to replay, defaults to --cashalloc"),
+    )
+
+    parser.add_argument(
+        "--no-cache",
+        required=False,
+        action="store_true",
+        help=("Backtest even if the result cache has this run"),
+    )
+
+    parser.add_argument(
+        "--longrun",
+        required=False,
+        default=None,
+        metavar="DIR",
+        help=("Bounded memory run streaming equity and trades to DIR"),
+    )
+
     # Plot options
     parser.add_argument(
         "--plot",
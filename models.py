@@ -1,5 +1,4 @@
 import numpy as np
-from scipy import interpolate, stats
 
 class LineMemory:
     def __init__(self, memory_size):
@@ -39,6 +38,7 @@ class LineMemory:
         self.update_lowest()
 
     def get_interpolation(self):
+        from scipy import interpolate  # only loaded by the spline users
         x = np.arange(0, len(self.memory))
         y = self.memory
 
@@ -49,6 +49,7 @@ class LineMemory:
         return x, y, ynew, yder
 
     def get_linear_trend(self, memory):
+        from scipy import stats
         x = np.arange(0, len(memory))
         y = memory
 
@@ -0,0 +1,279 @@
+"""Parallel parameter sweeps over OHLCV arrays in shared memory
+
+The feed is parsed once by the parent and its bars are written to a file
+backed shared memory segment (/dev/shm when available). Workers of a
+process pool map that segment without copying, run chunks of parameter
+sets with one small Cerebro per run and send back only compact metric
+records, never strategy objects.
+"""
+import itertools
+import math
+import multiprocessing
+import os
+import tempfile
+import time
+import traceback
+
+import backtrader as bt
+import numpy as np
+
+import profiling
+from feeds import ArrayData, load_feed_arrays
+from stoprules import EarlyStop
+
+STRATEGY_METRICS = ('gross_profits', 'gross_losses', 'total_trades',
+                    'percent_profitable', 'profit_factor', 'max_drawdown',
+                    'max_profit')
+
+_attached = {}  # path -> memmap, one mapping per process
+
+
+class SharedOHLCV:
+    """ (7, n) float64 bars, rows ordered like feeds.COLUMNS, in a file
+    backed shared memory segment. Pickles as a handle, so passing it to
+    pool workers maps the same pages instead of copying the bars.
+    """
+
+    def __init__(self, path, shape, timeframe, compression, owner=False):
+        self.path = path
+        self.shape = tuple(shape)
+        self.timeframe = timeframe
+        self.compression = compression
+        self.owner = owner
+        if path not in _attached:
+            _attached[path] = np.memmap(path, dtype=np.float64, mode='r',
+                                        shape=self.shape)
+        self.arrays = _attached[path]
+
+    @classmethod
+    def create(cls, arrays, timeframe, compression, shmdir=None):
+        """ Copies arrays into a new shared segment owned by the caller
+        """
+        if shmdir is None:
+            shmdir = '/dev/shm' if os.path.isdir('/dev/shm') else None
+        fd, path = tempfile.mkstemp(prefix='btohlcv-', suffix='.f8',
+                                    dir=shmdir)
+        with os.fdopen(fd, 'wb') as f:
+            np.ascontiguousarray(arrays, dtype=np.float64).tofile(f)
+        return cls(path, arrays.shape, timeframe, compression, owner=True)
+
+    @classmethod
+    def from_feed(cls, data, shmdir=None):
+        """ Parses a backtrader feed once and shares its bars
+        """
+        arrays = load_feed_arrays(data)
+        return cls.create(arrays, data._timeframe, data._compression,
+                          shmdir=shmdir)
+
+    def __reduce__(self):
+        return (self.__class__,
+                (self.path, self.shape, self.timeframe, self.compression))
+
+    def __len__(self):
+        return self.shape[1]
+
+    def feed(self, start=0, stop=None, **kwargs):
+        """ Return ArrayData over bars[start:stop] without copying
+        """
+        return ArrayData(dataname=self.arrays, start=start, stop=stop,
+                         timeframe=self.timeframe,
+                         compression=self.compression, **kwargs)
+
+    def close(self):
+        """ Unmaps the segment, and removes it if this process created it
+        """
+        _attached.pop(self.path, None)
+        self.arrays = None
+        if self.owner and os.path.exists(self.path):
+            os.unlink(self.path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def param_grid(**axes):
+    """ Return list of params dicts for the product of all axes values
+    """
+    keys = list(axes)
+    return [dict(zip(keys, values))
+            for values in itertools.product(*axes.values())]
+
+
+def strategy_metrics(strat):
+    """ Return the result attributes the strategies in this repo keep,
+    plus the final broker value
+    """
+    metrics = {name: getattr(strat, name)
+               for name in STRATEGY_METRICS if hasattr(strat, name)}
+    metrics['final_value'] = strat.broker.getvalue()
+    return metrics
+
+
+def record_score(record, key):
+    """ Return record's ``key`` metric to maximize, -inf for a failed run
+    or a missing or NaN metric
+    """
+    value = record.get(key)
+    if record['status'] != 'ok' or value is None or value != value:
+        return -math.inf
+    return value
+
+
+def run_one(strategy, params, ohlcv, cash=100000.0, commission=0.0,
+            sizer=None, analyzers=(), metrics=strategy_metrics, start=0,
+            stop=None, profile=False, stop_rules=()):
+    """ Backtests strategy with params on ohlcv[start:stop] and returns
+    its compact result record. ``sizer`` is an optional (sizer class,
+    kwargs) pair, ``analyzers`` (analyzer class, kwargs) pairs for
+    ``metrics`` to read, ``profile`` adds the profiling.attach() phase
+    timings. A run ended by one of the stoprules ``stop_rules`` gets
+    status 'stopped' and partial metrics.
+    """
+    cerebro = bt.Cerebro(stdstats=False)
+    cerebro.adddata(ohlcv.feed(start, stop))
+    cerebro.addstrategy(strategy, **params)
+    cerebro.broker.setcash(cash)
+    cerebro.broker.setcommission(commission=commission)
+    if sizer is not None:
+        sizercls, sizerkw = sizer
+        cerebro.addsizer(sizercls, **sizerkw)
+    for ancls, ankw in analyzers:
+        cerebro.addanalyzer(ancls, **ankw)
+    if stop_rules:
+        cerebro.addanalyzer(EarlyStop, _name='earlystop', rules=stop_rules)
+    if profile:
+        profiling.attach(cerebro)
+    begin = time.perf_counter()
+    strat = cerebro.run()[0]
+    record = {'params': params, 'status': 'ok'}
+    record.update(metrics(strat))
+    record['wall_time'] = time.perf_counter() - begin
+    record['bars'] = len(strat.data)
+    record['worker'] = os.getpid()
+    if stop_rules:
+        stopped = strat.analyzers.earlystop.get_analysis()
+        if stopped['reason'] is not None:
+            record['status'] = 'stopped'
+            record['stop_reason'] = stopped['reason']
+            record['stop_bar'] = stopped['bar']
+    if profile:
+        record['profile'] = strat.analyzers.profiler.get_analysis()
+        record['bars_per_sec'] = record['profile']['bars_per_sec']
+        record['peak_rss'] = record['profile']['peak_rss']
+        if record['peak_rss'] is None:  # not resettable, whole worker
+            record['worker_peak_rss'] = record['profile']['worker_peak_rss']
+    return record
+
+
+def run_safe(strategy, params, ohlcv, **settings):
+    """ Like run_one, but an exception makes an 'error' status record
+    """
+    try:
+        return run_one(strategy, params, ohlcv, **settings)
+    except Exception:
+        return {'params': params, 'status': 'error',
+                'error': traceback.format_exc(limit=5),
+                'worker': os.getpid()}
+
+
+def _run_chunk(task):
+    """ Pool entry point, runs a chunk of (index, params, overrides)
+    sequentially
+    """
+    strategy, chunk, ohlcv, settings, errors = task
+    run = run_safe if errors == 'record' else run_one
+    return [(idx, run(strategy, params, ohlcv,
+                      **dict(settings, **(overrides or {}))))
+            for idx, params, overrides in chunk]
+
+
+class GridRunner:
+    """ Runs a strategy over a list of params dicts in a process pool
+
+    ``settings`` are passed to run_one: cash, commission, sizer,
+    analyzers, metrics, start, stop, profile and stop_rules. run() returns records in
+    grid order, worker_stats holds runs, bars, busy time and bars/sec per
+    worker pid and wall_time the seconds spent running, both summed over
+    the run() calls. With ``errors`` set
+    to 'record' a failing run gives an 'error' status record instead of
+    aborting the whole grid.
+    """
+
+    def __init__(self, strategy, ohlcv, workers=None, chunksize=None,
+                 errors='raise', **settings):
+        self.strategy = strategy
+        self.ohlcv = ohlcv
+        self.workers = workers or multiprocessing.cpu_count()
+        self.chunksize = chunksize
+        self.errors = errors
+        self.settings = settings
+        self.worker_stats = {}
+        self.wall_time = 0.0
+
+    def chunks(self, runs):
+        """ Return list of chunks of (index, params, overrides), about 4
+        per worker
+        """
+        items = [(idx, params, overrides)
+                 for idx, (params, overrides) in enumerate(runs)]
+        size = self.chunksize or max(
+            1, math.ceil(len(items) / (4.0 * self.workers)))
+        return [items[i:i + size] for i in range(0, len(items), size)]
+
+    def _collect(self, record):
+        if record['status'] == 'error':
+            return
+        stats = self.worker_stats.setdefault(
+            record['worker'], {'runs': 0, 'bars': 0, 'busy': 0.0})
+        stats['runs'] += 1
+        stats['bars'] += record['bars']
+        stats['busy'] += record['wall_time']
+        stats['bars_per_sec'] = stats['bars'] / max(stats['busy'], 1e-9)
+
+    def _consume(self, results, records):
+        for chunk in results:
+            for idx, record in chunk:
+                records[idx] = record
+                self._collect(record)
+
+    def run(self, grid):
+        """ Return list of result records, one per params dict of grid
+        """
+        return self.run_many([(params, None) for params in grid])
+
+    def run_many(self, runs):
+        """ Return list of result records for (params, overrides) pairs,
+        overrides being settings that differ per run, e.g. start and stop
+        """
+        tasks = [(self.strategy, chunk, self.ohlcv, self.settings,
+                  self.errors)
+                 for chunk in self.chunks(runs)]
+        records = [None] * len(runs)
+        begin = time.perf_counter()
+        if self.workers == 1:
+            self._consume(map(_run_chunk, tasks), records)
+        else:
+            with multiprocessing.Pool(self.workers) as pool:
+                self._consume(pool.imap_unordered(_run_chunk, tasks), records)
+        self.wall_time += time.perf_counter() - begin
+        return records
+
+    def format_stats(self):
+        """ Return human readable per worker throughput summary
+        """
+        lines = ["{:>8} {:>6} {:>10} {:>9} {:>10}".format(
+            'worker', 'runs', 'bars', 'busy (s)', 'bars/sec')]
+        for pid, stats in sorted(self.worker_stats.items()):
+            lines.append("{:>8} {:>6} {:>10} {:>9.2f} {:>10.0f}".format(
+                pid, stats['runs'], stats['bars'], stats['busy'],
+                stats['bars_per_sec']))
+        busy = sum(s['busy'] for s in self.worker_stats.values())
+        bars = sum(s['bars'] for s in self.worker_stats.values())
+        wall = max(self.wall_time, 1e-9)
+        lines.append("wall {:.2f}s, {:.0f} bars/sec, parallel speedup "
+                     "{:.2f}x on {} workers".format(
+                         wall, bars / wall, busy / wall, self.workers))
+        return '\n'.join(lines)
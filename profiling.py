@@ -0,0 +1,232 @@
+"""Per-run phase profiling of backtrader runs
+
+attach(cerebro) times a run without a profiler: wall and CPU time of
+preloading the datas, strategy setup, precomputing indicators (runonce),
+the next() loop, the analyzers called from it and stop, plus bars/sec
+and the peak RSS of the run. That is the process' high-water mark, reset
+when the run is attached on Linux (/proc/self/clear_refs); where it
+cannot be reset ``peak_rss`` is None and only ``worker_peak_rss``, the
+high-water mark of the whole process so far, is known. The result is a
+plain dict found in
+``strat.analyzers.profiler.get_analysis()`` and, for optimize.run_one
+with ``profile=True``, in ``record['profile']``.
+
+write_trace() exports profiled records in the Chrome trace event format,
+open it in chrome://tracing or https://ui.perfetto.dev to see every run
+of a sweep per worker on one timeline.
+"""
+import json
+import sys
+import time
+
+import backtrader as bt
+
+try:
+    import resource
+except ImportError:  # not available on Windows
+    resource = None
+
+PHASES = ('preload', 'setup', 'indicators', 'next', 'analyzers', 'stop')
+
+
+def peak_rss():
+    """ Return peak resident set size of this process in bytes since it
+    started or since reset_peak_rss(), or None
+    """
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+
+def reset_peak_rss():
+    """ Resets the peak RSS of this process to its current RSS, return
+    whether that is supported (Linux)
+    """
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+        return True
+    except OSError:
+        return False
+
+
+class Timings:
+    """ Accumulates wall and CPU seconds per phase and timeline spans
+    """
+
+    def __init__(self):
+        self.wall = dict.fromkeys(PHASES, 0.0)
+        self.cpu = dict.fromkeys(PHASES, 0.0)
+        self.spans = []  # (phase, start, duration) in perf_counter secs
+        self.last_end = None  # (wall, cpu) when the last timed call ended
+        # perf_counter -> epoch, to line up runs of several processes
+        self.epoch = time.time() - time.perf_counter()
+
+    def add(self, phase, wall, cpu):
+        self.wall[phase] += wall
+        self.cpu[phase] += cpu
+
+    def timed(self, phase, func, span=True):
+        """ Return func wrapped to add its run time to phase
+        """
+        def wrapper(*args, **kwargs):
+            wall, cpu = time.perf_counter(), time.process_time()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                end, cpu_end = time.perf_counter(), time.process_time()
+                self.add(phase, end - wall, cpu_end - cpu)
+                if span:
+                    self.spans.append((phase, wall, end - wall))
+                    self.last_end = (end, cpu_end)
+        return wrapper
+
+
+class RunProfiler(bt.Analyzer):
+    """ Instruments its strategy when the run starts, see attach()
+    """
+    params = (
+        ('timings', None),
+        ('rss_reset', False),  # peak RSS reset when the run was attached
+    )
+
+    def start(self):
+        timings = self.timings = self.p.timings or Timings()
+        strat = self.strategy
+        now = (time.perf_counter(), time.process_time())
+        if timings.last_end is not None:  # from end of preload to here
+            timings.add('setup', now[0] - timings.last_end[0],
+                        now[1] - timings.last_end[1])
+            timings.spans.append(('setup', timings.last_end[0],
+                                  now[0] - timings.last_end[0]))
+        self._loop_start = now
+        self._loop_end = None
+        self._runonce = strat.cerebro._dorunonce
+
+        def once(timed=timings.timed('indicators', strat._once)):
+            timed()
+            self._loop_start = timings.last_end
+
+        def stop(timed=timings.timed('stop', strat._stop)):
+            self._loop_end = (time.perf_counter(), time.process_time())
+            self._bars = len(strat.data)
+            timed()
+
+        strat._once = once
+        strat._stop = stop
+        strat._next_analyzers = timings.timed(
+            'analyzers', strat._next_analyzers, span=False)
+        if not self._runonce:
+            # indicators are computed bar by bar inside the next() loop
+            for ind in strat._lineiterators[bt.LineIterator.IndType]:
+                ind._next = timings.timed('indicators', ind._next,
+                                          span=False)
+
+    def get_analysis(self):
+        timings = self.timings
+        wall, cpu = dict(timings.wall), dict(timings.cpu)
+        spans = list(timings.spans)
+        if self._loop_end is not None:
+            # the loop minus what was timed inside of it
+            nested = ('analyzers',) if self._runonce else (
+                'analyzers', 'indicators')
+            loop_wall = self._loop_end[0] - self._loop_start[0]
+            wall['next'] = loop_wall - sum(wall[p] for p in nested)
+            cpu['next'] = (self._loop_end[1] - self._loop_start[1]
+                           - sum(cpu[p] for p in nested))
+            spans.append(('next', self._loop_start[0], loop_wall))
+        first = min(start for _, start, _ in spans)
+        last = max(start + duration for _, start, duration in spans)
+        wall['total'] = last - first
+        cpu['total'] = sum(cpu[p] for p in PHASES)
+        bars = getattr(self, '_bars', 0)
+        return {
+            'wall': wall,
+            'cpu': cpu,
+            'bars': bars,
+            'bars_per_sec': bars / max(wall['total'], 1e-9),
+            'peak_rss': peak_rss() if self.p.rss_reset else None,
+            'worker_peak_rss': None if self.p.rss_reset else peak_rss(),
+            'spans': [(phase, (timings.epoch + start) * 1e6, duration * 1e6)
+                      for phase, start, duration in spans],
+        }
+
+
+def attach(cerebro):
+    """ Instruments a cerebro before run(), returns its Timings
+    """
+    timings = Timings()
+    for data in cerebro.datas:
+        data.preload = timings.timed('preload', data.preload)
+    cerebro.addanalyzer(RunProfiler, _name='profiler', timings=timings,
+                        rss_reset=reset_peak_rss())
+    return timings
+
+
+def write_trace(records, path):
+    """ Writes profiled run records as a Chrome trace event file
+    """
+    events = []
+    for record in records:
+        profile = record.get('profile')
+        if not profile:
+            continue
+        pid = record.get('worker') or 0
+        label = json.dumps(record['params'], sort_keys=True, default=str)
+        spans = profile['spans']
+        start = min(ts for _, ts, _ in spans)
+        end = max(ts + dur for _, ts, dur in spans)
+        args = {'params': label, 'bars_per_sec': profile['bars_per_sec'],
+                'peak_rss': profile['peak_rss'],
+                'worker_peak_rss': profile.get('worker_peak_rss'),
+                'analyzers_ms': profile['wall']['analyzers'] * 1e3}
+        events.append({'name': label, 'cat': 'run', 'ph': 'X', 'ts': start,
+                       'dur': end - start, 'pid': pid, 'tid': 0,
+                       'args': args})
+        for phase, ts, dur in spans:
+            events.append({'name': phase, 'cat': 'phase', 'ph': 'X',
+                           'ts': ts, 'dur': dur, 'pid': pid, 'tid': 0})
+    with open(path, 'w') as f:
+        json.dump({'traceEvents': events, 'displayTimeUnit': 'ms'}, f)
+    return path
+
+
+def format_profile(records, top=5):
+    """ Return table of phase totals over records and the slowest runs
+    """
+    records = [r for r in records if r.get('profile')]
+    if not records:
+        return 'no profiled runs'
+    totals = dict.fromkeys(PHASES + ('total',), 0.0)
+    cpu = dict.fromkeys(PHASES + ('total',), 0.0)
+    for record in records:
+        for phase in totals:
+            totals[phase] += record['profile']['wall'][phase]
+            cpu[phase] += record['profile']['cpu'][phase]
+    lines = ["{:>12} {:>10} {:>10} {:>7}".format(
+        'phase', 'wall (s)', 'cpu (s)', 'share')]
+    for phase in PHASES + ('total',):
+        lines.append("{:>12} {:>10.3f} {:>10.3f} {:>6.1f}%".format(
+            phase, totals[phase], cpu[phase],
+            100.0 * totals[phase] / max(totals['total'], 1e-9)))
+    slowest = sorted(records, key=lambda r: r['profile']['wall']['total'],
+                     reverse=True)[:top]
+    lines.append('slowest runs:')
+    for record in slowest:
+        profile = record['profile']
+        rss, label = profile['peak_rss'], 'peak rss'
+        if rss is None:
+            rss, label = profile.get('worker_peak_rss'), 'worker peak rss'
+        lines.append("  {} {:.3f}s {:.0f} bars/sec {} {}".format(
+            record['params'], profile['wall']['total'],
+            profile['bars_per_sec'], label,
+            '{:.1f} MiB'.format(rss / 2.0 ** 20) if rss else 'n/a'))
+    return '\n'.join(lines)
@@ -0,0 +1,307 @@
+"""Execution-only re-simulation of recorded orders over cost/sizing sweeps
+
+Commission, sizing and starting cash change how a strategy's orders fill,
+not when its signals fire. ExecutionReplay runs the strategy once per
+params set with a broker that fills every order, recording the order
+intents (bar, buy or sell). Each cost/sizing config is then replayed from
+those intents with the arithmetic of backtrader's BackBroker only: no
+indicators, no strategy, no bar loop. All configs of a params set are
+replayed at once, as NumPy arrays over the configs.
+
+What the replay covers is what macd.py's TheStrategy does: long only,
+market orders filling at the open of the first bar with a later datetime
+than the bar they were created on (a bar repeating its timestamp is
+skipped, as backtrader does), entries sized with a percentage of the cash
+(macd.FixedPerc, through CommInfoBase.getsize) and exits closing the
+whole position, commission as a percentage of the traded value
+(broker.setcommission). A params set whose recorded orders fall outside
+of that, e.g. a second exit issued while the first is still pending, is
+marked ``unsupported`` and all its configs are run in full.
+
+A strategy whose decisions depend only on being in the market or not
+gives the same orders for every config, as long as every entry fills.
+A config where one would not (size 0, or not enough cash) took another
+path in a real run: it is run in full by a GridRunner instead, so every
+record matches a full backtest, ``replayed`` says which way it was made.
+"""
+import time
+
+import backtrader as bt
+import numpy as np
+
+from analyzers import EquityRecorder, TradeRecorder
+from optimize import GridRunner
+
+# cash of the record runs, fills any one unit entry
+RECORD_CASH = 1e12
+
+REPLAY_ANALYZERS = ((EquityRecorder, {'_name': 'replayEquity'}),
+                    (TradeRecorder, {'_name': 'replayTrades'}))
+
+
+class IntentRecorder(bt.Analyzer):
+    """ Records (bar, isbuy) of every order the strategy creates, bar
+    being the index of the bar it was created on, and counts the orders
+    that did not fill
+    """
+
+    def start(self):
+        self.rets['intents'] = []
+        self.rets['unfilled'] = 0
+        self.rets['exectypes'] = set()
+        self._seen = set()
+
+    def notify_order(self, order):
+        if order.ref not in self._seen:
+            self._seen.add(order.ref)
+            self.rets['intents'].append((order.plen - 1, order.isbuy()))
+            self.rets['exectypes'].add(order.exectype)
+        if order.status in (order.Canceled, order.Margin, order.Rejected,
+                            order.Expired):
+            self.rets['unfilled'] += 1
+
+
+def intent_metrics(strat):
+    return strat.analyzers.intents.get_analysis()
+
+
+def max_drawdown(values):
+    """ Return max drawdown in percent of the running peak of values
+    """
+    peak = np.maximum.accumulate(values)
+    return (100.0 * (peak - values) / peak).max()
+
+
+def execution_metrics(strat):
+    """ Metrics of a full run, the same the replay computes
+    """
+    equity = strat.analyzers.replayEquity.get_analysis()['value']
+    closed = strat.analyzers.replayTrades.get_analysis()['closed']
+    pnl = pnlcomm = 0.0
+    for _, tpnl, tpnlcomm in closed:
+        pnl += tpnl
+        pnlcomm += tpnlcomm
+    return {'final_value': strat.broker.getvalue(),
+            'trades': len(closed),
+            'pnl': pnl,
+            'pnlcomm': pnlcomm,
+            'max_drawdown': max_drawdown(equity)}
+
+
+def replay(intents, bars, cash, commission, perc):
+    """ Replays intents over (7, n) bars for arrays of configs
+
+    Return (metrics dict of arrays, filled), ``filled`` False for the
+    configs where an entry would not have filled.
+    """
+    opens, closes = bars[1], bars[4]
+    nbars = bars.shape[1]
+    # backtrader fills a market order on the first bar with a later
+    # datetime, which skips bars repeating the order bar's timestamp
+    fillbar = np.searchsorted(bars[0], bars[0], side='right')
+    cash, commission, perc = np.broadcast_arrays(
+        np.asarray(cash, dtype=np.float64),
+        np.asarray(commission, dtype=np.float64),
+        np.asarray(perc, dtype=np.float64))
+    cash = cash.copy()
+    nconf = len(cash)
+    size = np.zeros(nconf)
+    entry = np.zeros(nconf)
+    tradeprice = np.zeros(nconf)
+    opencomm = np.zeros(nconf)
+    pnl = np.zeros(nconf)
+    pnlcomm = np.zeros(nconf)
+    filled = np.ones(nconf, dtype=bool)
+    peak = cash.copy()
+    drawdown = np.zeros(nconf)
+    trades = 0
+    inmarket = False
+
+    def account(a, b):
+        # broker values of bars [a, b), cash and size constant
+        nonlocal peak, drawdown
+        if b <= a:
+            return
+        if inmarket:
+            # BackBroker._get_value, unrealized pnl out and back in
+            value = size[:, None] * closes[a:b]
+            unrealized = size[:, None] * (closes[a:b] - entry[:, None])
+            values = cash[:, None] + ((value - unrealized) + unrealized)
+        else:
+            values = cash[:, None]
+        running = np.maximum(np.maximum.accumulate(values, axis=1),
+                             peak[:, None])
+        drawdown = np.maximum(
+            drawdown, (100.0 * (running - values) / running).max(axis=1))
+        peak = running[:, -1]
+
+    last = 0
+    for bar, isbuy in intents:
+        execbar = fillbar[bar]
+        if execbar >= nbars:
+            break  # still pending at the end
+        account(last, execbar)
+        last = execbar
+        price = opens[execbar]
+        if isbuy:
+            # FixedPerc through getsize, and the broker's submit check at
+            # the creation close
+            size = np.floor_divide(perc * cash, closes[bar])
+            check = cash - size * closes[bar]
+            check -= size * commission * closes[bar]
+            filled &= (size > 0) & (check >= 0.0)
+            cash = cash - size * price
+            opencomm = size * commission * price
+            cash -= opencomm
+            filled &= cash >= 0.0
+            entry = np.full(nconf, price)
+            # Trade averages its price in, pnl is computed from that
+            with np.errstate(invalid='ignore'):
+                tradeprice = size * price / size
+            inmarket = True
+        else:
+            # BackBroker._execute closing a long position
+            gross = size * (price - entry)
+            cash = cash + (size * entry + gross)
+            closecomm = size * commission * price
+            cash -= closecomm
+            tradepnl = size * (price - tradeprice)
+            pnl += tradepnl
+            pnlcomm += tradepnl - (opencomm + closecomm)
+            trades += 1
+            size = np.zeros(nconf)
+            inmarket = False
+    account(last, nbars)
+
+    final = cash
+    if inmarket:
+        unrealized = size * (closes[-1] - entry)
+        final = cash + ((size * closes[-1] - unrealized) + unrealized)
+    return {'final_value': final,
+            'trades': np.full(nconf, trades),
+            'pnl': pnl,
+            'pnlcomm': pnlcomm,
+            'max_drawdown': drawdown}, filled
+
+
+class ExecutionReplay:
+    """ Records the orders of strategy for a grid of params dicts, then
+    replays them for configs, dicts of ``cash``, ``commission`` and
+    ``perc`` (of the cash for ``sizer`` to use, e.g. macd.FixedPerc)
+
+    ``settings`` go to the GridRunner of the record and fallback runs
+    (workers, start, stop). ``record_time`` and ``replay_time`` hold the
+    seconds spent in each stage, ``fallbacks`` the configs run in full.
+    """
+
+    def __init__(self, strategy, ohlcv, sizer, start=0, stop=None,
+                 **settings):
+        self.strategy = strategy
+        self.ohlcv = ohlcv
+        self.sizer = sizer
+        self.start = start
+        self.stop = stop
+        self.settings = dict(settings, start=start, stop=stop)
+        self.recorded = []
+        self.record_time = 0.0
+        self.replay_time = 0.0
+        self.fallbacks = 0
+
+    def record(self, grid):
+        """ Runs every params dict of grid once, returns and keeps the
+        records with their order intents
+        """
+        begin = time.perf_counter()
+        runner = GridRunner(
+            self.strategy, self.ohlcv, cash=RECORD_CASH,
+            analyzers=((IntentRecorder, {'_name': 'intents'}),),
+            metrics=intent_metrics, **self.settings)
+        self.recorded = runner.run(grid)
+        for record in self.recorded:
+            record['unsupported'] = self._unsupported(record)
+        self.record_time = time.perf_counter() - begin
+        return self.recorded
+
+    def _unsupported(self, record):
+        """ Return why the recorded orders cannot be replayed, or None
+        """
+        if record['unfilled']:
+            return '{} orders did not fill with {} cash'.format(
+                record['unfilled'], RECORD_CASH)
+        if record['exectypes'] - {bt.Order.Market}:
+            return 'non market orders'
+        sides = [isbuy for _, isbuy in record['intents']]
+        if sides[::2] != [True] * len(sides[::2]) or any(sides[1::2]):
+            return 'not long only entry/exit'
+        return None
+
+    def replay(self, configs):
+        """ Return list of records, one per recorded params and config,
+        in that order
+        """
+        begin = time.perf_counter()
+        configs = list(configs)
+        bars = np.asarray(self.ohlcv.arrays[:, self.start:self.stop])
+        cash = [config['cash'] for config in configs]
+        commission = [config['commission'] for config in configs]
+        perc = [config['perc'] for config in configs]
+        records, fallback = [], []
+        for recorded in self.recorded:
+            if recorded['unsupported']:
+                metrics, filled = {}, np.zeros(len(configs), dtype=bool)
+            else:
+                metrics, filled = replay(recorded['intents'], bars, cash,
+                                         commission, perc)
+            for i, config in enumerate(configs):
+                record = {'params': recorded['params'], 'status': 'ok',
+                          'replayed': bool(filled[i])}
+                record.update(config)
+                if filled[i]:
+                    record.update((key, values[i].item())
+                                  for key, values in metrics.items())
+                else:
+                    fallback.append((len(records), recorded['params'],
+                                     config))
+                records.append(record)
+        if fallback:
+            self._fallback(records, fallback)
+        self.replay_time = time.perf_counter() - begin
+        return records
+
+    def _fallback(self, records, fallback):
+        runner = GridRunner(self.strategy, self.ohlcv,
+                            analyzers=REPLAY_ANALYZERS,
+                            metrics=execution_metrics, **self.settings)
+        runs = [(params, {'cash': config['cash'],
+                          'commission': config['commission'],
+                          'sizer': (self.sizer, {'perc': config['perc']})})
+                for _, params, config in fallback]
+        for (idx, _, _), record in zip(fallback, runner.run_many(runs)):
+            for key in ('final_value', 'trades', 'pnl', 'pnlcomm',
+                        'max_drawdown'):
+                records[idx][key] = record[key]
+        self.fallbacks = len(fallback)
+
+    def run(self, grid, configs):
+        self.record(grid)
+        return self.replay(configs)
+
+    def format_summary(self, records, top=10):
+        """ Return table of the best records by final value plus timings
+        """
+        lines = ["{:>14} {:>8} {:>10} {:>6} {:>7} {:>8}  {}".format(
+            'final_value', 'cash', 'commission', 'perc', 'trades', 'maxdd%',
+            'params')]
+        for record in sorted(records, key=lambda r: -r['final_value'])[:top]:
+            lines.append(
+                "{:>14.2f} {:>8.0f} {:>10.4f} {:>6.2f} {:>7} {:>8.2f}  {}"
+                .format(record['final_value'], record['cash'],
+                        record['commission'], record['perc'],
+                        record['trades'], record['max_drawdown'],
+                        record['params']))
+        lines.append(
+            "{} runs recorded in {:.2f}s, {} configs replayed in {:.3f}s"
+            " ({} run in full)".format(
+                len(self.recorded), self.record_time, len(records),
+                self.replay_time, self.fallbacks))
+        return '\n'.join(lines)
@@ -1,16 +1,38 @@
 import backtrader as bt
 import sys
-import matplotlib.pyplot as plt
 import os
+import hashlib
+import shutil
 import pandas as pd
-from jinja2 import Environment, FileSystemLoader
-from weasyprint import HTML
+# matplotlib.pyplot, jinja2 and weasyprint are imported where a report is
+# rendered, backtests and sweep workers that render none don't load them
 from utils import timestamp2str, get_now, dir_exists
+from analyzers import EquityRecorder
+from cache import CachedResult
+from decimate import decimate_curve, cap_periods
+import report_server
+
+
+_template = None
+
+
+def get_template():
+    """ Return report template, compiled once per process
+    """
+    global _template
+    if _template is None:
+        from jinja2 import Environment, FileSystemLoader
+        basedir = os.path.abspath(os.path.dirname(__file__))
+        env = Environment(loader=FileSystemLoader(basedir))
+        _template = env.get_template("templates/template.html")
+    return _template
 
 
 class PerformanceReport:
     """ Report with performce stats for given backtest run
     """
+    max_points = 2000  # point budget of the equity curve chart
+    max_bars = 120  # bar budget of the return chart
 
     def __init__(self, stratbt, infilename,
                  outputdir, user, memo):
@@ -19,6 +41,7 @@ class PerformanceReport:
         self.outputdir = outputdir
         self.user = user
         self.memo = memo
+        self._recorded = None
         self.check_and_assign_defaults()
 
     def check_and_assign_defaults(self):
@@ -39,7 +62,7 @@ class PerformanceReport:
         """ Return dict with performace stats for given strategy withing backtest
         """
         st = self.stratbt
-        dt = st.data._dataname['open'].index
+        dt = self.get_recorded().index
         trade_analysis = st.analyzers.myTradeAnalysis.get_analysis()
         rpl = trade_analysis.pnl.net.total
         total_return = rpl / self.get_startcash()
@@ -77,13 +100,18 @@ class PerformanceReport:
                }
         return kpi
 
+    def get_recorded(self):
+        """ Return DataFrame with the bars recorded by EquityRecorder
+        """
+        if self._recorded is None:
+            recorder = self.stratbt.analyzers.myEquity
+            self._recorded = recorder.get_dataframe()
+        return self._recorded
+
     def get_equity_curve(self):
         """ Return series containing equity curve
         """
-        st = self.stratbt
-        dt = st.data._dataname['open'].index
-        value = st.observers.broker.lines[1].array[:len(dt)]
-        curve = pd.Series(data=value, index=dt)
+        curve = self.get_recorded()['value']
         return 100 * curve / curve.iloc[0]
 
     def _sqn2rating(self, sqn_score):
@@ -138,8 +166,9 @@ class PerformanceReport:
     def plot_equity_curve(self, fname='equity_curve.png'):
         """ Plots equity curve to png file
         """
-        curve = self.get_equity_curve()
-        buynhold = self.get_buynhold_curve()
+        import matplotlib.pyplot as plt
+        curve = decimate_curve(self.get_equity_curve(), self.max_points)
+        buynhold = decimate_curve(self.get_buynhold_curve(), self.max_points)
         xrnge = [curve.index[0], curve.index[-1]]
         dotted = pd.Series(data=[100, 100], index=xrnge)
         fig, ax = plt.subplots(1, 1)
@@ -157,7 +186,7 @@ class PerformanceReport:
         startdate = curve.index[0]
         enddate = curve.index[-1]
         time_interval = enddate - startdate
-        time_interval_days = time_interval.days
+        time_interval_days = time_interval.total_seconds() / 86400
         if time_interval_days > 5 * 365.25:
             periodicity = ('Yearly', 'Y')
         elif time_interval_days > 365.25:
@@ -169,8 +198,8 @@ class PerformanceReport:
         elif time_interval_days > 0.5:
             periodicity = ('Hourly', 'H')
         elif time_interval_days > 0.05:
-            periodicity = ('Per 15 Min', '15M')
-        else: periodicity = ('Per minute', '1M')
+            periodicity = ('Per 15 Min', '15T')
+        else: periodicity = ('Per minute', 'T')
         return periodicity
 
     def plot_return_curve(self, fname='return_curve.png'):
@@ -179,30 +208,41 @@ class PerformanceReport:
         curve = self.get_equity_curve()
         period = self._get_periodicity()
         values = curve.resample(period[1]).ohlc()['close']
+        values, merged = cap_periods(values.dropna(), self.max_bars)
         # returns = 100 * values.diff().shift(-1) / values
         returns = 100 * values.diff() / values
         returns.index = returns.index.date
         is_positive = returns > 0
+        import matplotlib.pyplot as plt
         fig, ax = plt.subplots(1, 1)
-        ax.set_title("{} returns".format(period[0]))
+        title = "{} returns".format(period[0])
+        if merged > 1:
+            title += " (compounded per {} periods)".format(merged)
+        ax.set_title(title)
         ax.set_xlabel("date")
         ax.set_ylabel("return (%)")
         _ = returns.plot.bar(color=is_positive.map({True: 'green', False: 'red'}), ax=ax)
         return fig
 
+    def get_image_paths(self):
+        """ Return paths of equity and return curve images in outputdir
+        """
+        outputdir = os.path.abspath(self.outputdir)
+        return (os.path.join(outputdir, 'equity_curve.png'),
+                os.path.join(outputdir, 'return_curve.png'))
+
     def generate_html(self):
         """ Returns parsed HTML text string for report
         """
-        basedir = os.path.abspath(os.path.dirname(__file__))
-        images = os.path.join(basedir, 'templates')
-        eq_curve = os.path.join(images, 'equity_curve.png')
-        rt_curve = os.path.join(images, 'return_curve.png')
+        import matplotlib.pyplot as plt
+        eq_curve, rt_curve = self.get_image_paths()
         fig_equity = self.plot_equity_curve()
         fig_equity.savefig(eq_curve)
+        plt.close(fig_equity)
         fig_return = self.plot_return_curve()
         fig_return.savefig(rt_curve)
-        env = Environment(loader=FileSystemLoader('.'))
-        template = env.get_template("templates/template.html")
+        plt.close(fig_return)
+        template = get_template()
         header = self.get_header_data()
         kpis = self.get_performance_stats()
         graphics = {'url_equity_curve': 'file://' + eq_curve,
@@ -215,28 +255,30 @@ class PerformanceReport:
     def generate_pdf_report(self):
         """ Returns PDF report with backtest results
         """
+        from weasyprint import HTML
         html = self.generate_html()
         outfile = os.path.join(self.outputdir, 'report.pdf')
         HTML(string=html).write_pdf(outfile)
         msg = "See {} for report with backtest results."
         print(msg.format(outfile))
+        return outfile
 
     def get_strategy_name(self):
         return self.stratbt.__class__.__name__
 
     def get_strategy_params(self):
-        return self.stratbt.cerebro.strats[0][0][-1]
+        return dict(self.stratbt.params._getkwargs())
 
     def get_start_date(self):
         """ Return first datafeed datetime
         """
-        dt = self.stratbt.data._dataname['open'].index
+        dt = self.get_recorded().index
         return timestamp2str(dt[0])
 
     def get_end_date(self):
         """ Return first datafeed datetime
         """
-        dt = self.stratbt.data._dataname['open'].index
+        dt = self.get_recorded().index
         return timestamp2str(dt[-1])
 
     def get_header_data(self):
@@ -253,49 +295,221 @@ class PerformanceReport:
                   }
         return header
 
-    def get_series(self, column='close'):
-        """ Return data series
+    def get_series(self, column='open'):
+        """ Return recorded series, one of EquityRecorder.COLUMNS
         """
-        return self.stratbt.data._dataname[column]
+        return self.get_recorded()[column]
 
     def get_buynhold_curve(self):
         """ Returns Buy & Hold equity curve starting at 100
         """
         s = self.get_series(column='open')
-        return 100 * s / s[0]
+        return 100 * s / s.iloc[0]
 
     def get_startcash(self):
         return self.stratbt.broker.startingcash
 
 
+class CachedReport(PerformanceReport):
+    """ Report rendered from a CachedResult instead of a strategy
+    """
+
+    def get_recorded(self):
+        return self.stratbt.recorded
+
+    def get_performance_stats(self):
+        return dict(self.stratbt.kpis)
+
+    def get_strategy_name(self):
+        return self.stratbt.meta['strategy_name']
+
+    def get_strategy_params(self):
+        return self.stratbt.meta['params']
+
+    def get_startcash(self):
+        return self.stratbt.meta['start_cash']
+
+
+ANALYZER_PROFILES = ('full', 'minimal', 'none')
+
+
 class Cerebro(bt.Cerebro):
-    def __init__(self, **kwds):
+    """ Cerebro engine extended with a report method
+
+    ``analyzers`` selects the analyzer profile:
+      - 'full': all report analyzers, attached at construction (default)
+      - 'minimal': only the analyzers read by PerformanceReport, attached
+        when a run can be reported (never during optimization). A report
+        requested without them re-runs the reported strategy once.
+      - 'none': no analyzers, report() is not available
+
+    With a ``cache`` (cache.ResultCache) single runs are looked up by the
+    hash of strategy source, params, data and broker settings. On a hit
+    run() returns [CachedResult] without backtesting and report() reuses
+    the stored PDF. Its meta holds the final broker value
+    (``final_value``) and what ``cache_meta``, a function of the
+    strategy returning a dict of JSON values, gave when it was stored.
+    """
+
+    equity_kwargs = {}  # params of the EquityRecorder of the report
+
+    def __init__(self, analyzers='full', cache=None, cache_meta=None,
+                 **kwds):
         super().__init__(**kwds)
-        self.add_report_analyzers()
+        if analyzers not in ANALYZER_PROFILES:
+            msg = "*** ERROR: analyzer profile {} not in {}."
+            print(msg.format(analyzers, ANALYZER_PROFILES))
+            sys.exit(0)
+        self.analyzer_profile = analyzers
+        self._report_analyzers = False
+        self.cache = cache
+        self.cache_meta = cache_meta
+        self.cache_key = None
+        self.cache_hit = False
+        if analyzers == 'full':
+            self.add_report_analyzers()
 
     def add_report_analyzers(self, riskfree=0.01):
-            """ Adds performance stats, required for report
-            """
-            self.addanalyzer(bt.analyzers.SharpeRatio,
-                             _name="mySharpe",
-                             riskfreerate=riskfree,
-                             timeframe=bt.TimeFrame.Months)
-            self.addanalyzer(bt.analyzers.DrawDown,
-                             _name="myDrawDown")
-            self.addanalyzer(bt.analyzers.AnnualReturn,
-                             _name="myReturn")
-            self.addanalyzer(bt.analyzers.TradeAnalyzer,
-                             _name="myTradeAnalysis")
-            self.addanalyzer(bt.analyzers.SQN,
-                             _name="mySqn")
+        """ Adds performance stats, required for report
+        """
+        self.add_minimal_analyzers(riskfree=riskfree)
+        self.addanalyzer(bt.analyzers.AnnualReturn,
+                         _name="myReturn")
+
+    def add_minimal_analyzers(self, riskfree=0.01):
+        """ Adds only the analyzers read by PerformanceReport
+        """
+        self.addanalyzer(bt.analyzers.SharpeRatio,
+                         _name="mySharpe",
+                         riskfreerate=riskfree,
+                         timeframe=bt.TimeFrame.Months)
+        self.addanalyzer(bt.analyzers.DrawDown,
+                         _name="myDrawDown")
+        self.addanalyzer(bt.analyzers.TradeAnalyzer,
+                         _name="myTradeAnalysis")
+        self.addanalyzer(bt.analyzers.SQN,
+                         _name="mySqn")
+        self.addanalyzer(EquityRecorder,
+                         _name="myEquity", **self.equity_kwargs)
+        self._report_analyzers = True
+
+    def run(self, **kwargs):
+        if (self.analyzer_profile == 'minimal'
+                and not self._report_analyzers
+                and not self._dooptimize):
+            self.add_minimal_analyzers()
+        if self.cache is None or self._dooptimize:
+            return super().run(**kwargs)
+        self.cache_key = self.cache.key(self, kwargs)
+        entry = self.cache.get(self.cache_key)
+        self.cache_hit = entry is not None
+        if entry is None:
+            runstrats = super().run(**kwargs)
+            self._cache_result(runstrats[0])
+            return runstrats
+        self.runstrats = [[entry]]
+        return [entry]
+
+    def _cache_result(self, strat):
+        """ Stores KPIs and recorded equity of strat in the cache
+        """
+        if not hasattr(strat.analyzers, 'myTradeAnalysis'):
+            return
+        rpt = PerformanceReport(strat, infilename=None,
+                                outputdir=self.cache.cachedir,
+                                user=None, memo=None)
+        try:
+            kpis = rpt.get_performance_stats()
+        except (ZeroDivisionError, TypeError):
+            return  # no closed trades, nothing worth caching
+        meta = {'strategy_name': rpt.get_strategy_name(),
+                'params': {k: str(v) for k, v in
+                           rpt.get_strategy_params().items()},
+                'start_cash': rpt.get_startcash(),
+                'final_value': strat.broker.getvalue()}
+        if self.cache_meta is not None:
+            meta.update(self.cache_meta(strat))
+        self.cache.put(self.cache_key, kpis, rpt.get_recorded(), meta)
 
     def get_strategy_backtest(self):
         return self.runstrats[0][0]
 
+    def _rerun_with_analyzers(self, strat):
+        """ Re-runs a single strategy with the minimal report analyzers
+        """
+        if not isinstance(strat, bt.Strategy):
+            print("*** ERROR: cannot report an optimization run "
+                  "with optreturn=True.")
+            sys.exit(0)
+        strats, dooptimize = self.strats, self._dooptimize
+        kwargs = dict(strat.params._getkwargs())
+        self.strats = [[(strat.__class__, (), kwargs)]]
+        self._dooptimize = False
+        try:
+            self.add_minimal_analyzers()
+            self.run()
+        finally:
+            self.strats, self._dooptimize = strats, dooptimize
+
     def report(self, outputdir,
-               infilename=None, user=None, memo=None):
+               infilename=None, user=None, memo=None, server=None):
+        """ Writes PDF report of the last run to outputdir, rendered by
+        the report_server listening on ``server`` if given
+        """
+        if self.analyzer_profile == 'none':
+            print("*** ERROR: report() needs analyzers, "
+                  "use analyzers='full' or 'minimal'.")
+            sys.exit(0)
         bt = self.get_strategy_backtest()
-        rpt =PerformanceReport(bt, infilename=infilename,
+        if isinstance(bt, CachedResult):
+            rpt = CachedReport(bt, infilename=infilename,
                                outputdir=outputdir, user=user,
                                memo=memo)
-        rpt.generate_pdf_report()
+            if self._report_from_cache(rpt):
+                return
+        else:
+            if not hasattr(bt.analyzers, 'myTradeAnalysis'):
+                self._rerun_with_analyzers(bt)
+                bt = self.get_strategy_backtest()
+            rpt = PerformanceReport(bt, infilename=infilename,
+                                    outputdir=outputdir, user=user,
+                                    memo=memo)
+        if server is None:
+            outfile = rpt.generate_pdf_report()
+        else:
+            outfile = self._report_from_server(rpt, server)
+        if self.cache_key is not None:
+            self.cache.put_artifact(self.cache_key,
+                                    self._artifact_name(rpt), outfile)
+
+    def _report_from_server(self, rpt, server):
+        """ Renders report in a running report_server, returns PDF path
+        """
+        payload = report_server.build_payload(rpt)
+        response = report_server.submit(server, payload)
+        if not response['ok']:
+            msg = "*** ERROR: report server failed: {}"
+            print(msg.format(response['error']))
+            sys.exit(0)
+        msg = "See {} for report with backtest results."
+        print(msg.format(response['report']))
+        return response['report']
+
+    def _artifact_name(self, rpt):
+        """ Return cache artifact name of the PDF for the report header
+        """
+        header = repr((rpt.infilename, rpt.user, rpt.memo)).encode('utf-8')
+        return 'report-{}.pdf'.format(hashlib.sha1(header).hexdigest())
+
+    def _report_from_cache(self, rpt):
+        """ Copies a cached PDF report to the outputdir, True if found
+        """
+        cached = self.cache.get_artifact(self.cache_key,
+                                         self._artifact_name(rpt))
+        if cached is None:
+            return False
+        outfile = os.path.join(rpt.outputdir, 'report.pdf')
+        shutil.copyfile(cached, outfile)
+        msg = "See {} for report with backtest results (cached)."
+        print(msg.format(outfile))
+        return True
@@ -0,0 +1,184 @@
+"""Long-lived local report rendering service
+
+Importing matplotlib, jinja2 and weasyprint and compiling the report
+template costs seconds, which dominates short backtests. The service keeps
+a pool of worker processes with all of that loaded and renders reports
+submitted over a Unix socket (or a localhost port) concurrently.
+
+    python report_server.py [--socket PATH | --port N] [--workers N]
+
+Backtests submit with ``Cerebro.report(outputdir, server=ADDRESS)``.
+Requests and responses are one JSON line each, arrays travel as base64
+encoded float64/int64 bytes.
+"""
+import argparse
+import base64
+import json
+import multiprocessing
+import os
+import socket
+import socketserver
+import sys
+import tempfile
+
+import numpy as np
+import pandas as pd
+
+DEFAULT_SOCKET = os.path.join(tempfile.gettempdir(), 'btreport.sock')
+
+
+def encode_array(array):
+    array = np.ascontiguousarray(array)
+    return {'dtype': array.dtype.str,
+            'data': base64.b64encode(array.tobytes()).decode('ascii')}
+
+
+def decode_array(encoded):
+    data = base64.b64decode(encoded['data'])
+    return np.frombuffer(data, dtype=np.dtype(encoded['dtype']))
+
+
+def build_payload(rpt):
+    """ Return JSON-able render request for a PerformanceReport
+    """
+    recorded = rpt.get_recorded()
+    arrays = {col: encode_array(recorded[col].values)
+              for col in recorded.columns}
+    arrays['index'] = encode_array(recorded.index.values.astype('int64'))
+    meta = {'strategy_name': rpt.get_strategy_name(),
+            'params': {k: str(v) for k, v in
+                       rpt.get_strategy_params().items()},
+            'start_cash': rpt.get_startcash()}
+    return {'kpis': rpt.get_performance_stats(),
+            'meta': meta,
+            'recorded': arrays,
+            'infilename': rpt.infilename,
+            'user': rpt.user,
+            'memo': rpt.memo,
+            'outputdir': os.path.abspath(rpt.outputdir)}
+
+
+def parse_address(address):
+    """ Return (family, address) for a socket path or 'host:port' string
+    """
+    if isinstance(address, tuple):
+        return socket.AF_INET, address
+    host, sep, port = address.rpartition(':')
+    if sep and port.isdigit() and os.path.sep not in address:
+        return socket.AF_INET, (host or '127.0.0.1', int(port))
+    return socket.AF_UNIX, address
+
+
+def submit(address, payload, timeout=300):
+    """ Sends a render request and returns the response dict
+    """
+    family, addr = parse_address(address)
+    with socket.socket(family, socket.SOCK_STREAM) as sock:
+        sock.settimeout(timeout)
+        sock.connect(addr)
+        rfile = sock.makefile('rb')
+        sock.sendall(json.dumps(payload, default=float).encode('utf-8')
+                     + b'\n')
+        return json.loads(rfile.readline().decode('utf-8'))
+
+
+def warm_up():
+    """ Loads heavy modules, compiled template and fonts into this process
+    """
+    import matplotlib
+    matplotlib.use('Agg')
+    import matplotlib.pyplot as plt
+    from matplotlib import font_manager
+    import report
+    report.get_template()
+    font_manager.findfont('DejaVu Sans')
+    plt.close(plt.figure())
+
+
+def render_payload(payload):
+    """ Renders a request in a warm worker, returns the response dict
+    """
+    from cache import CachedResult
+    from report import CachedReport
+    if not os.path.isdir(payload['outputdir']):
+        msg = 'outputdir {} does not exist'.format(payload['outputdir'])
+        return {'ok': False, 'error': msg}
+    arrays = {col: decode_array(enc)
+              for col, enc in payload['recorded'].items()}
+    index = pd.to_datetime(arrays.pop('index'), unit='ns')
+    recorded = pd.DataFrame(arrays, index=index)
+    entry = CachedResult(None, payload['kpis'], recorded, payload['meta'])
+    rpt = CachedReport(entry, infilename=payload['infilename'],
+                       outputdir=payload['outputdir'],
+                       user=payload['user'], memo=payload['memo'])
+    outfile = rpt.generate_pdf_report()
+    return {'ok': True, 'report': outfile,
+            'images': list(rpt.get_image_paths())}
+
+
+class RequestHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        line = self.rfile.readline()
+        if not line:
+            return
+        try:
+            payload = json.loads(line.decode('utf-8'))
+            response = self.server.pool.apply(render_payload, (payload,))
+        except Exception as e:
+            response = {'ok': False, 'error': repr(e)}
+        self.wfile.write(json.dumps(response).encode('utf-8') + b'\n')
+
+
+class UnixReportServer(socketserver.ThreadingMixIn,
+                       socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+class TCPReportServer(socketserver.ThreadingMixIn, socketserver.TCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+def make_server(address, workers):
+    """ Return report server listening on address with a warm worker pool
+    """
+    family, addr = parse_address(address)
+    if family == socket.AF_UNIX:
+        if os.path.exists(addr):
+            os.unlink(addr)
+        server = UnixReportServer(addr, RequestHandler)
+    else:
+        server = TCPReportServer(addr, RequestHandler)
+    server.pool = multiprocessing.Pool(workers, initializer=warm_up)
+    return server
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description='Warm report rendering service')
+    group = parser.add_mutually_exclusive_group()
+    group.add_argument('--socket', default=DEFAULT_SOCKET,
+                       help='Unix socket path to listen on')
+    group.add_argument('--port', type=int, default=None,
+                       help='Listen on this localhost port instead')
+    parser.add_argument('--workers', type=int,
+                        default=max(1, multiprocessing.cpu_count() // 2),
+                        help='Rendering processes')
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    args = parse_args()
+    address = args.socket if args.port is None else ('127.0.0.1', args.port)
+    server = make_server(address, args.workers)
+    print("Report server on {} with {} workers".format(address, args.workers))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.pool.terminate()
+        server.server_close()
+        if args.port is None and os.path.exists(args.socket):
+            os.unlink(args.socket)
+        sys.exit(0)
@@ -5,19 +5,29 @@ from __future__ import (
     unicode_literals
 )
 
+import argparse
 import datetime
 import os.path
 import sys
 
 import backtrader as bt
 
+from cache import ResultCache
+from report import Cerebro
+from stratlog import DEBUG, INFO, configure, get_logger
+from tickbars import TickBarData, parse_bars
+
 
 class RSIStrategy(bt.Strategy):
-    def log(self, txt, dt=None):
-        dt = dt or self.datas[0].datetime.date(0)
-        print("{}, {}".format(dt.isoformat(), txt))
+    def log(self, txt, *args, level=INFO, **fields):
+        """ Logs txt.format(*args) at the current bar if level is enabled
+        """
+        if level >= self.logger.level:
+            self.logger.log(level, txt, *args,
+                            dt=self.datas[0].datetime[0], **fields)
 
     def __init__(self):
+        self.logger = get_logger(type(self).__name__)
         self.dataclose = self.datas[0].close
         self.order = None
         self.buyprice = None
@@ -43,21 +53,19 @@ class RSIStrategy(bt.Strategy):
         if order.status in [order.Completed]:
             if order.isbuy():
                 self.log(
-                    "BUY EXECUTED, Price: {}, Cost: {}, Comm: {}".format(
-                        order.executed.price,
-                        order.executed.value,
-                        order.executed.comm,
-                    )
+                    "BUY EXECUTED, Price: {}, Cost: {}, Comm: {}",
+                    order.executed.price,
+                    order.executed.value,
+                    order.executed.comm,
                 )
                 self.buyprice = order.executed.price
                 self.buycomm = order.executed.comm
             else:  # Sell
                 self.log(
-                    "SELL EXECUTED, Price: {}, Cost: {}, Comm: {}".format(
-                        order.executed.price,
-                        order.executed.value,
-                        order.executed.comm,
-                    )
+                    "SELL EXECUTED, Price: {}, Cost: {}, Comm: {}",
+                    order.executed.price,
+                    order.executed.value,
+                    order.executed.comm,
                 )
 
             self.bar_executed = len(self)
@@ -85,20 +93,18 @@ class RSIStrategy(bt.Strategy):
         else:
             self.profit_factor = self.gross_profits / 1
 
-        self.log("ORDER PROFIT, GROSS: {}, NET: {}".format(
-                trade.pnl, trade.pnlcomm
-            )
-        )
+        self.log("ORDER PROFIT, GROSS: {}, NET: {}", trade.pnl, trade.pnlcomm)
 
     def next(self):
         # Simply log the closing price of the series from the reference
-        self.log("Today's Open: {}, High: {}, Low: {}, Close: {}, RSI: {}".format(
-            self.data_open[0],
-            self.data_high[0],
-            self.data_low[0],
-            self.dataclose[0],
-            self.rsi[0],
-        ))
+        if self.logger.isdebug:
+            self.log("Today's Open: {}, High: {}, Low: {}, Close: {}, RSI: {}",
+                     self.data_open[0],
+                     self.data_high[0],
+                     self.data_low[0],
+                     self.dataclose[0],
+                     self.rsi[0],
+                     level=DEBUG)
 
         # Check if an order is pending ... if yes, we cannot send a 2nd one
         if self.order:
@@ -107,45 +113,85 @@ class RSIStrategy(bt.Strategy):
         # Check if we are in the market
         if not self.position:
             if self.rsi[0] < 30:
-                self.log("CREATE BUY ORDER, {}".format(self.dataclose[0]))
+                self.log("CREATE BUY ORDER, {}", self.dataclose[0])
                 self.order = self.buy()
         else:
             if self.rsi[0] > 70:
-                self.log("CREATE SELL ORDER, {}".format(self.dataclose[0]))
+                self.log("CREATE SELL ORDER, {}", self.dataclose[0])
                 self.order = self.sell()
                 self.total_trades += 1
 
+    def results(self):
+        """ Return the result attributes printed at the end of a run
+        """
+        return {'gross_profits': self.gross_profits,
+                'gross_losses': self.gross_losses,
+                'total_trades': self.total_trades,
+                'percent_profitable': self.percent_profitable,
+                'profit_factor': self.profit_factor}
+
     def stop(self):
-        print("Total Gross Profit: {}, Losses: {}".format(
-            self.gross_profits, self.gross_losses
-        ))
-        print("Total Trades Closed: {}".format(self.total_trades))
-        print("Percent Profitable: {}".format(self.percent_profitable))
-        print("Profit Factor: {}".format(self.profit_factor))
+        print_results(self.results())
         super().stop()
 
 
+def print_results(results):
+    print("Total Gross Profit: {}, Losses: {}".format(
+        results['gross_profits'], results['gross_losses']
+    ))
+    print("Total Trades Closed: {}".format(results['total_trades']))
+    print("Percent Profitable: {}".format(results['percent_profitable']))
+    print("Profit Factor: {}".format(results['profit_factor']))
+
+
 if __name__ == '__main__':
-    cerebro = bt.Cerebro()
-    cerebro.addstrategy(RSIStrategy)
+    # orders and trades on stdout, bar by bar detail with BT_LOGLEVEL=DEBUG
+    configure(level=os.environ.get('BT_LOGLEVEL', 'INFO'))
+
+    parser = argparse.ArgumentParser(description='RSI strategy backtest')
+    parser.add_argument('--ticks', default=None, metavar='PATH',
+                        help='Run on bars aggregated from a tick file '
+                             'instead of the daily candles')
+    parser.add_argument('--bars', default='time:1d',
+                        help='With --ticks, time:TIMEFRAME, volume:SIZE or '
+                             'tick:COUNT bars')
+    parser.add_argument('--no-cache', action='store_true',
+                        help='Backtest even if the result cache has this run')
+    args = parser.parse_args()
 
     modpath = os.path.dirname(os.path.abspath(sys.argv[0]))
+    # reruns with unchanged code, data and params come from the cache
+    cache = None if args.no_cache else ResultCache(
+        os.path.join(modpath, '.btcache'))
+    cerebro = Cerebro(analyzers='none' if cache is None else 'minimal',
+                      cache=cache, cache_meta=lambda strat: strat.results())
+    cerebro.addstrategy(RSIStrategy)
     datapath = os.path.join(modpath, 'YHF-BTC-USD.csv')
 
-    data = bt.feeds.YahooFinanceCSVData(
-        dataname=datapath,
-        fromdate=datetime.datetime(2012, 1, 1),
-        todate=datetime.datetime(2019, 12, 31),
-        reverse=False)
+    if args.ticks:
+        bartype, barsize = parse_bars(args.bars)
+        data = TickBarData(dataname=args.ticks, bartype=bartype,
+                           barsize=barsize)
+    else:
+        data = bt.feeds.YahooFinanceCSVData(
+            dataname=datapath,
+            fromdate=datetime.datetime(2012, 1, 1),
+            todate=datetime.datetime(2019, 12, 31),
+            reverse=False)
 
     cerebro.adddata(data)
     cerebro.broker.setcash(100000.0)
     cerebro.broker.setcommission(commission=0.0)
     starting_cash = cerebro.broker.getvalue()
     print("Starting Portfolio Value: {}".format(starting_cash))
-    cerebro.run()
-    final_cash = cerebro.broker.getvalue()
+    strat = cerebro.run()[0]
+    if cerebro.cache_hit:
+        print_results(strat.meta)
+        final_cash = strat.meta['final_value']
+    else:
+        final_cash = cerebro.broker.getvalue()
     net_profit = final_cash - starting_cash
     print("Final Portfolio Value: {}".format(final_cash))
     print("Net Profit: {}".format(net_profit))
-    cerebro.plot()
+    if not cerebro.cache_hit:
+        cerebro.plot()
@@ -10,11 +10,12 @@ import datetime
 import os.path
 import sys
 
-import matplotlib.pyplot as plt
 import backtrader as bt
 
+from indicators import cached
 from models import DataMemory, LineMemory
 from report import Cerebro
+from stratlog import DEBUG, INFO, get_logger
 
 class RSIStrategy(bt.Strategy):
     images_dir = '/home/mfranco/Desktop/trading/backtrader-testing/images/test'
@@ -23,12 +24,15 @@ class RSIStrategy(bt.Strategy):
         ('memory_size', 5),
     )
 
-    def log(self, txt, dt=None, debug=False):
-        if debug:
-            dt = dt or self.datas[0].datetime.date(0)
-            print("{}, {}".format(dt.isoformat(), txt))
+    def log(self, txt, *args, level=INFO, **fields):
+        """ Logs txt.format(*args) at the current bar if level is enabled
+        """
+        if level >= self.logger.level:
+            self.logger.log(level, txt, *args,
+                            dt=self.datas[0].datetime[0], **fields)
 
     def __init__(self):
+        self.logger = get_logger(type(self).__name__)
         self.dataclose = self.datas[0].close
         self.order = None
         self.buyprice = None
@@ -47,7 +51,7 @@ class RSIStrategy(bt.Strategy):
         self.data_memory = DataMemory(self.memory_size)
         self.rsi_memory = LineMemory(self.memory_size)
 
-        self.rsi = rsi = bt.indicators.RSI(self.datas[0])
+        self.rsi = rsi = cached(bt.indicators.RSI, self.datas[0])
         #self.sma = bt.indicators.SmoothedMovingAverage(rsi, period=10)
 
     def notify_order(self, order):
@@ -60,21 +64,19 @@ class RSIStrategy(bt.Strategy):
         if order.status in [order.Completed]:
             if order.isbuy():
                 self.log(
-                    "BUY EXECUTED, Price: {}, Cost: {}, Comm: {}".format(
-                        order.executed.price,
-                        order.executed.value,
-                        order.executed.comm,
-                    )
+                    "BUY EXECUTED, Price: {}, Cost: {}, Comm: {}",
+                    order.executed.price,
+                    order.executed.value,
+                    order.executed.comm,
                 )
                 self.buyprice = order.executed.price
                 self.buycomm = order.executed.comm
             else:  # Sell
                 self.log(
-                    "SELL EXECUTED, Price: {}, Cost: {}, Comm: {}".format(
-                        order.executed.price,
-                        order.executed.value,
-                        order.executed.comm,
-                    )
+                    "SELL EXECUTED, Price: {}, Cost: {}, Comm: {}",
+                    order.executed.price,
+                    order.executed.value,
+                    order.executed.comm,
                 )
 
             self.bar_executed = len(self)
@@ -106,20 +108,18 @@ class RSIStrategy(bt.Strategy):
         else:
             self.profit_factor = self.gross_profits / 1
 
-        self.log("ORDER PROFIT, GROSS: {}, NET: {}".format(
-                trade.pnl, trade.pnlcomm
-            )
-        )
+        self.log("ORDER PROFIT, GROSS: {}, NET: {}", trade.pnl, trade.pnlcomm)
 
     def next(self):
         # Simply log the closing price of the series from the reference
-        self.log("Today's Open: {}, High: {}, Low: {}, Close: {}, RSI: {}".format(
-            self.data_open[0],
-            self.data_high[0],
-            self.data_low[0],
-            self.dataclose[0],
-            self.rsi[0],
-        ))
+        if self.logger.isdebug:
+            self.log("Today's Open: {}, High: {}, Low: {}, Close: {}, RSI: {}",
+                     self.data_open[0],
+                     self.data_high[0],
+                     self.data_low[0],
+                     self.dataclose[0],
+                     self.rsi[0],
+                     level=DEBUG)
 
         self.data_memory.push(
             open=self.data_open[0],
@@ -157,7 +157,7 @@ class RSIStrategy(bt.Strategy):
                     and price_slope < 0
                 ):
                 #if self.rsi[0] < 30:
-                    self.log("CREATE BUY ORDER, {}".format(self.dataclose[0]))
+                    self.log("CREATE BUY ORDER, {}", self.dataclose[0])
                     self.order = self.buy()
             else:
                 if (
@@ -166,7 +166,7 @@ class RSIStrategy(bt.Strategy):
                     and price_slope > 0
                 ):
                 #if self.rsi[0] > 70:
-                    self.log("CREATE SELL ORDER, {}".format(self.dataclose[0]))
+                    self.log("CREATE SELL ORDER, {}", self.dataclose[0])
                     self.order = self.sell()
                     self.total_trades += 1
 
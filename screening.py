@@ -0,0 +1,222 @@
+"""Vectorized screening of SMAStrategy (sma_multi.py) over a period grid
+
+SMAStrategy buys when sma_short > sma_long while flat and sells when
+sma_short < sma_long while long, with market orders filled at the next
+bar's open. That makes its position a hysteresis of the sign of
+sma_short - sma_long, so a whole grid can be evaluated with array
+operations: every SMA comes from one cumulative sum of the closes and the
+entries, exits and fill-at-next-open PnL of all pairs are computed in
+blocks of pairs at once.
+
+Like SMAStrategy, the model ignores the signal while an order is pending,
+that is until the order's fill bar, which differs from the next bar only
+when bars repeat a timestamp: the few rows where that drops a position
+change are rescanned event by event. It assumes orders are never rejected
+for lack of cash (true for the default stake of 1 and 100k cash on
+BTC-USD), a rejection is where it can still differ from backtrader;
+reconcile() confirms the top candidates with real backtrader runs.
+"""
+import math
+
+import numpy as np
+
+from optimize import GridRunner, STRATEGY_METRICS
+
+
+def sma_table(closes, periods):
+    """ Return {period: sma array}, NaN before the period is complete
+    """
+    csum = np.concatenate(([0.0], np.cumsum(closes, dtype=np.float64)))
+    n = len(closes)
+    smas = {}
+    for period in periods:
+        sma = np.full(n, np.nan)
+        sma[period - 1:] = (csum[period:] - csum[:-period]) / period
+        smas[period] = sma
+    return smas
+
+
+def _fsum_sma(closes, period, t):
+    """ Return sma at bar t exactly as backtrader's SMA computes it
+    """
+    return math.fsum(closes[t - period + 1:t + 1]) / period
+
+
+def _signal(diff, start):
+    """ Return int8 signal per bar for rows of sma differences: 1 where
+    diff > 0, 0 where diff < 0 or before ``start``, -1 where equal
+    """
+    rows, n = diff.shape
+    signal = np.full((rows, n), -1, dtype=np.int8)
+    signal[diff > 0] = 1
+    signal[diff < 0] = 0
+    cols = np.arange(n)
+    signal[cols[None, :] < start[:, None]] = 0  # next() not called yet
+    signal[:, 0] = np.where(signal[:, 0] < 0, 0, signal[:, 0])
+    return signal
+
+
+def _hysteresis(signal):
+    """ Return 0/1 position state per bar for rows of signals: 1 after a
+    1, 0 after a 0, previous state while -1
+    """
+    cols = np.arange(signal.shape[1])
+    last = np.where(signal >= 0, cols[None, :], 0)
+    np.maximum.accumulate(last, axis=1, out=last)
+    return np.take_along_axis(signal, last, axis=1)
+
+
+def _gated_events(signal, fillbar):
+    """ Return bars of the orders of one row of signals when the signal is
+    ignored from an order's bar until its fill bar, as SMAStrategy does
+    with a pending order
+    """
+    wanted = (np.flatnonzero(signal == 1), np.flatnonzero(signal == 0))
+    events = []
+    bar = 0
+    while bar < len(signal):
+        bars = wanted[len(events) % 2]  # an entry, then an exit, ...
+        k = np.searchsorted(bars, bar)
+        if k == len(bars):
+            break
+        events.append(bars[k])
+        bar = fillbar[bars[k]]
+    return events
+
+
+def _screen_block(pairs, smas, fillbar, opens, closes, cash, stake,
+                  commission):
+    """ Return list of metric dicts for a block of (short, long) pairs
+    """
+    n = len(closes)
+    rows = len(pairs)
+    shorts = np.array([smas[s] for s, _ in pairs])
+    longs = np.array([smas[l] for _, l in pairs])
+    diff = shorts - longs
+    # cumsum smas differ from backtrader's fsum ones in the last bits, so
+    # recompute near ties the way backtrader does, its sign decides there
+    near = np.abs(diff) <= 1e-9 * np.abs(longs)
+    for i, t in zip(*np.nonzero(near)):
+        short, long = pairs[i]
+        diff[i, t] = (_fsum_sma(closes, short, t)
+                      - _fsum_sma(closes, long, t))
+    start = np.array([max(s, l) - 1 for s, l in pairs])
+    signal = _signal(np.nan_to_num(diff), start)
+    state = _hysteresis(signal)
+
+    change = np.diff(state, axis=1, prepend=0)
+    row, bar = np.nonzero(change)  # orders issued at bar, row-major order
+    is_entry = change[row, bar] > 0
+    # a change before the previous order of its row filled is ignored by
+    # the strategy, rescan those rows honouring the pending orders
+    pending = (row[1:] == row[:-1]) & (bar[1:] < fillbar[bar[:-1]])
+    gated = np.unique(row[1:][pending])
+    if len(gated):
+        keep = ~np.isin(row, gated)
+        rescanned = [_gated_events(signal[i], fillbar) for i in gated]
+        row = np.concatenate([row[keep]] + [np.full(len(events), i)
+                              for i, events in zip(gated, rescanned)])
+        bar = np.concatenate([bar[keep]] + [np.array(events, dtype=bar.dtype)
+                              for events in rescanned])
+        is_entry = np.concatenate([is_entry[keep]] + [
+            np.arange(len(events)) % 2 == 0 for events in rescanned])
+        order = np.lexsort((bar, row))
+        row, bar, is_entry = row[order], bar[order], is_entry[order]
+    fill = fillbar[bar]
+    filled = fill < n
+    price = np.where(filled, opens[np.minimum(fill, n - 1)], np.nan)
+
+    # events of a row alternate entry, exit, entry, ... so every exit is
+    # preceded by its entry
+    exits = np.nonzero(~is_entry)[0]
+    closed = exits[filled[exits]]
+    pnl = stake * (price[closed] - price[closed - 1])
+    crow = row[closed]
+
+    total_trades = np.bincount(row[~is_entry], minlength=rows)
+    closed_trades = np.bincount(crow, minlength=rows)
+    wins = np.bincount(crow, weights=pnl > 0, minlength=rows)
+    gross_profits = np.bincount(crow, weights=np.where(pnl > 0, pnl, 0),
+                                minlength=rows)
+    gross_losses = -np.bincount(crow, weights=np.where(pnl > 0, 0, pnl),
+                                minlength=rows)
+    max_profit = np.zeros(rows)
+    np.maximum.at(max_profit, crow, pnl)
+    max_drawdown = np.zeros(rows)
+    np.minimum.at(max_drawdown, crow, pnl)
+
+    fills = filled.copy()
+    comm = np.bincount(row[fills], weights=stake * price[fills] * commission,
+                       minlength=rows)
+    value = cash + np.bincount(crow, weights=pnl, minlength=rows) - comm
+    # position still open at the end: the row's last event is a filled
+    # entry, or an exit issued on the last bar that never filled
+    last = np.nonzero(np.r_[row[1:] != row[:-1], True])[0] if len(row) else row
+    open_pos = np.r_[last[is_entry[last] & filled[last]],
+                     last[~is_entry[last] & ~filled[last]] - 1]
+    value[row[open_pos]] += stake * (closes[-1] - price[open_pos])
+
+    results = []
+    for i in range(rows):
+        losses = gross_losses[i]
+        results.append({
+            'gross_profits': gross_profits[i],
+            'gross_losses': losses,
+            'total_trades': int(total_trades[i]),
+            'percent_profitable': (wins[i] / closed_trades[i]
+                                   if closed_trades[i] else 0),
+            'profit_factor': (gross_profits[i] / losses if losses != 0
+                              else gross_profits[i]),
+            'max_drawdown': max_drawdown[i],
+            'max_profit': max_profit[i],
+            'final_value': value[i],
+        })
+    return results
+
+
+def screen_sma_pairs(arrays, pairs, cash=100000.0, stake=1,
+                     commission=0.0, max_cells=2**24):
+    """ Return GridRunner style records for every (short, long) pair
+
+    ``arrays`` is a (7, n) bars array ordered like feeds.COLUMNS, such as
+    SharedOHLCV.arrays. Pairs are evaluated in blocks of at most
+    ``max_cells`` pair-bars to bound memory.
+    """
+    opens = np.asarray(arrays[1], dtype=np.float64)
+    closes = np.asarray(arrays[4], dtype=np.float64)
+    # backtrader fills a market order on the first bar with a later
+    # datetime, which skips bars repeating the order bar's timestamp
+    datetimes = np.asarray(arrays[0], dtype=np.float64)
+    fillbar = np.searchsorted(datetimes, datetimes, side='right')
+    pairs = [tuple(pair) for pair in pairs]
+    smas = sma_table(closes, sorted({p for pair in pairs for p in pair}))
+    block = max(1, max_cells // max(len(closes), 1))
+    records = []
+    for i in range(0, len(pairs), block):
+        chunk = pairs[i:i + block]
+        metrics = _screen_block(chunk, smas, fillbar, opens, closes, cash,
+                                stake, commission)
+        for pair, metric in zip(chunk, metrics):
+            record = {'params': {'sma_period': pair}, 'status': 'screened'}
+            record.update(metric)
+            records.append(record)
+    return records
+
+
+def reconcile(strategy, ohlcv, records, top=5, key='final_value',
+              rtol=1e-6, **settings):
+    """ Reruns the ``top`` screened records with backtrader and returns
+    list of (screened, confirmed, mismatched metric names)
+    """
+    best = sorted(records, key=lambda record: record[key], reverse=True)
+    best = best[:top]
+    runner = GridRunner(strategy, ohlcv, **settings)
+    confirmed = runner.run([record['params'] for record in best])
+    checks = []
+    for screened, real in zip(best, confirmed):
+        names = STRATEGY_METRICS + ('final_value',)
+        bad = [name for name in names
+               if not np.isclose(screened[name], real[name], rtol=rtol,
+                                 atol=1e-6)]
+        checks.append((screened, real, bad))
+    return checks
@@ -0,0 +1,281 @@
+"""Adaptive parameter search over a strategy's params
+
+Exhaustive grids grow multiplicatively with every parameter, macd.py's
+seven params are out of reach. Search samples a Space instead:
+
+- random: n distinct random points
+- halving: successive halving, many candidates are run on a short slice
+  of the bars, the best 1/eta of them on a slice eta times longer, until
+  the survivors run on all bars
+- bayes: a gaussian process fitted to the results so far picks the points
+  with the highest expected improvement
+
+Runs go through optimize.GridRunner, so batches use all workers. Every
+mode reports how many runs it took and after how many the best result
+was found.
+"""
+import math
+import random
+
+import numpy as np
+
+from optimize import GridRunner, record_score
+from store import params_key
+
+MODES = ('random', 'halving', 'bayes')
+
+
+class Uniform:
+    """ Continuous parameter uniformly distributed in [low, high]
+    """
+
+    def __init__(self, low, high):
+        self.low = low
+        self.high = high
+
+    def __repr__(self):
+        return 'Uniform({!r}, {!r})'.format(self.low, self.high)
+
+
+class Space:
+    """ Search space, {param name: list/range of choices or Uniform}
+
+    ``constraint`` is an optional callable rejecting invalid params dicts,
+    e.g. lambda p: p['macd1'] < p['macd2'].
+    """
+
+    def __init__(self, dims, constraint=None):
+        self.dims = {name: dim if isinstance(dim, Uniform) else list(dim)
+                     for name, dim in dims.items()}
+        self.constraint = constraint
+
+    @classmethod
+    def from_strategy(cls, strategy, constraint=None, **dims):
+        """ Return Space over a strategy's numeric params: ints from half
+        to twice their default, floats likewise, overridden by ``dims``
+        """
+        space = {}
+        for name, default in strategy.params._getpairs().items():
+            if name in dims:
+                space[name] = dims[name]
+            elif isinstance(default, bool):
+                continue
+            elif isinstance(default, int):
+                space[name] = range(max(1, default // 2), 2 * default + 1)
+            elif isinstance(default, float):
+                space[name] = Uniform(default / 2.0, default * 2.0)
+        space.update(dims)
+        return cls(space, constraint=constraint)
+
+    def size(self):
+        """ Return number of points, inf with continuous dimensions
+        """
+        size = 1
+        for dim in self.dims.values():
+            if isinstance(dim, Uniform):
+                return math.inf
+            size *= len(dim)
+        return size
+
+    def sample(self, rng, tries=1000):
+        for _ in range(tries):
+            params = {}
+            for name, dim in self.dims.items():
+                if isinstance(dim, Uniform):
+                    params[name] = rng.uniform(dim.low, dim.high)
+                else:
+                    params[name] = rng.choice(dim)
+            if self.constraint is None or self.constraint(params):
+                return params
+        raise ValueError('no params satisfying the constraint found')
+
+    def encode(self, params):
+        """ Return params as a point of the unit cube, choices by index
+        """
+        point = []
+        for name, dim in self.dims.items():
+            if isinstance(dim, Uniform):
+                span = (dim.high - dim.low) or 1.0
+                point.append((params[name] - dim.low) / span)
+            else:
+                point.append(dim.index(params[name]) / max(len(dim) - 1, 1))
+        return point
+
+
+class Search:
+    """ Runs adaptive searches of a strategy over a Space
+
+    ``key`` is the record metric maximized, ``settings`` go to GridRunner
+    (workers, cash, commission, sizer, ...). Results of every run are kept
+    in ``history`` as (evaluation number, fraction of bars, record).
+    """
+
+    def __init__(self, strategy, ohlcv, space, key='final_value', seed=None,
+                 **settings):
+        self.strategy = strategy
+        self.ohlcv = ohlcv
+        self.space = space
+        self.key = key
+        self.rng = random.Random(seed)
+        # short halving slices can be shorter than indicator periods
+        self.runner = GridRunner(strategy, ohlcv, errors='record',
+                                 **settings)
+        self.history = []
+        self.bars = 0
+        self._seen = {}  # (params key, stop) -> record
+
+    @property
+    def evaluations(self):
+        return len(self.history)
+
+    def evaluate(self, batch, fraction=1.0):
+        """ Runs a batch of params dicts on the first ``fraction`` of the
+        bars, returns their records, reusing runs done before
+        """
+        stop = max(1, int(round(len(self.ohlcv) * fraction)))
+        if stop >= len(self.ohlcv):
+            stop, fraction = None, 1.0
+        todo = [p for p in batch if (params_key(p), stop) not in self._seen]
+        todo = list({params_key(p): p for p in todo}.values())
+        self.runner.settings['stop'] = stop
+        for record in self.runner.run(todo) if todo else ():
+            self._seen[params_key(record['params']), stop] = record
+            self.history.append((len(self.history) + 1, fraction, record))
+            self.bars += record.get('bars', 0)
+        return [self._seen[params_key(p), stop] for p in batch]
+
+    def _samples(self, n):
+        """ Return up to n distinct params dicts not evaluated on all bars
+        """
+        found = {}
+        limit = self.space.size()
+        for _ in range(max(20 * n, 1000)):
+            if len(found) >= n or len(found) + self._full_runs() >= limit:
+                break
+            params = self.space.sample(self.rng)
+            pkey = params_key(params)
+            if (pkey, None) not in self._seen:
+                found[pkey] = params
+        return list(found.values())
+
+    def _full_runs(self):
+        return sum(1 for _, stop in self._seen if stop is None)
+
+    def random(self, n):
+        """ Evaluates n random points, returns the best record
+        """
+        self.evaluate(self._samples(n))
+        return self.best()
+
+    def halving(self, n, eta=3, min_fraction=None):
+        """ Successive halving from n candidates, returns the best record
+
+        Rungs run the survivors on fractions of the bars growing by eta,
+        from ``min_fraction`` (default so that the last rung keeps about
+        one candidate) to all bars.
+        """
+        candidates = self._samples(n)
+        if min_fraction is None:
+            rungs = max(1, int(math.floor(math.log(max(n, 1), eta))))
+            min_fraction = float(eta) ** -rungs
+        fractions = []
+        fraction = min_fraction
+        while fraction < 1.0 - 1e-9:
+            fractions.append(fraction)
+            fraction *= eta
+        for fraction in fractions:
+            if len(candidates) <= 1:
+                break
+            records = self.evaluate(candidates, fraction)
+            ranked = sorted(zip(records, candidates),
+                            key=lambda rc: self._score(rc[0]), reverse=True)
+            keep = max(1, len(candidates) // eta)
+            candidates = [params for _, params in ranked[:keep]]
+        self.evaluate(candidates)
+        return self.best()
+
+    def bayes(self, n, init=None, batch=None, pool=2000, xi=0.01):
+        """ Gaussian process search with expected improvement, n runs in
+        total of which ``init`` random, returns the best record
+        """
+        batch = batch or self.runner.workers
+        init = init or max(5, 2 * len(self.space.dims))
+        self.evaluate(self._samples(min(init, n)))
+        while self._full_runs() < n:
+            full = [rec for _, f, rec in self.history
+                    if f >= 1.0 and rec['status'] == 'ok']
+            size = min(batch, n - self._full_runs())
+            if not full:
+                # nothing to fit yet, every run so far failed
+                samples = self._samples(size)
+                if not samples:
+                    break
+                self.evaluate(samples)
+                continue
+            x = np.array([self.space.encode(rec['params']) for rec in full])
+            y = np.array([self._score(rec) for rec in full])
+            candidates = self._samples(pool)
+            if not candidates:
+                break
+            xc = np.array([self.space.encode(p) for p in candidates])
+            ei = expected_improvement(x, y, xc, xi=xi)
+            picks = np.argsort(-ei)[:size]
+            self.evaluate([candidates[i] for i in picks])
+        return self.best()
+
+    def run(self, mode, n, **kwargs):
+        if mode not in MODES:
+            raise ValueError('unknown search mode {}'.format(mode))
+        return getattr(self, mode)(n, **kwargs)
+
+    def _score(self, record):
+        return record_score(record, self.key)
+
+    def best(self):
+        """ Return best record run on all bars
+        """
+        full = [rec for _, f, rec in self.history if f >= 1.0]
+        return max(full, key=self._score) if full else None
+
+    def evaluations_to_best(self):
+        """ Return number of runs done when the best record was found
+        """
+        best = self.best()
+        for number, fraction, record in self.history:
+            if record is best:
+                return number
+        return None
+
+    def format_summary(self):
+        best = self.best()
+        full_bars = len(self.ohlcv)
+        return ("{} runs ({:.1f} full run equivalents, space of {}), best "
+                "{} {} after {} runs with {}".format(
+                    self.evaluations, self.bars / max(full_bars, 1),
+                    self.space.size(), self.key,
+                    best and best.get(self.key), self.evaluations_to_best(),
+                    best and best['params']))
+
+
+def expected_improvement(x, y, xc, xi=0.01, length=0.2, noise=1e-6):
+    """ Return expected improvement at points xc of a gaussian process with
+    RBF kernel fitted to standardized scores y at points x
+    """
+    std = y.std() or 1.0
+    ys = (y - y.mean()) / std
+
+    def kernel(a, b):
+        d2 = ((a[:, None, :] - b[None, :, :]) ** 2).sum(axis=2)
+        return np.exp(-0.5 * d2 / length ** 2)
+
+    k = kernel(x, x) + noise * np.eye(len(x))
+    chol = np.linalg.cholesky(k)
+    alpha = np.linalg.solve(chol.T, np.linalg.solve(chol, ys))
+    kc = kernel(xc, x)
+    mean = kc @ alpha
+    v = np.linalg.solve(chol, kc.T)
+    sigma = np.sqrt(np.maximum(1.0 - (v ** 2).sum(axis=0), 1e-12))
+    from scipy import stats  # bayes mode only
+    improvement = mean - ys.max() - xi
+    z = improvement / sigma
+    return improvement * stats.norm.cdf(z) + sigma * stats.norm.pdf(z)
@@ -5,6 +5,7 @@ from __future__ import (
     unicode_literals
 )
 
+import argparse
 import csv
 import datetime
 import os.path
@@ -13,18 +14,34 @@ import time
 
 import backtrader as bt
 
+from distributed import DistributedRunner, parse_address
+from fastforward import FastForward
+from indicators import cached
+from optimize import GridRunner, SharedOHLCV
+from profiling import format_profile, write_trace
+from screening import reconcile, screen_sma_pairs
+from search import MODES, Search, Space
+from stoprules import EquityBelow, MaxDrawdown, MinTrades
+from store import ResultStore
+from stratlog import DEBUG, INFO, JsonlSink, configure, get_logger
+from sweep import ResumableSweep
+from walkforward import WalkForward
 
-class SMAStrategy(bt.Strategy):
+
+class SMAStrategy(FastForward, bt.Strategy):
     params = (
         ('sma_period', (10, 20)),
     )
 
-    def log(self, txt, dt=None, debug=False):
-        if debug:
-            dt = dt or self.datas[0].datetime.date(0)
-            print("{}, {}".format(dt.isoformat(), txt))
+    def log(self, txt, *args, level=INFO, **fields):
+        """ Logs txt.format(*args) at the current bar if level is enabled
+        """
+        if level >= self.logger.level:
+            self.logger.log(level, txt, *args,
+                            dt=self.datas[0].datetime[0], **fields)
 
     def __init__(self):
+        self.logger = get_logger(type(self).__name__)
         self.dataclose = self.datas[0].close
         self.order = None
         self.buyprice = None
@@ -39,10 +56,13 @@ class SMAStrategy(bt.Strategy):
         self.percent_profitable = 0
         self.profit_factor = 0
 
-        self.sma_short = bt.indicators.SimpleMovingAverage(
+        # the grid shares a few periods, compute each sma once per process
+        self.sma_short = cached(
+            bt.indicators.SimpleMovingAverage,
             self.datas[0], period=self.params.sma_period[0]
         )
-        self.sma_long = bt.indicators.SimpleMovingAverage(
+        self.sma_long = cached(
+            bt.indicators.SimpleMovingAverage,
             self.datas[0], period=self.params.sma_period[1]
         )
         #self.sma = bt.indicators.SimpleMovingAverage(
@@ -52,6 +72,12 @@ class SMAStrategy(bt.Strategy):
         #    self.datas[0], period=30
         #)
 
+    def wakeup(self):
+        if self.logger.isdebug:
+            return None  # logs every bar
+        # flat it buys whenever the short sma is above the long one
+        return self.ffarray(self.sma_short) > self.ffarray(self.sma_long)
+
     def notify_order(self, order):
         if order.status in [order.Submitted, order.Accepted]:
             # Buy/Sell order submitted/accepted to/by broker - Nothing to do
@@ -62,21 +88,19 @@ class SMAStrategy(bt.Strategy):
         if order.status in [order.Completed]:
             if order.isbuy():
                 self.log(
-                    "BUY EXECUTED, Price: {}, Cost: {}, Comm: {}".format(
-                        order.executed.price,
-                        order.executed.value,
-                        order.executed.comm,
-                    )
+                    "BUY EXECUTED, Price: {}, Cost: {}, Comm: {}",
+                    order.executed.price,
+                    order.executed.value,
+                    order.executed.comm,
                 )
                 self.buyprice = order.executed.price
                 self.buycomm = order.executed.comm
             else:  # Sell
                 self.log(
-                    "SELL EXECUTED, Price: {}, Cost: {}, Comm: {}".format(
-                        order.executed.price,
-                        order.executed.value,
-                        order.executed.comm,
-                    )
+                    "SELL EXECUTED, Price: {}, Cost: {}, Comm: {}",
+                    order.executed.price,
+                    order.executed.value,
+                    order.executed.comm,
                 )
 
             self.bar_executed = len(self)
@@ -108,19 +132,17 @@ class SMAStrategy(bt.Strategy):
         else:
             self.profit_factor = self.gross_profits / 1
 
-        self.log("ORDER PROFIT, GROSS: {}, NET: {}".format(
-                trade.pnl, trade.pnlcomm
-            )
-        )
+        self.log("ORDER PROFIT, GROSS: {}, NET: {}", trade.pnl, trade.pnlcomm)
 
     def next(self):
         # Simply log the closing price of the series from the reference
-        self.log("Today's Open: {}, High: {}, Low: {}, Close: {}".format(
-            self.data_open[0],
-            self.data_high[0],
-            self.data_low[0],
-            self.dataclose[0],
-        ))
+        if self.logger.isdebug:
+            self.log("Today's Open: {}, High: {}, Low: {}, Close: {}",
+                     self.data_open[0],
+                     self.data_high[0],
+                     self.data_low[0],
+                     self.dataclose[0],
+                     level=DEBUG)
 
         # Check if an order is pending ... if yes, we cannot send a 2nd one
         if self.order:
@@ -130,12 +152,12 @@ class SMAStrategy(bt.Strategy):
         if not self.position:
             #if self.dataclose[0] > self.sma[0]:
             if self.sma_short[0] > self.sma_long[0]:
-                self.log("CREATE BUY ORDER, {}".format(self.dataclose[0]))
+                self.log("CREATE BUY ORDER, {}", self.dataclose[0])
                 self.order = self.buy()
         else:
             #if self.dataclose[0] < self.sma[0]:
             if self.sma_short[0] < self.sma_long[0]:
-                self.log("CREATE SELL ORDER, {}".format(self.dataclose[0]))
+                self.log("CREATE SELL ORDER, {}", self.dataclose[0])
                 self.order = self.sell()
                 self.total_trades += 1
 
@@ -151,14 +173,80 @@ class SMAStrategy(bt.Strategy):
         super().stop()
 
 
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description='SMA crossover period grid sweep')
+    parser.add_argument('--screen', action='store_true',
+                        help='Evaluate the grid with the vectorized '
+                             'screening engine instead of backtrader runs')
+    parser.add_argument('--reconcile', type=int, default=0, metavar='N',
+                        help='With --screen, confirm the N best pairs with '
+                             'real backtrader runs')
+    parser.add_argument('--db', default='./results.db',
+                        help='SQLite result store runs are appended to')
+    parser.add_argument('--resume', action='store_true',
+                        help='Store each run as it finishes and skip runs '
+                             'already stored by an interrupted sweep')
+    parser.add_argument('--timeout', type=float, default=None,
+                        help='With --resume, seconds after which a run is '
+                             'killed and stored as timed out')
+    parser.add_argument('--search', default=None, choices=MODES,
+                        help='Search the period pairs adaptively instead '
+                             'of running the whole grid')
+    parser.add_argument('--evals', type=int, default=30,
+                        help='With --search, runs on all bars '
+                             '(candidates for halving)')
+    parser.add_argument('--profile', action='store_true',
+                        help='Time the phases of every run and print where '
+                             'the sweep spends its time')
+    parser.add_argument('--trace', default=None, metavar='PATH',
+                        help='With --profile, write a Chrome trace of the '
+                             'runs to PATH')
+    parser.add_argument('--max-drawdown', type=float, default=None,
+                        metavar='PCT',
+                        help='Stop a run once its drawdown exceeds PCT')
+    parser.add_argument('--min-equity', type=float, default=None,
+                        metavar='VALUE',
+                        help='Stop a run once its value falls below VALUE')
+    parser.add_argument('--min-trades', type=int, default=None, metavar='N',
+                        help='Stop a run once it can no longer close N '
+                             'trades')
+    parser.add_argument('--listen', default=None, metavar='HOST:PORT',
+                        help='Coordinate a distributed sweep, workers '
+                             'connect to HOST:PORT')
+    parser.add_argument('--local-workers', type=int, default=0,
+                        help='With --listen, worker processes to start on '
+                             'this host')
+    parser.add_argument('--authkey', default=None,
+                        help='With --listen, shared secret of the workers, '
+                             'default $BT_AUTHKEY, needed unless listening '
+                             'on a loopback address')
+    parser.add_argument('--log-level', default=None,
+                        help='Strategy log level, DEBUG logs every bar')
+    parser.add_argument('--log-file', default=None, metavar='PATH',
+                        help='Append strategy logs as JSON lines to PATH')
+    parser.add_argument('--walkforward', type=int, nargs=2, default=None,
+                        metavar=('TRAIN', 'TEST'),
+                        help='Walk-forward optimize with train and test '
+                             'windows of TRAIN and TEST bars')
+    parser.add_argument('--anchored', action='store_true',
+                        help='With --walkforward, train from the first bar '
+                             'instead of rolling windows')
+    parser.add_argument('--report', default=None, metavar='DIR',
+                        help='With --walkforward, write the out-of-sample '
+                             'PerformanceReport to DIR')
+    return parser.parse_args()
+
+
 if __name__ == '__main__':
+    args = parse_args()
+    configure(level=args.log_level,
+              sink=JsonlSink(args.log_file) if args.log_file else None)
     images_dir = '/home/mfranco/Desktop/trading/test_proj1/images'
     periods = []
     for i in range(5, 100, 5):
         for j in range(i + 5, 105, 5):
             periods.append((i, j))
-    cerebro = bt.Cerebro()
-    cerebro.optstrategy(SMAStrategy, sma_period=periods)
 
     modpath = os.path.dirname(os.path.abspath(sys.argv[0]))
     datapath = os.path.join(modpath, 'YHF-BTC-USD.csv')
@@ -169,13 +257,86 @@ if __name__ == '__main__':
         todate=datetime.datetime(2019, 12, 31),
         reverse=False)
 
-    cerebro.adddata(data)
-    cerebro.broker.setcash(100000.0)
-    cerebro.broker.setcommission(commission=0.0)
-    starting_cash = cerebro.broker.getvalue()
+    starting_cash = 100000.0
+    stop_rules = []
+    if args.max_drawdown is not None:
+        stop_rules.append(MaxDrawdown(args.max_drawdown))
+    if args.min_equity is not None:
+        stop_rules.append(EquityBelow(args.min_equity))
+    if args.min_trades is not None:
+        stop_rules.append(MinTrades(args.min_trades))
     print("Starting Portfolio Value: {}".format(starting_cash))
     start_time = time.time()
-    results = cerebro.run(optreturn=False)
+    # parse the data once, workers share it and only send back metrics
+    runner = None
+    checks = []
+    with SharedOHLCV.from_feed(data) as ohlcv:
+        if args.walkforward:
+            # warm up the indicators with the longest period before a window
+            walk = WalkForward(SMAStrategy, ohlcv,
+                               [{'sma_period': p} for p in periods],
+                               train=args.walkforward[0],
+                               test=args.walkforward[1],
+                               anchored=args.anchored,
+                               warmup=max(j for _, j in periods),
+                               cash=starting_cash, commission=0.0)
+            walk.run()
+            print(walk.format_folds())
+            stats = walk.get_performance_stats()
+            print("Out-of-sample Final Portfolio Value: {:.2f} "
+                  "(max drawdown {:.2f}%, {} trades)".format(
+                      walk.get_recorded()['value'].iloc[-1],
+                      stats['max_pct_drawdown'], stats['trades_closed']))
+            if args.report:
+                print("Report written to {}".format(
+                    walk.report(args.report, infilename=datapath)))
+            sys.exit(0)
+        if args.screen:
+            results = screen_sma_pairs(ohlcv.arrays, periods,
+                                       cash=starting_cash, commission=0.0)
+            if args.reconcile:
+                checks = reconcile(SMAStrategy, ohlcv, results,
+                                   top=args.reconcile, cash=starting_cash,
+                                   commission=0.0)
+        elif args.search:
+            searcher = Search(SMAStrategy, ohlcv,
+                              Space({'sma_period': periods}),
+                              cash=starting_cash, commission=0.0,
+                              profile=args.profile,
+                              stop_rules=stop_rules)
+            searcher.run(args.search, args.evals)
+            results = [record for _, fraction, record in searcher.history
+                       if fraction >= 1.0]
+            runner = searcher.runner
+        elif args.resume:
+            with ResultStore(args.db) as store:
+                runner = ResumableSweep(SMAStrategy, ohlcv, store,
+                                        timeout=args.timeout, note=datapath,
+                                        cash=starting_cash, commission=0.0,
+                                        profile=args.profile,
+                                        stop_rules=stop_rules)
+                results = runner.run([{'sma_period': p} for p in periods])
+        elif args.listen:
+            with DistributedRunner(SMAStrategy, ohlcv,
+                                   address=parse_address(args.listen),
+                                   authkey=(args.authkey.encode('utf-8')
+                                            if args.authkey else None),
+                                   local_workers=args.local_workers,
+                                   cash=starting_cash, commission=0.0,
+                                   profile=args.profile,
+                                   stop_rules=stop_rules) as runner:
+                print("Waiting for workers on {}:{}".format(*runner.address))
+                results = runner.run([{'sma_period': p} for p in periods])
+        else:
+            runner = GridRunner(SMAStrategy, ohlcv,
+                                cash=starting_cash, commission=0.0,
+                                profile=args.profile,
+                                stop_rules=stop_rules)
+            results = runner.run([{'sma_period': p} for p in periods])
+    stopped = [r for r in results if r['status'] == 'stopped']
+    failed = [r for r in results
+              if r['status'] not in ('ok', 'screened', 'stopped')]
+    results = [r for r in results if r['status'] in ('ok', 'screened')]
     elapsed_time = time.time() - start_time
     elapsed_time = time.strftime("%H:%M:%S", time.gmtime(elapsed_time))
     total_runs = ["TOTAL CASES"]
@@ -188,18 +349,20 @@ if __name__ == '__main__':
     max_drawdown = ["MAX DRAWDOWN"]
     max_profit = ["MAX PROFIT"]
     runtime = ["RUN TIME"]
-    for strat in results:
-        strat = strat[0]
+    for record in results:
         total_runs.append(str(len(periods)))
-        headers.append("PERIOD {}".format(strat.params.sma_period))
-        profits.append(strat.gross_profits)
-        losses.append(strat.gross_losses)
-        trades.append(strat.total_trades)
-        percent_profitable.append(strat.percent_profitable)
-        profit_factor.append(strat.profit_factor)
-        max_drawdown.append(strat.max_drawdown)
-        max_profit.append(strat.max_profit)
-        runtime.append(elapsed_time)
+        headers.append("PERIOD {}".format(record['params']['sma_period']))
+        profits.append(record['gross_profits'])
+        losses.append(record['gross_losses'])
+        trades.append(record['total_trades'])
+        percent_profitable.append(record['percent_profitable'])
+        profit_factor.append(record['profit_factor'])
+        max_drawdown.append(record['max_drawdown'])
+        max_profit.append(record['max_profit'])
+        if 'wall_time' in record:
+            runtime.append("{:.3f}s".format(record['wall_time']))
+        else:
+            runtime.append(elapsed_time)
     with open('./results.csv', 'w') as csvfile:
             writer = csv.writer(csvfile, delimiter=",")
             writer.writerow(total_runs)
@@ -212,11 +375,35 @@ if __name__ == '__main__':
             writer.writerow(max_drawdown)
             writer.writerow(max_profit)
             writer.writerow(runtime)
-    final_cash = cerebro.broker.getvalue()
-    net_profit = final_cash - starting_cash
-    print("Final Portfolio Value: {}".format(final_cash))
-    print("Net Profit: {}".format(net_profit))
-    #figures = cerebro.plot()
-    #for figure, period in zip(figures, periods):
-    #    figure[0].savefig("{}/sma-{}period.png".format(images_dir, period))
-
+    if not args.resume:
+        with ResultStore(args.db) as store:
+            sweep_id = store.begin_sweep(
+                SMAStrategy, data=datapath,
+                note='screened' if args.screen else None)
+            store.add_many(results + stopped, strategy=SMAStrategy,
+                           sweep_id=sweep_id)
+    for record in failed:
+        print("PERIOD {} {}".format(record['params']['sma_period'],
+                                    record['status'].upper()))
+    if stopped:
+        bars = sum(r['bars'] for r in results + stopped)
+        print("{} runs stopped early, {} bars run ({:.1f}% of the full "
+              "runs)".format(len(stopped), bars, 100.0 * bars / (
+                  (len(results) + len(stopped)) * len(ohlcv))))
+    if results:
+        best = max(results, key=lambda record: record['final_value'])
+        print("Best Final Portfolio Value: {} with PERIOD {}".format(
+            best['final_value'], best['params']['sma_period']))
+    for screened, real, bad in checks:
+        print("RECONCILE PERIOD {}: screened {} backtrader {} {}".format(
+            screened['params']['sma_period'], screened['final_value'],
+            real['final_value'], 'MISMATCH ' + ', '.join(bad) if bad else 'OK'))
+    if runner is not None:
+        print(runner.format_stats())
+    if args.search:
+        print(searcher.format_summary())
+    if args.profile:
+        print(format_profile(results))
+        if args.trace:
+            print("Trace written to {}".format(write_trace(results,
+                                                           args.trace)))
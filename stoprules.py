@@ -0,0 +1,120 @@
+"""Early termination of hopeless runs
+
+Stop rules are checked by the EarlyStop analyzer after every bar of a
+run. The first rule that triggers stops cerebro (runstop), the strategy
+and analyzers still get their stop() calls, so the run's metrics cover
+the bars up to that point. optimize.run_one takes the rules as
+``stop_rules`` and records such a run with status 'stopped', the rule
+in ``stop_reason`` and the bar it stopped at in ``stop_bar``.
+
+With runonce the indicators are still precomputed over all bars, the
+bar loop of strategy and analyzers is what a rule saves.
+
+A rule is any object with a check(state) method returning a reason
+string to stop or None, state being the EarlyStop analyzer with its
+``value``, ``peak``, ``drawdown`` (percent), ``closed`` and ``open``
+trade counts and ``remaining`` bars (None when the data is not
+preloaded). Rules keep no state of their own, so one rule object can be
+shared by all runs of a sweep.
+"""
+import backtrader as bt
+
+
+class MaxDrawdown:
+    """ Stops once the broker value is more than ``pct`` percent below its
+    peak
+    """
+
+    def __init__(self, pct):
+        self.pct = pct
+
+    def check(self, state):
+        if state.drawdown > self.pct:
+            return 'drawdown {:.2f}% > {}%'.format(state.drawdown, self.pct)
+        return None
+
+    def __repr__(self):
+        return 'MaxDrawdown({!r})'.format(self.pct)
+
+
+class EquityBelow:
+    """ Stops once the broker value is below ``value``
+    """
+
+    def __init__(self, value):
+        self.value = value
+
+    def check(self, state):
+        if state.value < self.value:
+            return 'equity {:.2f} < {}'.format(state.value, self.value)
+        return None
+
+    def __repr__(self):
+        return 'EquityBelow({!r})'.format(self.value)
+
+
+class MinTrades:
+    """ Stops once the run can no longer close ``count`` trades, assuming
+    a trade needs at least ``bars_per_trade`` bars to open and close
+    """
+
+    def __init__(self, count, bars_per_trade=2):
+        self.count = count
+        self.bars_per_trade = bars_per_trade
+
+    def check(self, state):
+        if state.remaining is None:
+            return None
+        possible = (state.closed + state.open
+                    + state.remaining // self.bars_per_trade)
+        if possible < self.count:
+            return 'at most {} of {} trades'.format(possible, self.count)
+        return None
+
+    def __repr__(self):
+        return 'MinTrades({!r}, bars_per_trade={!r})'.format(
+            self.count, self.bars_per_trade)
+
+
+class EarlyStop(bt.Analyzer):
+    """ Checks ``rules`` after every bar, stops the run when one triggers
+
+    get_analysis() holds the ``reason`` and ``bar`` of the stop, both None
+    for a run that went to its last bar.
+    """
+    params = (
+        ('rules', ()),
+    )
+
+    def start(self):
+        self.value = self.peak = self.strategy.broker.getvalue()
+        self.drawdown = 0.0
+        self.closed = 0
+        self.open = 0
+        self.remaining = None
+        self._preloaded = self.strategy.cerebro._dopreload
+        self.rets['reason'] = None
+        self.rets['bar'] = None
+
+    def notify_trade(self, trade):
+        if trade.justopened:
+            self.open += 1
+        if trade.isclosed:
+            self.open -= 1
+            self.closed += 1
+
+    def next(self):
+        self.value = value = self.strategy.broker.getvalue()
+        if value > self.peak:
+            self.peak = value
+        self.drawdown = (100.0 * (self.peak - value) / self.peak
+                         if self.peak > 0 else 0.0)
+        if self._preloaded:
+            self.remaining = self.data.buflen() - len(self.data)
+        for rule in self.p.rules:
+            reason = rule.check(self)
+            if reason is not None:
+                self.rets['reason'] = '{!r}: {}'.format(rule, reason)
+                self.rets['bar'] = len(self.data)
+                self.strategy.env.runstop()
+                break
@@ -0,0 +1,255 @@
+"""SQLite store accumulating optimization results, one row per run
+
+Every sweep appends to the same database instead of overwriting a csv, so
+thousands of sweeps stay queryable together. Records as produced by
+optimize.run_one are buffered and written in batched transactions; the
+common rankings and filters are served by indexes and iterate rows from a
+cursor without loading whole tables.
+
+    python store.py results.db --strategy SMAStrategy --top 10
+"""
+import argparse
+import json
+import os
+import sqlite3
+import time
+
+from optimize import STRATEGY_METRICS
+
+KPI_COLUMNS = STRATEGY_METRICS + ('final_value',)
+RUN_COLUMNS = (('sweep_id', 'INTEGER'), ('strategy', 'TEXT'),
+               ('params', 'TEXT'), ('status', 'TEXT')) + tuple(
+    (name, 'INTEGER' if name == 'total_trades' else 'REAL')
+    for name in KPI_COLUMNS) + (
+    ('wall_time', 'REAL'), ('bars', 'INTEGER'), ('worker', 'INTEGER'),
+    ('extra', 'TEXT'), ('created', 'REAL'))
+RUN_NAMES = frozenset(name for name, _ in RUN_COLUMNS)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS sweeps (
+    id INTEGER PRIMARY KEY,
+    key TEXT,
+    strategy TEXT,
+    data TEXT,
+    note TEXT,
+    created REAL
+);
+CREATE TABLE IF NOT EXISTS runs (
+    id INTEGER PRIMARY KEY,
+    {columns}
+);
+CREATE INDEX IF NOT EXISTS runs_sweep ON runs (sweep_id);
+CREATE INDEX IF NOT EXISTS runs_strategy_value
+    ON runs (strategy, final_value);
+CREATE INDEX IF NOT EXISTS runs_strategy_factor
+    ON runs (strategy, profit_factor);
+CREATE INDEX IF NOT EXISTS runs_strategy_trades
+    ON runs (strategy, total_trades);
+""".format(columns=',\n    '.join('{} {}'.format(*c) for c in RUN_COLUMNS))
+
+
+def _json_default(value):
+    if hasattr(value, 'item'):  # numpy scalars
+        return value.item()
+    return str(value)
+
+
+class ResultStore:
+    """ Appends run records to a SQLite database in batches of
+    ``batch_size``, call flush() or use it as a context manager to write
+    the remainder
+    """
+
+    def __init__(self, path='results.db', batch_size=500):
+        self.path = path
+        self.batch_size = batch_size
+        self.db = sqlite3.connect(path)
+        self.db.row_factory = sqlite3.Row
+        self.db.execute('PRAGMA journal_mode=WAL')
+        self.db.executescript(SCHEMA)
+        columns = [row['name'] for row in
+                   self.db.execute('PRAGMA table_info(sweeps)')]
+        if 'key' not in columns:  # databases from before resumable sweeps
+            self.db.execute('ALTER TABLE sweeps ADD COLUMN key TEXT')
+        self.db.execute('CREATE UNIQUE INDEX IF NOT EXISTS sweeps_key '
+                        'ON sweeps (key)')
+        self._pending = []
+
+    def begin_sweep(self, strategy, data=None, note=None, key=None):
+        """ Return id of a new sweep to group the runs that follow, or of
+        the existing sweep with the same ``key`` to resume it
+        """
+        if key is not None:
+            row = self.db.execute('SELECT id FROM sweeps WHERE key = ?',
+                                  (key,)).fetchone()
+            if row is not None:
+                return row['id']
+        with self.db:
+            cursor = self.db.execute(
+                'INSERT INTO sweeps (key, strategy, data, note, created) '
+                'VALUES (?, ?, ?, ?, ?)',
+                (key, _name(strategy), data, note, time.time()))
+        return cursor.lastrowid
+
+    def completed(self, sweep_id, statuses=None):
+        """ Return {params_key: run} of the runs stored for a sweep,
+        optionally only those with one of ``statuses``
+        """
+        done = {}
+        for run in self.query(sweep_id=sweep_id, order_by='id'):
+            if statuses is None or run['status'] in statuses:
+                done[params_key(run['params'])] = run
+        return done
+
+    def add(self, record, strategy=None, sweep_id=None):
+        """ Buffers one run record, writes the batch when it is full
+        """
+        extra = {k: v for k, v in record.items() if k not in RUN_NAMES}
+        row = [sweep_id, _name(strategy),
+               params_key(record['params']),
+               record.get('status', 'ok')]
+        row.extend(_number(record.get(name)) for name in KPI_COLUMNS)
+        row.extend([record.get('wall_time'), record.get('bars'),
+                    record.get('worker'),
+                    json.dumps(extra, default=_json_default) if extra
+                    else None,
+                    time.time()])
+        self._pending.append(row)
+        if len(self._pending) >= self.batch_size:
+            self.flush()
+
+    def add_many(self, records, strategy=None, sweep_id=None):
+        for record in records:
+            self.add(record, strategy=strategy, sweep_id=sweep_id)
+        self.flush()
+
+    def flush(self):
+        """ Writes buffered rows in one transaction
+        """
+        if not self._pending:
+            return
+        names = [name for name, _ in RUN_COLUMNS]
+        sql = 'INSERT INTO runs ({}) VALUES ({})'.format(
+            ', '.join(names), ', '.join('?' * len(names)))
+        with self.db:
+            self.db.executemany(sql, self._pending)
+        self._pending = []
+
+    def query(self, strategy=None, sweep_id=None, status=None, where=None,
+              args=(), order_by='final_value', descending=True, limit=None):
+        """ Yields run rows as dicts with params decoded, filtered by the
+        keyword filters and an optional SQL ``where`` fragment using
+        ``args`` placeholders
+        """
+        self.flush()
+        clause, values = _where(strategy, sweep_id, status, where, args)
+        sql = 'SELECT * FROM runs' + clause
+        if order_by:
+            if order_by not in RUN_NAMES and order_by != 'id':
+                raise ValueError('unknown column {}'.format(order_by))
+            sql += ' ORDER BY {} {}'.format(order_by,
+                                           'DESC' if descending else 'ASC')
+        if limit is not None:
+            sql += ' LIMIT ?'
+            values.append(int(limit))
+        for row in self.db.execute(sql, values):
+            yield _decode(row)
+
+    def top(self, n=10, key='final_value', **filters):
+        """ Return the n best runs by key
+        """
+        return list(self.query(order_by=key, limit=n, **filters))
+
+    def sweeps(self):
+        return [dict(row) for row in
+                self.db.execute('SELECT * FROM sweeps ORDER BY id')]
+
+    def count(self, strategy=None, sweep_id=None, status=None, where=None,
+              args=()):
+        self.flush()
+        clause, values = _where(strategy, sweep_id, status, where, args)
+        return self.db.execute('SELECT COUNT(*) FROM runs' + clause,
+                               values).fetchone()[0]
+
+    def close(self):
+        self.flush()
+        self.db.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def params_key(params):
+    """ Return canonical string of a params dict, tuples and lists alike
+    """
+    return json.dumps(params, sort_keys=True, default=_json_default)
+
+
+def _where(strategy, sweep_id, status, where, args):
+    """ Return (WHERE clause, placeholder values) for run filters
+    """
+    clauses, values = [], []
+    for column, value in (('strategy', _name(strategy)),
+                          ('sweep_id', sweep_id), ('status', status)):
+        if value is not None:
+            clauses.append('{} = ?'.format(column))
+            values.append(value)
+    if where:
+        clauses.append('({})'.format(where))
+        values.extend(args)
+    if not clauses:
+        return '', values
+    return ' WHERE ' + ' AND '.join(clauses), values
+
+
+def _name(strategy):
+    if strategy is None or isinstance(strategy, str):
+        return strategy
+    return strategy.__name__
+
+
+def _number(value):
+    return value.item() if hasattr(value, 'item') else value
+
+
+def _decode(row):
+    run = dict(row)
+    run['params'] = json.loads(run['params'])
+    if run['extra']:
+        run.update(json.loads(run['extra']))
+    del run['extra']
+    return run
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description='Query accumulated optimization results')
+    parser.add_argument('db', help='SQLite result database')
+    parser.add_argument('--strategy', default=None,
+                        help='Only runs of this strategy class')
+    parser.add_argument('--sweep', type=int, default=None,
+                        help='Only runs of this sweep id')
+    parser.add_argument('--where', default=None,
+                        help='Extra SQL filter, e.g. "total_trades >= 10"')
+    parser.add_argument('--key', default='final_value',
+                        help='Column to rank by')
+    parser.add_argument('--top', type=int, default=10,
+                        help='Number of runs to show')
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    args = parse_args()
+    if not os.path.exists(args.db):
+        raise SystemExit('{} does not exist'.format(args.db))
+    with ResultStore(args.db) as store:
+        columns = ('id', 'sweep_id', 'strategy', args.key, 'total_trades',
+                   'wall_time', 'params')
+        print('\t'.join(columns))
+        for run in store.query(strategy=args.strategy, sweep_id=args.sweep,
+                               where=args.where, order_by=args.key,
+                               limit=args.top):
+            print('\t'.join(str(run[c]) for c in columns))
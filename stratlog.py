@@ -0,0 +1,207 @@
+"""Structured strategy logging that costs nothing when it is off
+
+Strategies get a StrategyLogger with get_logger(). Its ``isdebug`` and
+``isinfo`` flags are plain attributes, checking one of them before a
+per-bar log call is the only work done while that level is off:
+
+    if self.logger.isdebug:
+        self.log("Close: {}, RSI: {}", self.dataclose[0], self.rsi[0],
+                 level=DEBUG)
+
+A message is a format string and its arguments, only the values are
+captured in next(), formatting and writing happen in the background
+thread of the sink, which writes in batches. JsonlSink writes one JSON
+object per line (datetime, level, logger, message plus any extra fields),
+TextSink the "date, message" lines the strategies used to print.
+
+The level and sink are set for all loggers with configure(), by default
+from the BT_LOGLEVEL (WARNING) and BT_LOGFILE (stdout) environment
+variables. A process forked after configure() restarts the sink thread
+the first time it logs.
+"""
+import atexit
+import json
+import logging
+import os
+import queue
+import sys
+import threading
+
+import backtrader as bt
+
+DEBUG = logging.DEBUG
+INFO = logging.INFO
+WARNING = logging.WARNING
+
+
+def _level(level):
+    if isinstance(level, str):
+        return logging.getLevelName(level.upper())
+    return level
+
+
+class TextSink:
+    """ Writes "date, message" lines to a stream from a background thread,
+    ``batch`` records at most per write
+    """
+
+    def __init__(self, stream=None, batch=1000):
+        self.stream = stream
+        self.batch = batch
+        self._pid = None
+
+    def _open(self):
+        return self.stream or sys.stdout
+
+    def _start(self):
+        self._queue = queue.SimpleQueue()
+        self._out = self._open()
+        self._thread = threading.Thread(target=self._drain, daemon=True)
+        self._pid = os.getpid()
+        self._thread.start()
+
+    def write(self, record):
+        """ Queues (logger name, level, datetime, message, args, fields)
+        """
+        if self._pid != os.getpid():
+            self._start()
+        self._queue.put(record)
+
+    def format(self, record):
+        name, level, dt, msg, args, fields = record
+        if args:
+            msg = msg.format(*args)
+        if dt is None:
+            return msg
+        return '{}, {}'.format(bt.num2date(dt).date().isoformat(), msg)
+
+    def _drain(self):
+        get, get_nowait = self._queue.get, self._queue.get_nowait
+        while True:
+            records = [get()]
+            try:
+                while len(records) < self.batch:
+                    records.append(get_nowait())
+            except queue.Empty:
+                pass
+            done = records[-1] is None
+            if done:
+                records.pop()
+            if records:
+                self._out.write(''.join(self.format(r) + '\n'
+                                        for r in records))
+                self._out.flush()
+            if done:
+                return
+
+    def close(self):
+        """ Writes what is queued and stops the thread
+        """
+        if self._pid == os.getpid():
+            self._queue.put(None)
+            self._thread.join()
+            if self._out is not self.stream and self._out is not sys.stdout:
+                self._out.close()
+        self._pid = None
+
+
+class JsonlSink(TextSink):
+    """ Writes records as JSON lines appended to ``path``
+    """
+
+    def __init__(self, path, batch=1000):
+        super().__init__(batch=batch)
+        self.path = path
+
+    def _open(self):
+        return open(self.path, 'a')
+
+    def format(self, record):
+        name, level, dt, msg, args, fields = record
+        line = {'datetime': (bt.num2date(dt).isoformat()
+                             if dt is not None else None),
+                'level': logging.getLevelName(level),
+                'logger': name,
+                'message': msg.format(*args) if args else msg}
+        line.update(fields)
+        return json.dumps(line, default=str)
+
+
+class StrategyLogger:
+    """ Logger of one strategy class, see the module docstring
+    """
+
+    def __init__(self, name, level=WARNING, sink=None):
+        self.name = name
+        self.sink = sink
+        self.setlevel(level)
+
+    def setlevel(self, level):
+        self.level = _level(level)
+        self.isdebug = self.level <= DEBUG
+        self.isinfo = self.level <= INFO
+
+    def log(self, level, msg, *args, dt=None, **fields):
+        """ Queues msg.format(*args) to the sink if level is enabled,
+        ``dt`` is a backtrader float datetime
+        """
+        if level < self.level:
+            return
+        self.sink.write((self.name, level, dt, msg, args, fields))
+
+    def debug(self, msg, *args, **kwargs):
+        if self.isdebug:
+            self.log(DEBUG, msg, *args, **kwargs)
+
+    def info(self, msg, *args, **kwargs):
+        if self.isinfo:
+            self.log(INFO, msg, *args, **kwargs)
+
+    def warning(self, msg, *args, **kwargs):
+        self.log(WARNING, msg, *args, **kwargs)
+
+
+_loggers = {}
+_config = {'level': os.environ.get('BT_LOGLEVEL', 'WARNING'), 'sink': None}
+
+
+def _default_sink():
+    path = os.environ.get('BT_LOGFILE')
+    return JsonlSink(path) if path else TextSink()
+
+
+def configure(level=None, sink=None):
+    """ Sets level and/or sink of all strategy loggers, the previous sink
+    is flushed and closed
+    """
+    if level is not None:
+        _config['level'] = level
+        for logger in _loggers.values():
+            logger.setlevel(level)
+    if sink is not None:
+        previous = _config['sink']
+        _config['sink'] = sink
+        for logger in _loggers.values():
+            logger.sink = sink
+        if previous is not None:
+            previous.close()
+
+
+def get_logger(name):
+    """ Return the StrategyLogger named name, e.g. a strategy class name
+    """
+    logger = _loggers.get(name)
+    if logger is None:
+        if _config['sink'] is None:
+            _config['sink'] = _default_sink()
+        logger = _loggers[name] = StrategyLogger(
+            name, level=_config['level'], sink=_config['sink'])
+    return logger
+
+
+@atexit.register
+def shutdown():
+    """ Flushes the sink, called at exit
+    """
+    if _config['sink'] is not None:
+        _config['sink'].close()
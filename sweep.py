@@ -0,0 +1,190 @@
+"""Checkpointed, resumable parameter sweeps
+
+ResumableSweep runs a grid like optimize.GridRunner but stores every
+result in a store.ResultStore as soon as it arrives. A sweep is identified
+by the strategy source, the bars and the run settings, so running the
+same sweep again skips the params already stored and only runs the rest.
+
+Workers are plain processes fed one params set at a time over a pipe, so
+the parent always knows what each one is running: a worker that dies is
+replaced and its params retried, one that exceeds ``timeout`` is killed
+and its params stored with status 'timeout', the others keep going.
+"""
+import collections
+import hashlib
+import multiprocessing
+import time
+from multiprocessing.connection import wait
+
+import numpy as np
+
+from cache import class_source
+from optimize import GridRunner, run_safe
+from store import params_key
+
+
+def sweep_key(strategy, ohlcv, settings):
+    """ Return key identifying a sweep: strategy source, bars, settings
+    """
+    sha = hashlib.sha256(class_source(strategy).encode('utf-8'))
+    sha.update(np.ascontiguousarray(ohlcv.arrays).tobytes())
+    sha.update(repr((ohlcv.timeframe, ohlcv.compression,
+                     sorted((k, repr(v)) for k, v in settings.items())))
+               .encode('utf-8'))
+    return sha.hexdigest()
+
+
+def _worker(conn, strategy, ohlcv, settings):
+    """ Worker process loop: receives (idx, params), sends (idx, record)
+    """
+    while True:
+        task = conn.recv()
+        if task is None:
+            break
+        idx, params = task
+        conn.send((idx, run_safe(strategy, params, ohlcv, **settings)))
+
+
+class _Slot:
+    """ One worker process with the task it is running, if any
+    """
+
+    def __init__(self, strategy, ohlcv, settings):
+        self.conn, child = multiprocessing.Pipe()
+        self.process = multiprocessing.Process(
+            target=_worker, args=(child, strategy, ohlcv, settings),
+            daemon=True)
+        self.process.start()
+        child.close()
+        self.task = None
+        self.started = None
+
+    def assign(self, task):
+        self.task = task
+        self.started = time.monotonic()
+        self.conn.send(task)
+
+    def stop(self, kill=False):
+        if kill:
+            self.process.kill()
+        else:
+            try:
+                self.conn.send(None)
+            except (BrokenPipeError, OSError):
+                pass
+        self.process.join(1)
+        if self.process.is_alive():
+            self.process.kill()
+            self.process.join()
+        self.conn.close()
+
+
+class ResumableSweep(GridRunner):
+    """ Runs a grid, persisting each record to ``store`` as it finishes
+
+    ``timeout`` is the per run limit in seconds (None for no limit),
+    ``retries`` how often params of a crashed worker are retried before
+    they are stored with status 'crashed'. ``rerun_failed`` reruns stored
+    params whose status is not 'ok' instead of skipping them.
+    """
+    poll = 0.5  # seconds between timeout checks
+
+    def __init__(self, strategy, ohlcv, store, workers=None, timeout=None,
+                 retries=1, rerun_failed=False, note=None, **settings):
+        super().__init__(strategy, ohlcv, workers=workers, **settings)
+        self.store = store
+        self.timeout = timeout
+        self.retries = retries
+        self.rerun_failed = rerun_failed
+        self.note = note
+        self.key = sweep_key(strategy, ohlcv, settings)
+        self.sweep_id = None
+        self.skipped = 0
+
+    def run(self, grid):
+        """ Return list of records, one per params dict of grid, stored
+        ones included
+        """
+        self.sweep_id = self.store.begin_sweep(
+            self.strategy, data=self.ohlcv.path, note=self.note,
+            key=self.key)
+        done = self.store.completed(
+            self.sweep_id, statuses=('ok',) if self.rerun_failed else None)
+        records = [None] * len(grid)
+        pending = collections.deque()
+        for idx, params in enumerate(grid):
+            stored = done.get(params_key(params))
+            if stored is not None:
+                records[idx] = dict(stored, params=params)
+            else:
+                pending.append((idx, params))
+        self.skipped = len(grid) - len(pending)
+
+        begin = time.perf_counter()
+        if pending:
+            self._run_pending(pending, records)
+        self.wall_time += time.perf_counter() - begin
+        return records
+
+    def _save(self, idx, record, records):
+        records[idx] = record
+        self.store.add(record, strategy=self.strategy, sweep_id=self.sweep_id)
+        self.store.flush()
+        if record['status'] in ('ok', 'stopped'):
+            self._collect(record)
+
+    def _run_pending(self, pending, records):
+        attempts = collections.Counter()
+        nslots = min(self.workers, len(pending))
+        slots = [_Slot(self.strategy, self.ohlcv, self.settings)
+                 for _ in range(nslots)]
+        try:
+            while pending or any(slot.task for slot in slots):
+                for slot in slots:
+                    if slot.task is None and pending:
+                        slot.assign(pending.popleft())
+                busy = [slot for slot in slots if slot.task]
+                ready = wait([slot.conn for slot in busy]
+                             + [slot.process.sentinel for slot in busy],
+                             timeout=self.poll)
+                now = time.monotonic()
+                for i, slot in enumerate(slots):
+                    if slot.task is None:
+                        continue
+                    if slot.conn in ready:
+                        try:
+                            idx, record = slot.conn.recv()
+                        except (EOFError, OSError):
+                            pass  # died while sending, handled below
+                        else:
+                            slot.task = None
+                            self._save(idx, record, records)
+                            continue
+                    idx, params = slot.task
+                    if not slot.process.is_alive():
+                        attempts[idx] += 1
+                        if attempts[idx] <= self.retries:
+                            pending.appendleft(slot.task)
+                        else:
+                            self._save(idx, {'params': params,
+                                             'status': 'crashed'}, records)
+                    elif (self.timeout is not None
+                          and now - slot.started > self.timeout):
+                        self._save(idx, {'params': params,
+                                         'status': 'timeout',
+                                         'wall_time': now - slot.started},
+                                   records)
+                    else:
+                        continue
+                    slot.task = None
+                    slot.stop(kill=True)
+                    slots[i] = _Slot(self.strategy, self.ohlcv, self.settings)
+        finally:
+            for slot in slots:
+                slot.stop(kill=slot.task is not None)
+            self.store.flush()
+
+    def format_stats(self):
+        stats = super().format_stats()
+        return "{}\nresumed sweep {}: {} stored runs skipped".format(
+            stats, self.sweep_id, self.skipped)
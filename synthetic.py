@@ -0,0 +1,263 @@
+"""Seeded synthetic OHLCV series for scale and stress tests
+
+SyntheticOHLCV generates bars of any ccxt style timeframe ('1m', '4h',
+'1d', ...) from a geometric Brownian motion with:
+
+- volatility regimes: a Markov chain over ``regimes`` volatility
+  multipliers, leaving its regime with probability ``switch`` per bar
+- jumps: ``jumps`` a year on average, log sizes normal(0, ``jumpsize``)
+- gaps: with probability ``gaprate`` a bar starts an outage of
+  ``gapbars`` missing bars on average, the price moves on while no bar
+  is made, so the next bar opens away from the last close
+- zero volume bars: with probability ``zerovolume`` a bar has no trades,
+  open, high, low and close are all the same
+
+Volume is lognormal around ``volume``, higher in the volatile regimes.
+Bars are generated in blocks of BLOCK bars, each from its own random
+stream derived from ``seed`` and the block number, carrying only the
+last close, regime and timestamp over. Memory is one block whatever the
+length, and the same arguments give the same bars, byte for byte.
+
+Bars stream to a Yahoo style CSV (Date,Open,High,Low,Close,Adj
+Close,Volume, dates with a time for intraday timeframes) or to a .npy
+file of the (7, n) feeds.COLUMNS array, one contiguous column per line,
+which read_columns() maps without loading and feeds.ArrayData feeds:
+
+    python synthetic.py 100000000 btc-1m.npy --timeframe 1m --seed 7
+    data = feeds.ArrayData(dataname=read_columns('btc-1m.npy'),
+                           timeframe=bt.TimeFrame.Minutes)
+
+YahooFinanceCSVData reads the date only, read intraday CSV files with
+GenericCSVData (dtformat='%Y-%m-%d %H:%M:%S').
+"""
+import argparse
+import datetime
+import time
+
+import backtrader as bt
+import numpy as np
+
+from feeds import COLUMNS
+from livefeed import parse_timeframe
+
+BLOCK = 1 << 18  # bars per block, part of what the seed gives
+CSV_HEADER = 'Date,Open,High,Low,Close,Adj Close,Volume\n'
+CSV_SLICE = 1 << 15  # rows formatted at once
+EPOCH = datetime.datetime(1970, 1, 1)
+YEAR_MS = 365.25 * 86400000  # bars run around the clock
+
+
+class SyntheticOHLCV:
+    """ ``bars`` bars of ``timeframe`` from ``start``, see the module
+    docstring for the other arguments. ``drift`` and ``volatility`` are
+    annual, of the middle regime.
+    """
+
+    def __init__(self, bars, timeframe='1d',
+                 start=datetime.datetime(2010, 1, 1), seed=0, price=100.0,
+                 drift=0.05, volatility=0.6, regimes=(0.5, 1.0, 2.5),
+                 switch=0.002, jumps=6.0, jumpsize=0.05, gaprate=0.0005,
+                 gapbars=20.0, zerovolume=0.002, volume=1000.0):
+        self.bars = int(bars)
+        self.timeframe = timeframe
+        self.frame, self.compression, self.step = parse_timeframe(timeframe)
+        try:
+            start + datetime.timedelta(milliseconds=self.step * self.bars)
+        except OverflowError:
+            raise ValueError('{} {} bars go past year 9999'.format(
+                self.bars, timeframe))
+        self.start = start
+        self.seed = seed
+        self.price = price
+        self.drift = drift
+        self.volatility = volatility
+        self.regimes = np.asarray(regimes, dtype=np.float64)
+        self.switch = switch
+        self.jumps = jumps
+        self.jumpsize = jumpsize
+        self.gaprate = gaprate
+        self.gapbars = gapbars
+        self.zerovolume = zerovolume
+        self.volume = volume
+
+    def __len__(self):
+        return self.bars
+
+    def _block(self, index, n, state):
+        """ Return (7, n) bars of block ``index`` following ``state``,
+        (last close, regime, last timestamp ms), and the new state
+        """
+        close, regime, stamp = state
+        rng = np.random.default_rng([self.seed, index])
+        dt = self.step / YEAR_MS
+
+        # regime path: a new regime drawn at every switch, kept until the
+        # next one
+        switches = rng.random(n) < self.switch
+        drawn = rng.integers(0, len(self.regimes), n)
+        last = np.maximum.accumulate(np.where(switches, np.arange(n), -1))
+        regimes = np.where(last >= 0, drawn[np.maximum(last, 0)], regime)
+        sigma = self.volatility * self.regimes[regimes]
+
+        # outages: bars missing before a bar, its open moves over them
+        missing = np.where(rng.random(n) < self.gaprate,
+                           rng.geometric(1.0 / self.gapbars, n), 0)
+        gapsigma = sigma * np.sqrt(missing * dt)
+        gaps = ((self.drift - 0.5 * sigma ** 2) * missing * dt
+                + gapsigma * rng.standard_normal(n))
+        jumped = rng.random(n) < self.jumps * dt
+        moves = ((self.drift - 0.5 * sigma ** 2) * dt
+                 + sigma * np.sqrt(dt) * rng.standard_normal(n)
+                 + np.where(jumped, rng.normal(0.0, self.jumpsize, n), 0.0))
+        wicks = sigma * np.sqrt(dt) * np.abs(rng.standard_normal((2, n)))
+        volumes = rng.lognormal(np.log(self.volume), 0.5, n)
+
+        idle = rng.random(n) < self.zerovolume
+        moves[idle] = 0.0
+        wicks[:, idle] = 0.0
+        volumes[idle] = 0.0
+        volumes *= self.regimes[regimes]
+
+        logclose = np.log(close) + np.cumsum(gaps + moves)
+        closes = np.exp(logclose)
+        opens = np.exp(logclose - moves)
+        stamps = stamp + np.cumsum((1 + missing) * self.step)
+
+        bars = np.empty((len(COLUMNS), n))
+        bars[0] = bt.date2num(EPOCH) + stamps / 86400000.0
+        bars[1] = opens
+        bars[2] = np.maximum(opens, closes) * np.exp(wicks[0])
+        bars[3] = np.minimum(opens, closes) * np.exp(-wicks[1])
+        bars[4] = closes
+        bars[5] = volumes
+        bars[6] = 0.0
+        return bars, (closes[-1], regimes[-1], stamps[-1])
+
+    def blocks(self):
+        """ Yields the bars as (7, n) arrays of up to BLOCK bars
+        """
+        start = int((self.start - EPOCH).total_seconds() * 1000)
+        # the first bar closes one step after start
+        state = (self.price, len(self.regimes) // 2, start)
+        for index, first in enumerate(range(0, self.bars, BLOCK)):
+            bars, state = self._block(index, min(BLOCK, self.bars - first),
+                                      state)
+            yield bars
+
+    def array(self):
+        """ Return all bars as one (7, n) array, in memory
+        """
+        bars = np.empty((len(COLUMNS), self.bars))
+        offset = 0
+        for block in self.blocks():
+            bars[:, offset:offset + block.shape[1]] = block
+            offset += block.shape[1]
+        return bars
+
+    def write_csv(self, path):
+        """ Writes the bars to a Yahoo style CSV file, returns bar count
+        """
+        unit = 's' if self.step < 86400000 else 'D'
+        count = 0
+        with open(path, 'w') as f:
+            f.write(CSV_HEADER)
+            for block in self.blocks():
+                # formatted in slices, the rows of a block as Python
+                # objects would be most of the memory used
+                for first in range(0, block.shape[1], CSV_SLICE):
+                    bars = block[:, first:first + CSV_SLICE]
+                    stamps = (bars[0] - bt.date2num(EPOCH)) * 86400000.0
+                    dates = np.datetime_as_string(
+                        np.round(stamps).astype('datetime64[ms]'), unit=unit)
+                    if unit == 's':
+                        dates = np.char.replace(dates, 'T', ' ')
+                    rows = zip(dates.tolist(), *(bars[i].tolist()
+                                                 for i in range(1, 6)))
+                    f.writelines(
+                        '{},{:.10g},{:.10g},{:.10g},{:.10g},{:.10g},{:.4f}\n'
+                        .format(date, o, h, l, c, c, v)
+                        for date, o, h, l, c, v in rows)
+                count += block.shape[1]
+        return count
+
+    def write_columns(self, path):
+        """ Writes the bars to a .npy file of the (7, n) array, column by
+        column, returns bar count
+        """
+        count = 0
+        with open(path, 'wb') as f:
+            np.lib.format.write_array_header_1_0(f, {
+                'descr': np.lib.format.dtype_to_descr(np.dtype('<f8')),
+                'fortran_order': False,
+                'shape': (len(COLUMNS), self.bars)})
+            header = f.tell()
+            for bars in self.blocks():
+                for row in range(len(COLUMNS)):
+                    f.seek(header + 8 * (row * self.bars + count))
+                    bars[row].astype('<f8').tofile(f)
+                count += bars.shape[1]
+        return count
+
+
+def read_columns(path):
+    """ Return the (7, n) bars of a .npy file as a read-only memmap
+    """
+    return np.load(path, mmap_mode='r')
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description='Seeded synthetic OHLCV series')
+    parser.add_argument('bars', type=float,
+                        help='Number of bars, e.g. 1e8')
+    parser.add_argument('output',
+                        help='.csv for Yahoo style CSV, .npy for columns')
+    parser.add_argument('--timeframe', default='1d',
+                        help='Bar timeframe, e.g. 1m, 4h, 1d')
+    parser.add_argument('--start', default='2010-01-01',
+                        help='Starting date in YYYY-MM-DD format')
+    parser.add_argument('--seed', type=int, default=0, help='Random seed')
+    parser.add_argument('--price', type=float, default=100.0,
+                        help='Starting price')
+    parser.add_argument('--drift', type=float, default=0.05,
+                        help='Annual drift')
+    parser.add_argument('--volatility', type=float, default=0.6,
+                        help='Annual volatility of the middle regime')
+    parser.add_argument('--regimes', type=float, nargs='+',
+                        default=[0.5, 1.0, 2.5],
+                        help='Volatility multipliers of the regimes')
+    parser.add_argument('--switch', type=float, default=0.002,
+                        help='Probability per bar of a regime switch')
+    parser.add_argument('--jumps', type=float, default=6.0,
+                        help='Jumps per year')
+    parser.add_argument('--jumpsize', type=float, default=0.05,
+                        help='Standard deviation of the log jump size')
+    parser.add_argument('--gaprate', type=float, default=0.0005,
+                        help='Probability per bar of an outage before it')
+    parser.add_argument('--gapbars', type=float, default=20.0,
+                        help='Mean missing bars of an outage')
+    parser.add_argument('--zerovolume', type=float, default=0.002,
+                        help='Probability of a bar with no volume')
+    parser.add_argument('--volume', type=float, default=1000.0,
+                        help='Median volume per bar')
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    args = parse_args()
+    synthetic = SyntheticOHLCV(
+        args.bars, timeframe=args.timeframe,
+        start=datetime.datetime.strptime(args.start, '%Y-%m-%d'),
+        seed=args.seed, price=args.price, drift=args.drift,
+        volatility=args.volatility, regimes=args.regimes,
+        switch=args.switch, jumps=args.jumps, jumpsize=args.jumpsize,
+        gaprate=args.gaprate, gapbars=args.gapbars,
+        zerovolume=args.zerovolume, volume=args.volume)
+    begin = time.perf_counter()
+    if args.output.endswith('.npy'):
+        count = synthetic.write_columns(args.output)
+    else:
+        count = synthetic.write_csv(args.output)
+    elapsed = time.perf_counter() - begin
+    print("{} {} bars written to {} in {:.2f}s, {:.0f} bars/s".format(
+        count, args.timeframe, args.output, elapsed, count / elapsed))
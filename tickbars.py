@@ -0,0 +1,315 @@
+"""Bars aggregated from trades, for tick history replay and live trades
+
+A trade is (timestamp in epoch ms, price, size). Trades are aggregated
+into bars of one of three kinds:
+
+- time: all trades of an interval (e.g. '1m', '1h', as ccxt timeframes),
+  stamped with the last millisecond of the interval, as backtrader's
+  resampler stamps session ends, so a daily bar keeps its day
+- volume: a bar every ``size`` units traded, the trade crossing a
+  multiple of ``size`` of the cumulative volume closes its bar
+- tick: a bar every ``size`` trades
+
+volume and tick bars are stamped with their last trade. A bar is complete
+once a trade of a later bar arrives, the last bar of a stream is emitted
+at its end. Only the bar being built is kept, whatever the bar size.
+
+Tick files are a 16 byte header followed by packed (int64 ms, float64
+price, float64 size) records, 24 bytes per trade, appendable and mapped
+without parsing. aggregate_file() replays one in chunks with NumPy, at
+tens of millions of trades per second; BarAggregator.add() takes live
+trades one at a time and gives the same bars (volumes summed in another
+order may differ in the last bits). TickBarData feeds either to Cerebro:
+
+    data = TickBarData(dataname='btcusd.ticks', bartype='volume',
+                       barsize=50)
+
+    python tickbars.py convert trades.csv btcusd.ticks
+    python tickbars.py bench btcusd.ticks --bars time:1m
+"""
+import argparse
+import time
+
+import backtrader as bt
+import numpy as np
+
+from livefeed import ms2num, parse_timeframe
+
+MAGIC = b'BTTICKS1'
+HEADER = 16
+TICK_DTYPE = np.dtype([('ts', '<i8'), ('price', '<f8'), ('size', '<f8')])
+BAR_FIELDS = ('datetime', 'open', 'high', 'low', 'close', 'volume',
+              'count')
+BARTYPES = ('time', 'volume', 'tick')
+
+
+def write_ticks(path, ts, price, size, append=False):
+    """ Writes (or appends) trades to a tick file
+    """
+    ticks = np.empty(len(ts), dtype=TICK_DTYPE)
+    ticks['ts'] = ts
+    ticks['price'] = price
+    ticks['size'] = size
+    with open(path, 'ab' if append else 'wb') as f:
+        if not append or f.tell() == 0:
+            f.write(MAGIC.ljust(HEADER, b'\0'))
+        ticks.tofile(f)
+
+
+def read_ticks(path):
+    """ Return the trades of a tick file as a read-only memmap
+    """
+    with open(path, 'rb') as f:
+        if f.read(len(MAGIC)) != MAGIC:
+            raise ValueError('{} is not a tick file'.format(path))
+    return np.memmap(path, dtype=TICK_DTYPE, mode='r', offset=HEADER)
+
+
+def parse_bars(text):
+    """ Return (bartype, barsize) of 'time:1m', 'volume:50' or 'tick:100'
+    """
+    bartype, _, size = text.partition(':')
+    if bartype not in BARTYPES:
+        raise ValueError('bar type must be one of {}'.format(BARTYPES))
+    if bartype == 'time':
+        return bartype, size
+    return bartype, float(size) if bartype == 'volume' else int(size)
+
+
+class BarAggregator:
+    """ Builds ``bartype`` bars of ``barsize`` (a timeframe string for time
+    bars) from trades, see the module docstring
+
+    add() takes one trade and returns the bar it completed or None,
+    add_arrays() a chunk of trades and returns the completed bars as a
+    dict of arrays (BAR_FIELDS). flush() returns the bar being built.
+    Bars are (datetime ms, open, high, low, close, volume, count) tuples.
+    """
+
+    def __init__(self, bartype='time', barsize='1m'):
+        if bartype not in BARTYPES:
+            raise ValueError('bar type must be one of {}'.format(BARTYPES))
+        self.bartype = bartype
+        if bartype == 'time':
+            _, _, barsize = parse_timeframe(barsize)
+        self.barsize = barsize
+        self.bar = None  # [id, end, open, high, low, close, volume, count]
+        self.cumvolume = 0.0
+        self.trades = 0
+
+    def _ids(self, ts, size):
+        """ Return bar id of each trade of a chunk
+        """
+        if self.bartype == 'time':
+            return ts // self.barsize
+        if self.bartype == 'tick':
+            return (self.trades + np.arange(len(ts))) // self.barsize
+        # cumulative volume before each trade, accumulated sequentially
+        # like add() does
+        cum = np.cumsum(np.r_[self.cumvolume, size])
+        return np.floor_divide(cum[:-1], self.barsize).astype(np.int64)
+
+    def _stamp(self, barid, ts):
+        if self.bartype == 'time':
+            return (barid + 1) * self.barsize - 1
+        return ts
+
+    def add(self, ts, price, size):
+        if self.bartype == 'time':
+            barid = ts // self.barsize
+        elif self.bartype == 'tick':
+            barid = self.trades // self.barsize
+        else:
+            barid = int(self.cumvolume // self.barsize)
+        self.trades += 1
+        self.cumvolume += size
+        bar = self.bar
+        if bar is not None and bar[0] == barid:
+            bar[1] = self._stamp(barid, ts)
+            if price > bar[3]:
+                bar[3] = price
+            if price < bar[4]:
+                bar[4] = price
+            bar[5] = price
+            bar[6] += size
+            bar[7] += 1
+            return None
+        self.bar = [barid, self._stamp(barid, ts), price, price, price,
+                    price, size, 1]
+        return None if bar is None else tuple(bar[1:])
+
+    def flush(self):
+        bar, self.bar = self.bar, None
+        return None if bar is None else tuple(bar[1:])
+
+    def add_arrays(self, ts, price, size):
+        if not len(ts):
+            return {field: np.empty(0) for field in BAR_FIELDS}
+        ids = self._ids(ts, size)
+        self.trades += len(ts)
+        if self.bartype == 'volume':
+            self.cumvolume = float(np.cumsum(np.r_[self.cumvolume, size])[-1])
+        starts = np.flatnonzero(np.r_[True, ids[1:] != ids[:-1]])
+        ends = np.r_[starts[1:], len(ids)]
+        bars = {
+            'datetime': (self._stamp(ids[starts], None)
+                         if self.bartype == 'time' else ts[ends - 1]),
+            'open': price[starts],
+            'high': np.maximum.reduceat(price, starts),
+            'low': np.minimum.reduceat(price, starts),
+            'close': price[ends - 1],
+            'volume': np.add.reduceat(size, starts),
+            'count': ends - starts,
+        }
+        bars = {field: np.asarray(values, dtype=np.float64)
+                for field, values in bars.items()}
+        carry = self.bar
+        if carry is not None:
+            if carry[0] == ids[0]:  # first bar continues the carried one
+                bars['open'][0] = carry[2]
+                bars['high'][0] = max(carry[3], bars['high'][0])
+                bars['low'][0] = min(carry[4], bars['low'][0])
+                bars['volume'][0] += carry[6]
+                bars['count'][0] += carry[7]
+            else:
+                for field, value in zip(BAR_FIELDS, carry[1:]):
+                    bars[field] = np.r_[value, bars[field]]
+        # the last bar stays open for the next chunk
+        self.bar = [ids[-1]] + [bars[field][-1] for field in BAR_FIELDS]
+        return {field: values[:-1] for field, values in bars.items()}
+
+
+def aggregate_file(path, bartype='time', barsize='1m', chunk=1 << 20,
+                   start=0, stop=None):
+    """ Yields dicts of bar arrays for the trades of a tick file, read
+    ``chunk`` trades at a time, the last bar included
+    """
+    ticks = read_ticks(path)[start:stop]
+    aggregator = BarAggregator(bartype, barsize)
+    for i in range(0, len(ticks), chunk):
+        block = ticks[i:i + chunk]
+        bars = aggregator.add_arrays(np.asarray(block['ts']),
+                                     np.asarray(block['price']),
+                                     np.asarray(block['size']))
+        if len(bars['open']):
+            yield bars
+    last = aggregator.flush()
+    if last is not None:
+        yield {field: np.array([value], dtype=np.float64)
+               for field, value in zip(BAR_FIELDS, last)}
+
+
+def aggregate_trades(trades, bartype='time', barsize='1m', flush=True):
+    """ Yields bar tuples from an iterable of (ts, price, size) trades as
+    they complete, e.g. from a live trade stream
+    """
+    aggregator = BarAggregator(bartype, barsize)
+    for ts, price, size in trades:
+        bar = aggregator.add(ts, price, size)
+        if bar is not None:
+            yield bar
+    if flush:
+        bar = aggregator.flush()
+        if bar is not None:
+            yield bar
+
+
+class TickBarData(bt.feed.DataBase):
+    """ Feeds bars aggregated from trades: ``dataname`` is a tick file
+    path, replayed in chunks, or an iterable of (ts, price, size) trades
+    aggregated one by one. ``bartype`` and ``barsize`` as BarAggregator,
+    the trade count of a bar goes to openinterest.
+    """
+    params = (
+        ('bartype', 'time'),
+        ('barsize', '1m'),
+        ('chunk', 1 << 20),
+    )
+
+    def start(self):
+        super().start()
+        if self.p.bartype == 'time':
+            self._timeframe, self._compression, _ = parse_timeframe(
+                self.p.barsize)
+        else:
+            self._timeframe = bt.TimeFrame.Ticks
+            self._compression = 1
+        if isinstance(self.p.dataname, str):
+            chunks = aggregate_file(self.p.dataname, self.p.bartype,
+                                    self.p.barsize, chunk=self.p.chunk)
+            self._bars = (tuple(row) for bars in chunks
+                          for row in zip(*(bars[f].tolist()
+                                           for f in BAR_FIELDS)))
+        else:
+            self._bars = aggregate_trades(self.p.dataname, self.p.bartype,
+                                          self.p.barsize)
+
+    def _load(self):
+        bar = next(self._bars, None)
+        if bar is None:
+            return False
+        dt, o, h, l, c, v, n = bar
+        lines = self.lines
+        lines.datetime[0] = ms2num(dt)
+        lines.open[0] = o
+        lines.high[0] = h
+        lines.low[0] = l
+        lines.close[0] = c
+        lines.volume[0] = v
+        lines.openinterest[0] = n
+        return True
+
+
+def convert_csv(src, dst, ts='timestamp', price='price', size='amount',
+                chunksize=1 << 20):
+    """ Writes the trades of a CSV (ms timestamps or date strings) to a
+    tick file, ``chunksize`` rows at a time, returns the trade count
+    """
+    import pandas as pd
+    count = 0
+    for frame in pd.read_csv(src, usecols=[ts, price, size],
+                             chunksize=chunksize):
+        stamps = frame[ts]
+        if stamps.dtype == object:
+            stamps = pd.to_datetime(stamps).astype('int64') // 1000000
+        write_ticks(dst, stamps.values, frame[price].values,
+                    frame[size].values, append=count > 0)
+        count += len(frame)
+    return count
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description='Tick files and bars aggregated from trades')
+    sub = parser.add_subparsers(dest='command')
+    convert = sub.add_parser('convert', help='CSV of trades to tick file')
+    convert.add_argument('csv')
+    convert.add_argument('ticks')
+    convert.add_argument('--ts', default='timestamp',
+                         help='Timestamp column, epoch ms or dates')
+    convert.add_argument('--price', default='price', help='Price column')
+    convert.add_argument('--size', default='amount', help='Size column')
+    bench = sub.add_parser('bench', help='Aggregation throughput of a file')
+    bench.add_argument('ticks')
+    bench.add_argument('--bars', default='time:1m',
+                       help='time:TIMEFRAME, volume:SIZE or tick:COUNT')
+    bench.add_argument('--chunk', type=int, default=1 << 20,
+                       help='Trades per chunk')
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    args = parse_args()
+    if args.command == 'convert':
+        count = convert_csv(args.csv, args.ticks, ts=args.ts,
+                            price=args.price, size=args.size)
+        print("{} trades written to {}".format(count, args.ticks))
+    elif args.command == 'bench':
+        bartype, barsize = parse_bars(args.bars)
+        trades = len(read_ticks(args.ticks))
+        begin = time.perf_counter()
+        nbars = sum(len(bars['open']) for bars in aggregate_file(
+            args.ticks, bartype, barsize, chunk=args.chunk))
+        elapsed = time.perf_counter() - begin
+        print("{} trades -> {} {} bars in {:.3f}s, {:.0f} trades/s".format(
+            trades, nbars, args.bars, elapsed, trades / elapsed))
@@ -5,12 +5,16 @@ from __future__ import (
     unicode_literals,
 )
 
+import argparse
 import datetime
 import os
 import sys
 
 import backtrader as bt
+
 from models import LineMemory
+from stratlog import DEBUG, INFO, WARNING, configure, get_logger
+from tickbars import TickBarData, parse_bars
 
 
 class Strategy(bt.Strategy):
@@ -37,6 +41,7 @@ class Strategy(bt.Strategy):
     will_long_close_55 = False
 
     def __init__(self):
+        self.logger = get_logger(type(self).__name__)
         self.highs = []
         self.lows = []
         self.highs.append(LineMemory(20))
@@ -56,9 +61,10 @@ class Strategy(bt.Strategy):
             self.datas[0], period=self.average_period
         )
 
-    def log(self, msg, dt=None):
-        dt = dt or self.datas[0].datetime.date(0)
-        print("{}, {}".format(dt.isoformat(), msg))
+    def log(self, msg, *args, level=INFO, **fields):
+        if level >= self.logger.level:
+            self.logger.log(level, msg, *args,
+                            dt=self.datas[0].datetime[0], **fields)
 
     def notify_order(self, order):
         if order.status in [order.Submitted, order.Accepted]:
@@ -67,21 +73,19 @@ class Strategy(bt.Strategy):
         if order.status in [order.Completed]:
             if order.isbuy():
                 self.log(
-                    "BUY, price: {}, cost: {}, comm: {}".format(
-                        order.executed.price,
-                        order.executed.value,
-                        order.executed.comm,
-                    )
+                    "BUY, price: {}, cost: {}, comm: {}",
+                    order.executed.price,
+                    order.executed.value,
+                    order.executed.comm,
                 )
                 self.buyprice = order.executed.price
                 self.buycomm = order.executed.comm
             elif order.issell():
                 self.log(
-                    "SELL, price: {}, cost: {}, comm: {}".format(
-                        order.executed.price,
-                        order.executed.value,
-                        order.executed.comm,
-                    )
+                    "SELL, price: {}, cost: {}, comm: {}",
+                    order.executed.price,
+                    order.executed.value,
+                    order.executed.comm,
                 )
             self.bar_executed = len(self)
         elif order.status in [order.Canceled, order.Margin, order.Rejected]:
@@ -99,18 +103,23 @@ class Strategy(bt.Strategy):
         else:
             self.losses += 1
             self.gross_losses -= trade.pnl
-        self.percent_profitable = self.wins / self.total_trades
-        self.profit_factor = self.gross_profits / self.gross_losses
+        if self.total_trades:
+            self.percent_profitable = self.wins / self.total_trades
+        if self.gross_losses != 0:
+            self.profit_factor = self.gross_profits / self.gross_losses
+        else:
+            self.profit_factor = self.gross_profits / 1
 
-        self.log("PROFIT, gross: {}, net: {}".format(trade.pnl, trade.pnlcomm))
+        self.log("PROFIT, gross: {}, net: {}", trade.pnl, trade.pnlcomm)
 
     def next(self):
-        self.log("Today's Open: {}, High: {}, Low: {}, Close: {}, ".format(
-            self.data_open[0],
-            self.data_high[0],
-            self.data_low[0],
-            self.dataclose[0],
-        ))
+        if self.logger.isdebug:
+            self.log("Today's Open: {}, High: {}, Low: {}, Close: {}, ",
+                     self.data_open[0],
+                     self.data_high[0],
+                     self.data_low[0],
+                     self.dataclose[0],
+                     level=DEBUG)
 
         for item in self.highs:
             item.push(self.data_high[0]) # self.dataclose[0]
@@ -121,12 +130,12 @@ class Strategy(bt.Strategy):
             self.high_20_count + self.high_55_count > 2
             or self.high_20_count + self.high_55_count < 0
         ):
-            print("SHIT bad number of long entries")
+            self.log("SHIT bad number of long entries", level=WARNING)
         if (
             self.low_20_count + self.low_55_count > 2
             or self.low_20_count + self.low_55_count < 0
         ):
-            print("SHIT bad number of short entries")
+            self.log("SHIT bad number of short entries", level=WARNING)
 
         self.will_short_close = False
         self.will_short_close_20 = False
@@ -134,7 +143,8 @@ class Strategy(bt.Strategy):
         self.will_long_close = False
         self.will_long_close_20 = False
         self.will_long_close_55 = False
-        print(self.position.size)
+        if self.logger.isdebug:
+            self.log("Position size: {}", self.position.size, level=DEBUG)
         if self.order:
             return
 
@@ -160,14 +170,14 @@ class Strategy(bt.Strategy):
                 and not self.high_20_count
             ):
                 self.high_20_count += 1
-                self.log("LONG, {} 20 day entry".format(self.dataclose[0]))
+                self.log("LONG, {} 20 day entry", self.dataclose[0])
                 self.order = self.buy()
 
             if self.will_long_close_20:
                 self.total_trades += 1
                 self.high_20_count = 0
                 self.high_55_count = 0
-                self.log("LONG CLOSE, {} 10 day low".format(self.dataclose[0]))
+                self.log("LONG CLOSE, {} 10 day low", self.dataclose[0])
                 self.order = self.close()
 
             if len(self) > 55:
@@ -192,14 +202,14 @@ class Strategy(bt.Strategy):
                     if self.position.size < 0 and not self.will_short_close:
                         self.order = self.close()
                     self.high_55_count += 1
-                    self.log("LONG, {} 55 day entry".format(self.dataclose[0]))
+                    self.log("LONG, {} 55 day entry", self.dataclose[0])
                     self.order = self.buy()
 
                 if self.will_long_close_55:
                     self.total_trades += 1
                     self.high_20_count = 0
                     self.high_55_count = 0
-                    self.log("LONG CLOSE, {} 20 day low".format(self.dataclose[0]))
+                    self.log("LONG CLOSE, {} 20 day low", self.dataclose[0])
                     self.order = self.close()
 
             if (
@@ -207,14 +217,14 @@ class Strategy(bt.Strategy):
                 and not self.low_20_count
             ):
                 self.low_20_count += 1
-                self.log("SHORT, {} 20 day low".format(self.dataclose[0]))
+                self.log("SHORT, {} 20 day low", self.dataclose[0])
                 self.order = self.sell()
 
             if self.will_short_close_20:
                 self.total_trades += 1
                 self.low_20_count = 0
                 self.low_55_count = 0
-                self.log("SHORT CLOSE, {} 10 day high".format(self.dataclose[0]))
+                self.log("SHORT CLOSE, {} 10 day high", self.dataclose[0])
                 self.order = self.close()
             if len(self) > 55:
                 if (
@@ -224,14 +234,14 @@ class Strategy(bt.Strategy):
                     if self.position.size > 0 and not self.will_long_close:
                         self.order = self.close()
                     self.low_55_count += 1
-                    self.log("SHORT, {} 55 day low".format(self.dataclose[0]))
+                    self.log("SHORT, {} 55 day low", self.dataclose[0])
                     self.order = self.sell()
 
                 if self.will_short_close_55:
                     self.total_trades += 1
                     self.low_20_count = 0
                     self.low_55_count = 0
-                    self.log("SHORT CLOSE, {} 20 day high".format(self.dataclose[0]))
+                    self.log("SHORT CLOSE, {} 20 day high", self.dataclose[0])
                     self.order = self.close()
 
     def stop(self):
@@ -241,18 +251,43 @@ class Strategy(bt.Strategy):
         super().stop()
 
 if __name__ == '__main__':
-    cerebro = bt.Cerebro()
+    # orders and trades on stdout, bar by bar detail with BT_LOGLEVEL=DEBUG
+    configure(level=os.environ.get('BT_LOGLEVEL', 'INFO'))
+
+    parser = argparse.ArgumentParser(description='Turtle strategy backtest')
+    parser.add_argument('--ticks', default=None, metavar='PATH',
+                        help='Run on bars aggregated from a tick file '
+                             'instead of the daily candles')
+    parser.add_argument('--bars', default='time:1d',
+                        help='With --ticks, time:TIMEFRAME, volume:SIZE or '
+                             'tick:COUNT bars')
+    parser.add_argument('--longrun', default=None, metavar='DIR',
+                        help='Bounded memory run streaming equity and '
+                             'trades to DIR, no plot')
+    args = parser.parse_args()
+
+    if args.longrun:
+        # Strategy needs no Lookback, next() reads the current bar only
+        from longrun import LongRunCerebro
+        cerebro = LongRunCerebro(args.longrun)
+    else:
+        cerebro = bt.Cerebro()
     cerebro.addstrategy(Strategy)
 
     root_dir = os.path.dirname(os.path.abspath(sys.argv[0]))
     data_file = os.path.join(root_dir, 'YHF-BTC-USD.csv')
 
-    data = bt.feeds.YahooFinanceCSVData(
-        dataname=data_file,
-        fromdate=datetime.datetime(2012, 1, 1),
-        todate=datetime.datetime(2019, 12, 14),
-        #reverse=False
-    )
+    if args.ticks:
+        bartype, barsize = parse_bars(args.bars)
+        data = TickBarData(dataname=args.ticks, bartype=bartype,
+                           barsize=barsize)
+    else:
+        data = bt.feeds.YahooFinanceCSVData(
+            dataname=data_file,
+            fromdate=datetime.datetime(2012, 1, 1),
+            todate=datetime.datetime(2019, 12, 14),
+            #reverse=False
+        )
 
     cerebro.adddata(data)
     cerebro.broker.setcash(100000.0)
@@ -264,5 +299,8 @@ if __name__ == '__main__':
     final_value = cerebro.broker.getvalue()
     print("Final Cash: {}".format(final_value))
     print("Net Profit: {}".format(final_value - initial_value))
-    cerebro.plot()
+    if args.longrun:
+        print("Equity and trades written to {}".format(args.longrun))
+    else:
+        cerebro.plot()
 
@@ -0,0 +1,235 @@
+"""Walk-forward optimization with a stitched out-of-sample equity curve
+
+The bars are split into train/test windows, rolling (fixed length train
+windows moving forward) or anchored (train windows all starting at the
+first bar). The params of a grid are run on every train window, the best
+of each window is then run on the window that follows it, and the test
+windows are stitched into one out-of-sample equity curve.
+
+All runs of all folds go through one optimize.GridRunner, so folds run in
+parallel. Windows are start/stop bounds on the SharedOHLCV bars, no fold
+copies data. ``warmup`` bars before each test window are fed to let
+indicators fill up, only returns from the test window on are kept.
+"""
+import math
+
+import numpy as np
+import pandas as pd
+
+from analyzers import EquityRecorder, TradeRecorder, num2index
+from optimize import GridRunner, record_score, strategy_metrics
+
+OOS_ANALYZERS = ((EquityRecorder, {'_name': 'wfEquity'}),
+                 (TradeRecorder, {'_name': 'wfTrades'}))
+
+
+def windows(nbars, train, test, anchored=False, step=None):
+    """ Return list of (train_start, train_stop, test_start, test_stop)
+    bar bounds, test windows follow each other every ``step`` bars
+    (default ``test``)
+    """
+    step = step or test
+    folds = []
+    test_start = train
+    while test_start < nbars:
+        train_start = 0 if anchored else test_start - train
+        folds.append((train_start, test_start, test_start,
+                      min(test_start + test, nbars)))
+        test_start += step
+    return folds
+
+
+def oos_metrics(strat):
+    """ Metrics of a test window run: the usual ones plus the recorded
+    equity and trades
+    """
+    metrics = strategy_metrics(strat)
+    metrics['equity'] = strat.analyzers.wfEquity.get_analysis()
+    trades = strat.analyzers.wfTrades.get_analysis()
+    metrics['trades'] = trades['closed']
+    metrics['opened'] = trades['opened']
+    return metrics
+
+
+def performance_stats(recorded, pnls, start_cash, total_trades,
+                      riskfree=0.01):
+    """ Return PerformanceReport kpis computed from an equity DataFrame
+    and the net pnls of the closed trades
+    """
+    value = recorded['value']
+    pnls = np.asarray(pnls, dtype=np.float64)
+    won, lost = pnls[pnls >= 0.0], pnls[pnls < 0.0]
+    closed = len(pnls)
+    rpl = pnls.sum()  # realized, as TradeAnalyzer's pnl.net.total
+    total_return = rpl / start_cash
+    days = (recorded.index[-1] - recorded.index[0]).days
+    peak = value.cummax()
+    # monthly sharpe like bt.analyzers.SharpeRatio(timeframe=Months)
+    monthly = pd.concat([pd.Series([start_cash]),
+                         value.resample('M').last().dropna()],
+                        ignore_index=True).pct_change().dropna()
+    excess = monthly - ((1.0 + riskfree) ** (1.0 / 12) - 1.0)
+    sharpe = (excess.mean() / excess.std(ddof=0)
+              if len(excess) > 1 and excess.std(ddof=0) else None)
+    sqn = (math.sqrt(closed) * pnls.mean() / pnls.std()
+           if closed > 1 and pnls.std() else 0.0)
+
+    def pct(count):
+        return 100.0 * count / closed if closed else None
+
+    return {'start_cash': start_cash,
+            'rpl': rpl,
+            'result_won_trades': won.sum(),
+            'result_lost_trades': lost.sum(),
+            'profit_factor': (-won.sum() / lost.sum() if len(lost)
+                              else None),
+            'rpl_per_trade': rpl / closed if closed else None,
+            'total_return': 100 * total_return,
+            'annual_return': (100 * (1 + total_return) ** (365.25 / days)
+                              - 100 if days > 0 else None),
+            'max_money_drawdown': (peak - value).max(),
+            'max_pct_drawdown': (100 * (peak - value) / peak).max(),
+            'total_number_trades': int(total_trades),
+            'trades_closed': closed,
+            'pct_winning': pct(len(won)),
+            'pct_losing': pct(len(lost)),
+            'avg_money_winning': won.mean() if len(won) else None,
+            'avg_money_losing': lost.mean() if len(lost) else None,
+            'best_winning_trade': won.max() if len(won) else None,
+            'worst_losing_trade': lost.min() if len(lost) else None,
+            'sharpe_ratio': sharpe,
+            'sqn_score': sqn}
+
+
+class WalkForward:
+    """ Walk-forward optimization of strategy over the params dicts of grid
+
+    ``train``, ``test`` and ``step`` are window lengths in bars, ``key``
+    the record metric picking the best params of a train window,
+    ``settings`` go to GridRunner (workers, cash, commission, sizer, ...).
+    After run(), ``folds`` holds a dict per window with its bounds, best
+    params, train and test records.
+    """
+
+    def __init__(self, strategy, ohlcv, grid, train, test, anchored=False,
+                 step=None, warmup=0, key='final_value', **settings):
+        self.strategy = strategy
+        self.ohlcv = ohlcv
+        self.grid = list(grid)
+        self.bounds = windows(len(ohlcv), train, test, anchored=anchored,
+                              step=step)
+        self.warmup = warmup
+        self.key = key
+        self.cash = settings.get('cash', 100000.0)
+        self.runner = GridRunner(strategy, ohlcv, errors='record',
+                                 **settings)
+        self.folds = []
+        self._recorded = None
+        self._pnls = None
+
+    def _score(self, record):
+        return record_score(record, self.key)
+
+    def run(self):
+        """ Optimizes every train window, runs the winners on their test
+        windows, returns the list of folds
+        """
+        if not self.bounds:
+            raise ValueError('{} bars are too few for the train window'
+                             .format(len(self.ohlcv)))
+        runs = [(params, {'start': a, 'stop': b})
+                for a, b, _, _ in self.bounds for params in self.grid]
+        records = self.runner.run_many(runs)
+        size = len(self.grid)
+        self.folds = []
+        tests = []
+        for i, (a, b, c, d) in enumerate(self.bounds):
+            train = max(records[i * size:(i + 1) * size], key=self._score)
+            self.folds.append({'fold': i, 'train': (a, b), 'test': (c, d),
+                               'params': train['params'], 'train_record':
+                               train})
+            tests.append((train['params'],
+                          {'start': max(0, c - self.warmup), 'stop': d,
+                           'analyzers': OOS_ANALYZERS,
+                           'metrics': oos_metrics}))
+        for fold, record in zip(self.folds, self.runner.run_many(tests)):
+            fold['test_record'] = record
+        self._recorded = None
+        return self.folds
+
+    def _stitch(self):
+        datetimes = self.ohlcv.arrays[0]
+        frames, pnls = [], []
+        equity = self.cash
+        total_trades = 0
+        for fold in self.folds:
+            record = fold['test_record']
+            if record['status'] != 'ok':
+                raise RuntimeError('test run of fold {} failed:\n{}'.format(
+                    fold['fold'], record.get('error')))
+            start_dt = datetimes[fold['test'][0]]
+            curve = record['equity']
+            keep = curve['datetime'] >= start_dt
+            value = curve['value'][keep]
+            if not len(value):
+                continue
+            # value at the end of the warmup, or starting cash
+            before = curve['value'][~keep]
+            base = before[-1] if len(before) else self.cash
+            scale = equity / base
+            frames.append(pd.DataFrame(
+                {'value': value * scale, 'cash': curve['cash'][keep] * scale,
+                 'open': curve['open'][keep]},
+                index=num2index(curve['datetime'][keep])))
+            pnls.extend(pnlcomm * scale for dt, _, pnlcomm
+                        in record['trades'] if dt >= start_dt)
+            total_trades += record['opened']
+            equity = value[-1] * scale
+        self._recorded = pd.concat(frames)
+        self._pnls = pnls
+        self._total_trades = total_trades
+
+    def get_recorded(self):
+        """ Return stitched out-of-sample DataFrame with the value, cash
+        and open columns of EquityRecorder
+        """
+        if self._recorded is None:
+            self._stitch()
+        return self._recorded
+
+    def get_performance_stats(self):
+        recorded = self.get_recorded()
+        return performance_stats(recorded, self._pnls, self.cash,
+                                 self._total_trades)
+
+    def report(self, outputdir, infilename=None, user=None, memo=None):
+        """ Renders the out-of-sample PerformanceReport, returns its path
+        """
+        from cache import CachedResult
+        from report import CachedReport
+        params = {'fold {} {}'.format(f['fold'], f['test']): f['params']
+                  for f in self.folds}
+        meta = {'strategy_name': 'Walk-forward ' + self.strategy.__name__,
+                'params': params, 'start_cash': self.cash}
+        entry = CachedResult(None, self.get_performance_stats(),
+                             self.get_recorded(), meta)
+        rpt = CachedReport(entry, infilename=infilename,
+                           outputdir=outputdir, user=user, memo=memo)
+        entry.kpis['sqn_human'] = rpt._sqn2rating(entry.kpis['sqn_score'])
+        return rpt.generate_pdf_report()
+
+    def format_folds(self):
+        """ Return table of the folds: windows, params, train and test
+        results by key
+        """
+        lines = ["{:>4} {:>13} {:>13} {:>14} {:>14}  {}".format(
+            'fold', 'train', 'test', 'train ' + self.key,
+            'test ' + self.key, 'params')]
+        for fold in self.folds:
+            test = fold.get('test_record', {})
+            lines.append("{:>4} {:>13} {:>13} {:>14.2f} {:>14.2f}  {}".format(
+                fold['fold'], '{}-{}'.format(*fold['train']),
+                '{}-{}'.format(*fold['test']),
+                self._score(fold['train_record']),
+                test.get(self.key, float('nan')), fold['params']))
+        return '\n'.join(lines)